@@ -72,23 +72,101 @@ ISSUE SEEMS TO BE RESOLVED FROM MICROSOFT IN NEWER EXCEL VERSIONS.
 import os
 import sys
 import gzip
-import re
 import time
+import json
+import collections
+import contextlib
+import gc
+import threading
+import tracemalloc
+import array
+import bisect
+import hashlib
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
-from tkinter import *
-from tkinter import filedialog
-
-import numpy as np
-import pandas as pd
+import fast_gzip
+import record_store
+
+# tkinter, NumPy, and pandas are only imported where they are needed (the GUI is in
+# annotator_gui.py and the tables are in annotation_tables.py) so that importing
+# this module is quick and has no side effects (e.g. for lookups from scripts)
+
+# bump when parsed objects change so older cache files are not used
+CACHE_VERSION = 8
+
+# ways of keeping the loaded annotations in memory (see AnnotationStore)
+STORE_LAYOUTS = ['objects', 'columnar', 'disk']
+
+# optional field groups (the basic fields are always parsed); each group is parsed
+# and cached separately so that only the annotations that are used get parsed
+FIELD_GROUPS = ['keywords', 'go', 'pathways', 'mgi', 'features', 'sequence', 'comments']
+
+# CC comment topics shown as table columns by the Comments option (every topic is parsed)
+COMMENT_TOPICS = ['FUNCTION', 'SUBCELLULAR LOCATION', 'TISSUE SPECIFICITY', 'DISEASE']
+
+# UniProt sequence feature (FT line) types; codes are positions in this list
+FEATURE_TYPES = ['INIT_MET', 'SIGNAL', 'PROPEP', 'TRANSIT', 'CHAIN', 'PEPTIDE', 'TOPO_DOM',
+                 'TRANSMEM', 'INTRAMEM', 'DOMAIN', 'REPEAT', 'CA_BIND', 'ZN_FING', 'DNA_BIND',
+                 'NP_BIND', 'REGION', 'COILED', 'MOTIF', 'COMPBIAS', 'ACT_SITE', 'METAL',
+                 'BINDING', 'SITE', 'NON_STD', 'MOD_RES', 'LIPID', 'CARBOHYD', 'DISULFID',
+                 'CROSSLNK', 'VAR_SEQ', 'VARIANT', 'MUTAGEN', 'UNSURE', 'CONFLICT', 'NON_CONS',
+                 'NON_TER', 'HELIX', 'STRAND', 'TURN', 'OTHER']
+
+# DR line databases with IDs that results files may use instead of UniProt accessions,
+# and the number of ID fields kept from each line (see parse_xrefs)
+XREF_DATABASES = {'RefSeq': 2, 'Ensembl': 3, 'EnsemblPlants': 3, 'EMBL': 2, 'GeneID': 1,
+                  'PDB': 1, 'HGNC': 1, 'MGI': 1, 'Araport': 1, 'TAIR': 1}
+
+# smallest share of accessions two parses must have in common to be compared as releases
+RELEASE_OVERLAP = 0.5
+
+# column names for release change reports (see AnnotationStore.change_report)
+CHANGE_COLUMNS = ['Index', 'Accession', 'Change', 'Changed Annotations']
+
+# annotations compared by change reports: (name, field group or None, attribute function)
+CHANGE_FIELDS = [('names', None, lambda x: (x.name, x.other_names)),
+                 ('gene', None, lambda x: (x.gene, x.other_genes)),
+                 ('keywords', 'keywords', lambda x: x.keywords),
+                 ('GO terms', 'go', lambda x: x.go._go_num),
+                 ('pathways', 'pathways', lambda x: (x.pathway.react_acc, x.pathway.cc_string)),
+                 ('MGI', 'mgi', lambda x: (x.mgi_acc, x.mgi_gene)),
+                 ('comments', 'comments', lambda x: (x.comment_topics, x.comment_texts)),
+                 ('features', 'features', lambda x: (list(x.features.types), list(x.features.starts),
+                                                     list(x.features.ends))),
+                 ('sequence', 'sequence', lambda x: x.seq_md5)]
+
+# column names for site annotations (see AnnotationStore.annotate_sites)
+SITE_COLUMNS = ['Index', 'Site Start', 'Site End', 'Feature Type', 'Feature Start',
+                'Feature End', 'Feature Note']
+
+# taxonomy numbers for the species radio buttons (human, mouse, arabidopsis)
+SPECIES_TAXIDS = {1: '9606', 2: '10090', 3: '3702'}
+
+# evidence levels, strongest first (codes are positions in this list)
+EVIDENCE_LEVELS = ['experimental', 'curated', 'untagged', 'automatic']
+UNTAGGED = EVIDENCE_LEVELS.index('untagged')
+
+# evidence filter choices and the weakest evidence level each one keeps
+EVIDENCE_FILTERS = {'all': 3, 'no automatic': 2, 'experimental': 0}
+
+# ECO (and GO) evidence codes for experimental and automatic annotations;
+# any other code is counted as curated (similarity, curator inference, etc.)
+EXPERIMENTAL_EVIDENCE = {'ECO:0000269', 'ECO:0000270', 'ECO:0000314', 'ECO:0000315',
+                         'ECO:0000316', 'ECO:0000353', 'ECO:0007001', 'ECO:0007003',
+                         'ECO:0007005', 'ECO:0007007', 'EXP', 'IDA', 'IPI', 'IMP', 'IGI',
+                         'IEP', 'HTP', 'HDA', 'HMP', 'HGI', 'HEP'}
+AUTOMATIC_EVIDENCE = {'ECO:0000213', 'ECO:0000256', 'ECO:0000259', 'ECO:0000313',
+                      'ECO:0000501', 'ECO:0007744', 'ECO:0007829', 'IEA'}
 
 
 # module-wide function definitions
 def get_file(default_location, ext_list=[('All files', '*.*')], title_string="Select a file"):
     """Dialog box to browse to a folder.  Returns full file path."""
+    from tkinter import Tk, filedialog
+
     # set up GUI elements
     root = Tk()
     root.withdraw()
@@ -109,6 +187,8 @@ def get_file(default_location, ext_list=[('All files', '*.*')], title_string="Se
     
 def get_folder(default_location, title_string=""):
     """Dialog box to browse to a folder.  Returns full folder path."""    
+    from tkinter import Tk, filedialog
+
     # set up GUI elements
     root = Tk()
     root.withdraw()
@@ -126,10 +206,281 @@ def get_folder(default_location, title_string=""):
     full_folder_name = filedialog.askdirectory(parent=root, initialdir=default_location,
                                                title=title_string, mustexist=True)    
     # return full folder name
-    return full_folder_name   
-    
-    
-# class definitions:            
+    return full_folder_name
+
+def dat_sources():
+    """Returns the list of extra DAT files (lower priority than the selected one) from
+    the ANNOTATOR_DAT_SOURCES environment variable (file names in priority order
+    separated by os.pathsep, i.e. ";" on Windows and ":" elsewhere)."""
+    sources = []
+    for dat_file in os.environ.get('ANNOTATOR_DAT_SOURCES', '').split(os.pathsep):
+        dat_file = dat_file.strip()
+        if not dat_file:
+            continue
+        if os.path.exists(dat_file):
+            sources.append(os.path.abspath(dat_file))
+        else:
+            print('...DAT source not found:', dat_file)
+    return sources
+
+def recent_dat_files():
+    """Returns the recently used DAT files that still exist (most recent first)."""
+    try:
+        with open(os.path.join(get_user_folder(), 'recent_dat_files.json')) as fin:
+            recent = json.load(fin)
+    except (OSError, ValueError):
+        return []
+    return [x for x in recent if isinstance(x, str) and os.path.exists(x)]
+
+def remember_dat_file(dat_file, keep=5):
+    """Makes a DAT file the most recently used one (saved in the per-user folder)."""
+    dat_file = os.path.abspath(dat_file)
+    recent = [dat_file] + [x for x in recent_dat_files() if x != dat_file]
+    try:
+        with open(os.path.join(get_user_folder(), 'recent_dat_files.json'), 'w') as fout:
+            json.dump(recent[:keep], fout, indent=1)
+    except OSError:
+        pass
+    return
+
+def get_user_folder():
+    """Returns (and creates if needed) a per-user folder for logs and caches.
+    The location can be changed with the ANNOTATOR_HOME environment variable."""
+    folder = os.environ.get('ANNOTATOR_HOME')
+    if not folder:
+        if sys.platform.startswith('win'):
+            base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        elif sys.platform == 'darwin':
+            base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+        else:
+            base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+        folder = os.path.join(base, 'protein_annotator')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def sequence_digest(sequence):
+    """Returns the MD5 digest (hex string) of a protein sequence (also used for the
+    query sequences in ortholog_mapper.py)."""
+    return hashlib.md5(sequence.upper().encode('ascii', 'replace')).hexdigest()
+
+def dat_source(dat_file):
+    """Returns the name shared by the releases of one DAT file download: the base file
+    name without digits (uniprot_sprot_2019_05.dat.gz and uniprot_sprot_2020_01.dat.gz
+    are releases of the same source, human.dat.gz and custom.dat.gz are not)."""
+    return ''.join(x for x in os.path.basename(dat_file).lower() if not x.isdigit())
+
+def record_digest(prot_rec):
+    """Returns a short digest of the record text (it changes if any line changes,
+    including the DT entry version lines).
+    prot_rec: a list of strings, protein record"""
+    return hashlib.blake2b('\n'.join(prot_rec).encode('utf-8'), digest_size=8).digest()
+
+def record_accession(prot_rec):
+    """Returns the primary accession of a record without parsing it."""
+    for line in prot_rec:
+        if line.startswith('AC   '):
+            return line[5:].split(';')[0].strip()
+    return None
+
+def record_taxid(prot_rec):
+    """Returns the taxonomy number (OX line) of a record without parsing it."""
+    for line in prot_rec:
+        if line.startswith('OX   '):
+            return line.split('=')[1].split()[0].rstrip(';')
+    return None
+
+def parse_xrefs(prot_rec):
+    """Returns the list of cross-reference IDs (see XREF_DATABASES) in the DR lines.
+    prot_rec: a list of strings, protein record"""
+    xrefs = []
+    for line in prot_rec:
+        if line.startswith('DR   '):
+            fields = line[5:].split(' [')[0].rstrip('.').split(';')    # drop isoform tags
+            keep = XREF_DATABASES.get(fields[0])
+            if keep:
+                xrefs += [x.strip() for x in fields[1:keep + 1] if x.strip() not in ('', '-')]
+    return xrefs
+
+def unversioned(xref):
+    """Returns an ID without its version number (NP_000005.3 -> NP_000005), or None."""
+    base, dot, version = xref.rpartition('.')
+    return base if dot and version.isdigit() else None
+
+def add_xrefs(xrefs, prot_rec, accession):
+    """Adds the cross-reference IDs of a record to a dictionary of ID -> accession.
+    IDs are also added without version numbers. IDs of more than one record are
+    set to None (they cannot be used for lookups)."""
+    for xref in parse_xrefs(prot_rec):
+        for key in (xref, unversioned(xref)):
+            if key and xrefs.setdefault(key, accession) != accession:
+                xrefs[key] = None
+    return
+
+_gc_lock = threading.Lock()
+_gc_state = {'pauses': 0, 'enabled': True}
+
+@contextlib.contextmanager
+def gc_paused():
+    """Turns off garbage collection while many long-lived objects are made (parsing or
+    unpickling); the collections would only rescan the growing set of objects.
+    Threads loading at the same time share the pause (it ends with the last one)."""
+    with _gc_lock:
+        if _gc_state['pauses'] == 0:
+            _gc_state['enabled'] = gc.isenabled()
+            gc.disable()
+        _gc_state['pauses'] += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_state['pauses'] -= 1
+            if _gc_state['pauses'] == 0 and _gc_state['enabled']:
+                gc.enable()
+
+def evidence_code(tags):
+    """Returns the evidence level code of the strongest evidence tag in a list."""
+    code = UNTAGGED
+    for tag in tags:
+        if tag in EXPERIMENTAL_EVIDENCE:
+            return 0
+        elif tag not in AUTOMATIC_EVIDENCE:
+            code = 1
+        elif code == UNTAGGED:
+            code = 3
+    return code
+
+def split_evidence(text):
+    """Removes evidence blocks (like " {ECO:0000269|PubMed:123, ECO:0000250}") from text.
+    Returns the text and the evidence level code of the strongest tag."""
+    start = text.find('{ECO:')
+    if start < 0:
+        return text, UNTAGGED   # most text has no evidence
+    tags = []
+    while start >= 0:
+        end = text.find('}', start)
+        if end < 0:
+            end = len(text)
+        tags += [x.strip().split('|')[0] for x in text[start+1:end].split(',')]
+        text = text[:start].rstrip() + text[end+1:]
+        start = text.find('{ECO:')
+    return text, evidence_code(tags)
+
+def split_cc_topics(prot_rec):
+    """Splits the CC comment block into its topics in one pass.
+    prot_rec: a list of strings, protein record starting at the CC lines
+    Returns a list of (topic, text) tuples in record order (text keeps evidence blocks)."""
+    topics = []
+    for line in prot_rec:
+        if line[:5] != 'CC   ' or line[5:8] == '---':
+            break   # (the copyright notice ends the topics)
+        if line[5:9] == '-!- ':
+            topic, _, text = line[9:].partition(':')
+            topics.append([topic, text.strip()])
+        elif topics:
+            topics[-1][1] = (topics[-1][1] + ' ' + line[5:].strip()).lstrip()
+    return [tuple(x) for x in topics]
+
+
+# class definitions:
+class RunLog:
+    """Records wall time, peak memory, and counters for each processing stage.
+    Stage results are appended as JSON lines to a log file so slow sessions can be
+    diagnosed after the fact. Set ANNOTATOR_PROFILE=1 in the environment to also
+    trace memory allocations and save cProfile stats for each stage.
+    """
+    def __init__(self, log_file=None, profile=None):
+        """log_file: path to JSON lines log (default is in the per-user folder, False for none)
+        profile: bool; capture cProfile/tracemalloc data (default from environment)"""
+        if log_file is None:
+            log_file = os.environ.get('ANNOTATOR_LOG')
+        if log_file is None:
+            try:
+                log_file = os.path.join(get_user_folder(), 'annotator_log.jsonl')
+            except OSError:
+                log_file = None     # no writable location, keep stats in memory only
+        if profile is None:
+            profile = os.environ.get('ANNOTATOR_PROFILE', '0') not in ('', '0')
+        self.log_file = log_file
+        self.profile = profile
+        self.counters = collections.Counter()   # running totals for the session
+        self.stages = []                        # list of stage result dictionaries
+        self.depth = 0                          # nesting level of the running stages (profiling)
+        return
+
+    def count(self, key, n=1):
+        """Increments a named counter."""
+        self.counters[key] += n
+        return
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        """Context manager that times a stage and logs the results.
+        Stages can be nested (e.g. loading field groups of a species); only the
+        outermost stage is profiled, the inner stages are just timed.
+        name: string; stage name
+        info: any extra values to include in the log record"""
+        before = self.counters.copy()
+        profiler = None
+        started_tracing = False
+        outermost = self.profile and self.depth == 0
+        if self.profile:
+            self.depth += 1
+        if outermost:
+            import cProfile
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracemalloc.reset_peak()
+            profiler = cProfile.Profile()
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            wall_time = time.perf_counter() - start
+            if self.profile:
+                self.depth -= 1
+            record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'pid': os.getpid(),
+                      'stage': name, 'wall_s': round(wall_time, 4)}
+            record.update(info)
+            if profiler:
+                profiler.disable()
+                record['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+                if started_tracing:
+                    tracemalloc.stop()
+                if self.log_file:
+                    prof_file = '%s_%s_%d.prof' % (os.path.splitext(self.log_file)[0], name,
+                                                   int(time.time()))
+                    profiler.dump_stats(prof_file)
+                    record['profile_file'] = prof_file
+            record['peak_rss_mb'] = self.peak_rss()
+            record['counters'] = dict(self.counters - before)
+            self.stages.append(record)
+            self.write(record)
+
+    def peak_rss(self):
+        """Returns the peak resident memory of the process in MB (None if unknown)."""
+        try:
+            import resource
+        except ImportError:
+            return None     # not available on Windows
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == 'darwin':
+            return round(peak / 2**20, 2)   # bytes on macOS
+        return round(peak / 2**10, 2)       # kilobytes on Linux
+
+    def write(self, record):
+        """Appends one record to the JSON lines log file."""
+        if not self.log_file:
+            return
+        try:
+            with open(self.log_file, 'a') as fout:
+                print(json.dumps(record, default=str), file=fout)
+        except OSError:
+            print('WARNING: could not write to log file:', self.log_file)
+        return
+
+
 class OneKeyWord:
     """Data container for one UniProt keyword definition."""
     
@@ -140,7 +491,7 @@ class OneKeyWord:
         self.definition = None  # keyword description
         self.synonyms = []      # keyword synonyms
         self.GO_mapping = {}    # cross-reference to GO term
-        self.hierarchy = None   # heirarchy
+        self.hierarchy = []     # hierarchy paths (lists of terms from the category down)
         self.web = None         # web link
         self.category = None    # one of ten keywordcategories
 
@@ -151,6 +502,7 @@ class OneKeyWord:
                         'DE   ': self.parse_DE,
                         'SY   ': self.parse_SY,
                         'GO   ': self.parse_GO,
+                        'HI   ': self.parse_HI,
                         'CA   ': self.parse_CA}
         return
                         
@@ -184,6 +536,14 @@ class OneKeyWord:
                 self.GO_mapping['GO:' + part.split(';')[0]] = part.split(';')[1].strip()
         return
         
+    def parse_HI(self, content):
+        """Parses HI lines (like "Ligand: Metal-binding; Iron; Iron-sulfur; 2Fe-2S.")."""
+        for line in content.split(os.linesep):
+            category, _, terms = line.partition(':')
+            self.hierarchy.append([category.strip()] +
+                                  [x.strip() for x in terms.strip().rstrip('.').split(';') if x.strip()])
+        return
+
     def parse_CA(self, content):
         """Parses AC lines."""
         self.category = content.rstrip('.')
@@ -196,6 +556,11 @@ class KeyWords:
         """Basic constructor."""
         self.keywords = {}      # store OneKeyWord objects in dictionary by keyword
         self.categories = []    # alpabetical list of keyword categories 
+        self.terms = []         # keywords and categories in the hierarchy (sorted)
+        self.term_index = {}    # term -> term number
+        self.term_depths = []   # depth of each term (categories are 0, shortest path is used)
+        self.term_categories = []   # category of each term
+        self.ancestors = []     # sorted term numbers of each term's ancestors (and itself)
         return
 
     def parse_file(self, keyword_file):
@@ -203,7 +568,7 @@ class KeyWords:
         blocks = {}
         keyword = OneKeyWord() # object for first record
         for line in (open(keyword_file, 'r')):
-            if line.startswith('ID   '): # reset blocks once we are into records
+            if line.startswith('ID   ') or line.startswith('IC   '): # reset blocks once we are into records
                 blocks = {}
             if line.startswith("//"):   # record delimiter occurs after records
                 self._parse_blocks(keyword, blocks)
@@ -216,6 +581,7 @@ class KeyWords:
             else:
                 blocks[key] = value
         self.set_categories()
+        self.make_hierarchy()
         return
                 
     def _parse_blocks(self, keyword, blocks):
@@ -229,7 +595,34 @@ class KeyWords:
 
     def set_categories(self):
         """Gets the list of categories from the OneKeyWord objects."""
-        self.categories = sorted(set([self.keywords[k].category for k in self.keywords]))
+        self.categories = sorted(set([self.keywords[k].category for k in self.keywords
+                                      if self.keywords[k].category]))    # (not the category entries)
+
+    def make_hierarchy(self):
+        """Makes the keyword hierarchy (a DAG with the categories as roots) from the
+        HI lines and precomputes the ancestors of every term once."""
+        parents = {}
+        depths = {}
+        categories = {}
+        for keyword in self.keywords.values():
+            for path in keyword.hierarchy:
+                for depth, (parent, term) in enumerate(zip([None] + path, path)):
+                    parents.setdefault(term, set())
+                    if parent:
+                        parents[term].add(parent)
+                    depths[term] = min(depth, depths.get(term, depth))
+                    categories.setdefault(term, path[0])
+        self.terms = sorted(parents)
+        self.term_index = {term: i for (i, term) in enumerate(self.terms)}
+        self.term_depths = [depths[term] for term in self.terms]
+        self.term_categories = [categories[term] for term in self.terms]
+        closures = {}
+        def closure(term):
+            if term not in closures:
+                closures[term] = {term}.union(*[closure(x) for x in parents[term]])
+            return closures[term]
+        self.ancestors = [sorted(self.term_index[x] for x in closure(term)) for term in self.terms]
+        return
         
     def put_keywords_in_categories(self, keyword_list):
         """Given a list of keywords, returns a list of keywords grouped into 10 categories."""
@@ -259,52 +652,105 @@ class Annotations:
         self.other_accessions = []  # other accessions
         self.fasta_accession = None # compund accession like in the FASTA files
         self.name = None            # primary protein name
+        self.name_evidence = UNTAGGED               # evidence level code (see EVIDENCE_LEVELS)
         self.other_names = []       # alternative protein names
+        self.other_name_evidence = array.array('B') # evidence level codes of other names
         self.flags = []             # flags from DE lines
         self.gene = None            # UniProt gene name
+        self.gene_evidence = UNTAGGED               # evidence level code of gene name
         self.other_genes = []       # other gene synonyms
         self.os = None              # species name
         self.ox = None              # taxonomy number
         self.mgi_acc = None         # mouse gene index cross-reference
         self.mgi_gene = None        # MGI gene name (may differ from UniProt)
         self.keywords = []          # keyword list
+        self.keyword_evidence = array.array('B')    # evidence level codes of keywords
         self.go = GOTerms()         # GO term object
+        self.features = Features()  # sequence features from FT lines
 #        self.cc = None
         self.pathway = PathWays()   # container for CC PATHWAY and Reactome annotations
+        self.comment_topics = []    # CC comment topics (e.g. FUNCTION) in record order
+        self.comment_texts = []     # text of each CC topic (without evidence blocks)
+        self.comment_evidence = array.array('B')    # evidence level codes of the CC topics
+        self.sequence = ''          # protein sequence from SQ block
+        self.crc64 = None           # CRC64 checksum from SQ line
+        self.seq_md5 = None         # MD5 digest of the sequence (for exact matching)
+        self.groups = set()         # optional field groups that have been parsed
 
-        # compile re pattern for evidence codes
-        self.eco = re.compile(r' {?ECO:(.)*[},]') # ' {ECO:' followed by zero or more characters then '}'
-        
         # non-informative keywords to exclude:
         self.excluded_keywords = ['Reference proteome', 'Complete proteome',
                                   'Direct protein sequencing']
-
-        # methods switchyard dictionary
-        self.parse_method = {'ID': self.get_identifier,
-                             'AC': self.get_accessions,
-                             'DE': self.get_names,
-                             'GN': self.get_gene_name,
-                             'OS': self.get_os,
-                             'OX': self.get_ox,
-                             'CC': self.get_cc,
-                             'DR': self.get_databases,
-                             'KW': self.get_keywords}
         return
 
-    def parse_record(self, prot_rec):
+    def parse_methods(self, groups=None):
+        """Methods switchyard: (line code, method) pairs for the basic fields
+        and the optional field groups (all groups if groups is None)."""
+        methods = [('ID', self.get_identifier), ('AC', self.get_accessions),
+                   ('DE', self.get_names), ('GN', self.get_gene_name),
+                   ('OS', self.get_os), ('OX', self.get_ox)]
+        group_methods = {'keywords': [('KW', self.get_keywords)],
+                         'go': [('DR', self.get_GO)],
+                         'pathways': [('CC', self.get_cc), ('DR', self.get_reactome)],
+                         'mgi': [('DR', self.get_mgi)],
+                         'features': [('FT', self.get_features)],
+                         'sequence': [('SQ', self.get_sequence)],
+                         'comments': [('CC', self.get_cc)]}
+        for group in (FIELD_GROUPS if groups is None else groups):
+            methods += [x for x in group_methods[group] if x not in methods]
+        return methods
+
+    def parse_record(self, prot_rec, groups=None):
         """Parses annotation fields from protein records.
-        prot_rec: a list of strings, protein record"""        
+        prot_rec: a list of strings, protein record
+        groups: optional field groups to parse (default is all of them)"""
         # index the record to speed parsing
         idx = self.make_index(prot_rec)
 
         # skip to the right part of the record and call its method
-        for key in idx:
-            try:
-                self.parse_method[key](prot_rec[idx[key]:])
-            except KeyError:
-                pass    # skip annotation lines we are not parsing        
-        self.fasta_accession = '|'.join([self.db, self.accession, self.identifier])        
-        return        
+        self.groups.update(FIELD_GROUPS if groups is None else groups)
+        for key, method in self.parse_methods(groups):
+            if key in idx:
+                method(prot_rec[idx[key]:])
+        self.fasta_accession = '|'.join([self.db, self.accession, self.identifier])
+        return
+
+    def group_defaults(self, group):
+        """Returns the attributes of an optional field group with empty values."""
+        if group == 'keywords':
+            return {'keywords': [], 'keyword_evidence': array.array('B')}
+        elif group == 'go':
+            return {'go': GOTerms()}
+        elif group == 'pathways':
+            return {'pathway': PathWays()}
+        elif group == 'mgi':
+            return {'mgi_acc': None, 'mgi_gene': None}
+        elif group == 'features':
+            return {'features': Features()}
+        elif group == 'sequence':
+            return {'sequence': '', 'crc64': None, 'seq_md5': None}
+        elif group == 'comments':
+            return {'comment_topics': [], 'comment_texts': [],
+                    'comment_evidence': array.array('B')}
+        raise ValueError('unknown field group: %s' % group)
+
+    def get_group(self, group):
+        """Returns the attributes of a parsed field group as a dictionary."""
+        return {key: getattr(self, key) for key in self.group_defaults(group)}
+
+    def set_group(self, group, values=None):
+        """Sets the attributes of a field group (empty values if values is None)."""
+        self.__dict__.update(values if values is not None else self.group_defaults(group))
+        self.groups.add(group)
+        return
+
+    def basic_copy(self):
+        """Returns a copy with the optional field groups emptied (they are cached separately)."""
+        copy = Annotations.__new__(Annotations)
+        copy.__dict__.update(self.__dict__)
+        for group in FIELD_GROUPS:
+            copy.__dict__.update(self.group_defaults(group))
+        copy.groups = set()
+        return copy
 
     def make_index(self, prot_rec):
         """Indexes the major sections of the protein record.'
@@ -352,9 +798,10 @@ class Annotations:
         for line in prot_rec:
             if not line.startswith('DE'):
                 break
-            line = self.eco.sub('', line[5:])     # lines start with two uppercase letters and 3 spaces
+            line, evidence = split_evidence(line[5:])  # lines start with two uppercase letters and 3 spaces
             if 'RecName:' in line:
                 self.name = line.split('Full=')[1].rstrip(';')
+                self.name_evidence = evidence
             elif 'AltName:' in line:
                 if short_names and not self.other_names:
                     self.name += ' (' + '; '.join(short_names) + ')'
@@ -366,6 +813,7 @@ class Annotations:
                     self.other_names.append(line.split('Full=')[1].rstrip(';'))
                 except IndexError:
                     self.other_names.append(line.split('AltName:')[1].strip().rstrip(';'))
+                self.other_name_evidence.append(evidence)
             elif 'Flags:' in line:
                 self.flags = [x.strip() for x in line.split(':')[1].split(';') if x.strip()]
             elif 'Short=' in line:
@@ -384,8 +832,9 @@ class Annotations:
         prot_rec: a list of strings, protein record"""
         for line in prot_rec:
             if line.startswith('GN   '):
-                line = self.eco.sub('', line)   # remove evidence codes
-                self.gene = line[5:].split(';')[0].replace('Name=', '')
+                gene, self.gene_evidence = split_evidence(line[5:].split(';')[0])
+                self.gene = gene.replace('Name=', '')
+                line = split_evidence(line)[0]   # remove evidence codes
                 synonyms = [x for x in line[5:].split(';') if 'Synonyms' in x]
                 if synonyms:
                     other_genes = synonyms[0].replace('Synonyms=', '')
@@ -408,13 +857,12 @@ class Annotations:
                 self.ox = line.split('=')[1].split()[0].rstrip(';')
                 return    
 
-    def get_databases(self, prot_rec):
-        """Calls any database cross reference block parsings."""
-        self.pathway.parse_reactome(prot_rec)    
-        self.get_mgi(prot_rec)
-        self.get_GO(prot_rec)
+    def get_reactome(self, prot_rec):
+        """Parses the Reactome cross references.
+        prot_rec: a list of strings, protein record"""
+        self.pathway.parse_reactome(prot_rec)
         return
-                
+
     def get_mgi(self, prot_rec):
         """Returns the MGI accession number and gene name from the DAT file.
         prot_rec: a list of strings, protein record"""
@@ -432,25 +880,69 @@ class Annotations:
         return
 
     def get_cc(self, prot_rec):
-        """Parses CC PATHWAY info."""
-        self.pathway.parse_cc_pathway(prot_rec)
+        """Parses the CC PATHWAY info and the CC comment topics for the field groups
+        being parsed ("pathways" and "comments" share one pass over the CC lines).
+        prot_rec: a list of strings, protein record"""
+        topics = split_cc_topics(prot_rec)
+        if 'pathways' in self.groups:
+            self.pathway.parse_cc_pathway(topics)
+        if 'comments' not in self.groups:
+            return
+        for topic, text in topics:
+            text, evidence = split_evidence(text)
+            self.comment_topics.append(topic)
+            self.comment_texts.append(text.strip().replace('..', '.'))
+            self.comment_evidence.append(evidence)
+        return
+
+    def comment(self, topic, evidence_filter='all'):
+        """Returns the text of a CC topic (several blocks are joined with " | ").
+        evidence_filter: drops blocks with weaker evidence (see EVIDENCE_FILTERS)"""
+        level = EVIDENCE_FILTERS[evidence_filter]
+        return ' | '.join(text for (name, text, evidence) in
+                          zip(self.comment_topics, self.comment_texts, self.comment_evidence)
+                          if name == topic and evidence <= level)
        
     def get_keywords(self, prot_rec):
         """Return list of keywords from DAT file.
         prot_rec: a list of strings, protein record"""
         keyword_lst = []
+        evidence_lst = array.array('B')
         for line in prot_rec:
             if line.startswith('KW   '):
-                line = self.eco.sub('', line)   # remove evidence codes
-                [keyword_lst.append(k.strip()) for k in line[5:].split(';') 
-                if (k.strip() and k.strip().replace('.', '') not in self.excluded_keywords)]
+                for k in line[5:].split(';'):
+                    k, evidence = split_evidence(k)     # remove evidence codes
+                    k = k.strip()
+                    if k and k.replace('.', '') not in self.excluded_keywords:
+                        keyword_lst.append(k)
+                        evidence_lst.append(evidence)
             else:
                 break
         if keyword_lst:
             keyword_lst[-1] = keyword_lst[-1].rstrip('.')
         self.keywords = keyword_lst
+        self.keyword_evidence = evidence_lst
         return
         
+    def get_features(self, prot_rec):
+        """Parses the FT lines into a Features object.
+        prot_rec: a list of strings, protein record"""
+        self.features.parse_features(prot_rec)
+        return
+
+    def get_sequence(self, prot_rec):
+        """Gets the protein sequence from the SQ block.
+        prot_rec: a list of strings, protein record"""
+        self.crc64 = prot_rec[0].rstrip().rstrip(';').split()[-2]
+        self.sequence = ''.join([''.join(line.split()) for line in prot_rec[1:]
+                                 if line.startswith('     ')])
+        self.seq_md5 = sequence_digest(self.sequence)
+        return
+
+    def description(self):
+        """Returns a FASTA style description string."""
+        return '%s OS=%s OX=%s GN=%s' % (self.name, self.os, self.ox, self.gene)
+
     def _snoop(self):
         """Prints itself for diagnostics."""
         print('identifier:', self.identifier)
@@ -478,15 +970,12 @@ class PathWays:
         self.react_desc = []    # list of Reactome description strings
         self.react_string = ''  # formatted reactome info
         self.cc_string = ''     # string to collect CC description lines
-        
-        # compile re pattern for evidence codes
-        self.eco = re.compile(r' {?ECO:(.)*[},]') # ' {ECO:' followed by zero or more characters then '}'
+        self.cc_evidence = UNTAGGED     # evidence level code of the CC PATHWAY text
         return
-        
+
     def parse_reactome(self, prot_rec):
         """Parses Reatome DR lines into paired acc and desc lists."""
         for line in prot_rec:
-            line = self.eco.sub('', line)
             if line.startswith('DR   Reactome;'):
                 line_split = [x.strip() for x in line.split(';')]
                 self.react_acc.append(line_split[1])
@@ -496,27 +985,91 @@ class PathWays:
         self.react_string = '; '.join(['%s {%s}' % (desc, acc) for (desc, acc) in zip(self.react_desc, self.react_acc)])
         return
         
-    def parse_cc_pathway(self, prot_rec):
-        """Parses CC PATHWAY lines from protein record."""
-        in_pathway = False
+    def parse_cc_pathway(self, topics):
+        """Gets the CC PATHWAY text (the last one if there are several).
+        topics: list of (topic, text) tuples from split_cc_topics"""
+        pathways = [text for (topic, text) in topics if topic == 'PATHWAY']
+        self.cc_string = pathways[-1] if pathways else ''
+        # evidence blocks can be split over lines, so remove them from the whole text
+        self.cc_string, self.cc_evidence = split_evidence(self.cc_string)
+        self.cc_string = self.cc_string.strip().replace('..', '.')
+        return
+ 
+class Features:
+    """Sequence features (FT lines) stored as compact parallel arrays sorted by start.
+    Feature types are small integer codes into FEATURE_TYPES. Unknown positions are -1."""
+    def __init__(self):
+        """Basic constructor."""
+        self.types = array.array('B')   # feature type codes
+        self.starts = array.array('l')  # first residue (sorted)
+        self.ends = array.array('l')    # last residue
+        self.notes = []                 # feature notes (or descriptions)
+        return
+
+    def parse_features(self, prot_rec):
+        """Parses FT lines (current and pre-2019 formats).
+        prot_rec: a list of strings, protein record"""
+        features = []
+        in_note = False     # True while reading the lines of a note
         for line in prot_rec:
-            line = self.eco.sub('', line)
-            if '-!- PATHWAY:' in line:
-                in_pathway = True
-                self.cc_string = line.split('-!- PATHWAY: ')[1] + ' '
-            elif in_pathway and ('-!-' in line or '----------' in line):
+            if not line.startswith('FT   '):
                 break
-            elif in_pathway and '-!-' not in line:
-                if line == 'CC      .':
-                    continue
-                try:
-                    self.cc_string += line.split('CC   ')[1].lstrip() + ' '
-                except IndexError:
-                    break
-        if self.cc_string.endswith(' '):
-            self.cc_string = self.cc_string[:-1]
+            content = line[21:].strip()
+            if line[5] != ' ':      # start of a new feature
+                parts = line[5:].split()
+                if len(parts) > 2:  # older format: key, from, to, description
+                    start, end, note = parts[1], parts[2], ' '.join(parts[3:])
+                else:
+                    location = parts[1].split(':')[-1] if len(parts) > 1 else '?'
+                    start, _, end = location.partition('..')   # drop any isoform prefix above
+                    end = end if end else start
+                    note = ''
+                features.append([parts[0], self._position(start), self._position(end), note])
+                in_note = len(parts) > 2
+            elif not features:
+                continue
+            elif content.startswith('/'):
+                in_note = content.startswith('/note="')
+                if in_note:
+                    features[-1][3] = content[7:]
+            elif in_note:
+                features[-1][3] += ' ' + content    # note continues on next line
+        for key, start, end, note in sorted(features, key=lambda x: x[1]):
+            try:
+                self.types.append(FEATURE_TYPES.index(key))
+            except ValueError:
+                self.types.append(FEATURE_TYPES.index('OTHER'))
+                note = '%s: %s' % (key, note)
+            self.starts.append(start)
+            self.ends.append(end)
+            self.notes.append(note.strip().strip('"').rstrip('.'))
         return
- 
+
+    def _position(self, text):
+        """Converts a position string (like "<1", ">250", or "?") to an integer."""
+        try:
+            return int(text.strip('<>?'))
+        except ValueError:
+            return -1
+
+    def overlapping(self, start, end=None, types=None):
+        """Returns the features that overlap residues start to end (inclusive).
+        types: optional list of feature type names to keep
+        Each feature is a (type, start, end, note) tuple."""
+        if end is None:
+            end = start
+        last = bisect.bisect_right(self.starts, end)    # features starting after end can't overlap
+        found = []
+        for i in range(last):
+            if self.ends[i] >= start and self.starts[i] >= 0:
+                feature_type = FEATURE_TYPES[self.types[i]]
+                if types is None or feature_type in types:
+                    found.append((feature_type, self.starts[i], self.ends[i], self.notes[i]))
+        return found
+
+    def __len__(self):
+        return len(self.types)
+
 class GOTerms:
     """Object containing GO terms out of DAT file."""
     def __init__(self):
@@ -524,11 +1077,9 @@ class GOTerms:
         self._go_num = []               # GO accession
         self._go_type = []              # GO category
         self._go_desc = []              # GO term
-        self.molecular_function = ''    # collects MF GO terms
-        self.cellular_component = ''    # collects CC GO terms
-        self.biological_process = ''    # collects BP GO terms
+        self.evidence = array.array('B')    # evidence level code (see EVIDENCE_LEVELS)
         return
-        
+
     def parse_GO_terms(self, prot_rec):
         """Retrieve the GO Terms from the DAT file
         prot_rec: a list of strings, protein record"""
@@ -538,826 +1089,1160 @@ class GOTerms:
                 self._go_num.append(terms[0][3:])
                 self._go_type.append(terms[1][0])
                 self._go_desc.append(terms[1][2:])
-        self._sort_GO_terms()
+                self.evidence.append(evidence_code([terms[2].split(':')[0]]))
         return
-                
-    def _sort_GO_terms(self):
-        """Sort the GO Terms based on their category:
-        Biological process, Molecular function, or
-        Cellular component."""
-        molecular_function = []
-        cellular_component = []
-        biological_process = []
-        for i, item in enumerate(self._go_type):
-            if item == 'F':
-                molecular_function.append('%s {GO:%s}' % (self._go_desc[i], self._go_num[i]))
-            if item == 'C':
-                cellular_component.append('%s {GO:%s}' % (self._go_desc[i], self._go_num[i]))
-            if item == 'P':
-                biological_process.append('%s {GO:%s}' % (self._go_desc[i], self._go_num[i]))
-        
-        # combine terms into single strings
-        self.molecular_function = '; '.join(molecular_function)
-        self.cellular_component = '; '.join(cellular_component)
-        self.biological_process = '; '.join(biological_process)
-        return        
+
+    def category_string(self, category, keep=None):
+        """Combines the GO Terms of one category (F: Molecular function,
+        C: Cellular component, or P: Biological process) into a single string.
+        Strings are only made for the proteins that end up in a table.
+        keep: optional boolean array (see evidence_masks) of terms to include"""
+        if keep is None:
+            keep = [True] * len(self._go_type)
+        return '; '.join(['%s {GO:%s}' % (desc, num) for (go_type, desc, num, ok)
+                          in zip(self._go_type, self._go_desc, self._go_num, keep)
+                          if go_type == category and ok])
+
+    @property
+    def molecular_function(self):
+        """MF GO terms string."""
+        return self.category_string('F')
+
+    @property
+    def cellular_component(self):
+        """CC GO terms string."""
+        return self.category_string('C')
+
+    @property
+    def biological_process(self):
+        """BP GO terms string."""
+        return self.category_string('P')
+
                 
 class AnnotationPickle:
       """Container for parsed annotation dictionary of DAT file.
       Includes DAT file name, and DAT file creation date to test if pickle seems viable.
+      The content fingerprint (see ParseCache) is used instead when it is present.
       """
-      def __init__(self, dat_file, dat_date, annotate_dict):
+      def __init__(self, dat_file, dat_date, annotate_dict, fingerprint=None):
           """Basic constructor."""
           self.dat_file = dat_file
           self.dat_date = dat_date
           self.annotate_dict = annotate_dict
+          self.fingerprint = fingerprint
           return
-         
-          
-# GUI classes
-class StatusBar(Frame):
-    """window status bar class with set and clear methods.
-    Code from "http://effbot.org/tkinterbook/text.htm"
+
+class PreviousRelease:
+    """Cached records of an earlier parsed DAT file (e.g. last month's Swiss-Prot).
+    Records whose text has not changed are copied from it instead of being parsed,
+    and it is compared to the current release for change reports.
     """
-    def __init__(self, master):
-        Frame.__init__(self, master)
-        self.label = Label(self, bd=1, padx=5, pady=1, relief=SUNKEN, anchor=W)
-        self.label.pack(fill=X)
+    def __init__(self, cache, fingerprint, versions, groups=None):
+        """cache: ParseCache object
+        fingerprint: cache fingerprint of the earlier DAT file
+        versions: dictionary of accession -> (taxonomy number, record digest)
+        groups: optional field groups to load (all cached groups if None)"""
+        self.cache = cache
+        self.fingerprint = fingerprint
+        self.versions = versions
+        self.groups = groups
+        self.partitions = {}    # accession -> Annotations dictionaries keyed by taxonomy number
+        self.loaded = {}        # field groups loaded for each species
         return
-               
-    def set(self, format, *args):
-        self.label.config(text=format % args)
-        self.label.update_idletasks()
+
+    def _species(self, taxid):
+        """Returns the records of one species keyed by accession (loaded if needed)."""
+        if taxid not in self.partitions:
+            records = {}
+            self.loaded[taxid] = set()
+            pickled_anno = self.cache.load(self.fingerprint, 'species_%s.pk' % taxid)
+            if pickled_anno is not None:
+                records = {x.accession: x for x in pickled_anno.annotate_dict.values()}
+                for group in (FIELD_GROUPS if self.groups is None else self.groups):
+                    values = self.cache.load(self.fingerprint, 'species_%s_%s.pk' % (taxid, group))
+                    if values is None:
+                        continue    # never parsed for the earlier release
+                    for acc, annotations in records.items():
+                        annotations.set_group(group, values.get(acc))
+                    self.loaded[taxid].add(group)
+            self.partitions[taxid] = records
+        return self.partitions[taxid]
+
+    def record(self, accession):
+        """Returns the earlier record for an accession (or None)."""
+        taxid = self.versions.get(accession, (None, None))[0]
+        return self._species(taxid).get(accession) if taxid else None
+
+    def unchanged(self, accession, digest, groups):
+        """Returns the earlier record if the record text is the same and it has
+        all of the field groups (None otherwise)."""
+        taxid, old_digest = self.versions.get(accession, (None, None))
+        if old_digest != digest:
+            return None
+        records = self._species(taxid)
+        if not set(groups) <= self.loaded[taxid]:
+            return None
+        return records.get(accession)
+
+class CrossReferences:
+    """Lookups of the proteins of one species by the IDs of other databases (RefSeq,
+    Ensembl, GeneID, etc. from the DR lines, see XREF_DATABASES). Supports the
+    dictionary operations used for annotation lookups (key in xrefs, xrefs[key]).
+    Version numbers do not have to match and the parts of "|" separated accessions
+    (e.g. ref|NP_000005.3|) are tried.
+    """
+    def __init__(self, ids, partition):
+        """ids: dictionary of external ID -> UniProt accession
+        partition: annotation dictionary of the species"""
+        self.ids = ids
+        self.partition = partition
         return
-            
-    def clear(self):
-        self.label.config(text="")
-        self.label.update_idletasks()
-        return     
-    # end StatusBar class  
-
-class ProteinAnnotator:
-    """Object creating the main GUI window."""
-    def __init__(self):
-        self.root = Tk()
-        self.root.title('Protein Annotator')
-        self.myFrame = Frame(self.root)
-        self.myFrame.pack()
-        self.radio_var = IntVar()
-        self.kw_var = IntVar()
-        self.pw_var = IntVar()
-        self.go_var = IntVar()
-        self.sf_var = IntVar()
-        
-        # set default values
-        self.radio_var.set(1)
-        self.kw_var.set(1)
-        self.pw_var.set(1)
-        self.go_var.set(1)
-        self.sf_var.set(0)
-        
-        # create a button toolbar
-        self.toolbar = Frame(self.myFrame)
-
-        self.b1 = self.make_toolbar_button('Get accessions', self.get_accessions)
-        self.b2 = self.make_toolbar_button('Parse DAT file', self.parse_dat_file, width=13)
-        self.b3 = self.make_toolbar_button('Blast mapping', self.blast_mapping)
-        self.b4 = self.make_toolbar_button('Add annotations', self.add_annotations)
-        self.b5 = self.make_toolbar_button('Reset', self.clear_data, width=8)
-        self.b6 = self.make_toolbar_button('Help', self.print_help, width=8)
-        self.b7 = self.make_toolbar_button('Quit', self.quit_me, width=8)
-
-        self.toolbar.pack(side=TOP, fill=X)
-        
-        #create an option bar
-        self.option_bar = Frame(self.myFrame)
-        self.rb_frame = Frame(self.option_bar, bd=2, relief=SUNKEN)  # radiobuttons frame
 
-        self.rb1 = self.make_radiobutton('human', 1)
-        self.rb2 = self.make_radiobutton('mouse', 2)
-        self.rb3 = self.make_radiobutton('arabidopsis', 3)
-        
-        self.rb_frame.pack(side=LEFT, fill=X, padx=5, pady=5)
-                
-        self.cb_frame = Frame(self.option_bar, bd=2, relief=SUNKEN)  # checkboxes frame
+    def _accession(self, key):
+        """Returns the UniProt accession for an external ID (or None)."""
+        for part in key.split('|'):
+            part = part.strip()
+            accession = self.ids.get(part)
+            if accession is None and unversioned(part):
+                accession = self.ids.get(unversioned(part))
+            if accession is not None and accession in self.partition:
+                return accession
+        return None
+
+    def __len__(self):
+        """Number of external IDs."""
+        return len(self.ids)
+
+    def __contains__(self, key):
+        return self._accession(key) is not None
+
+    def __getitem__(self, key):
+        accession = self._accession(key)
+        if accession is None:
+            raise KeyError(key)
+        return self.partition[accession]
+
+    def get(self, key, default=None):
+        """Returns the annotations for an external ID (or default)."""
+        accession = self._accession(key)
+        return self.partition[accession] if accession is not None else default
+
+def partition_keys(partition):
+    """Returns the lookup key dictionary of a loaded species (key -> Annotations object
+    for dictionaries, key -> row number for the columnar and disk layouts)."""
+    if isinstance(partition, dict):
+        return partition
+    if isinstance(partition, record_store.DiskStore):
+        return partition.index.keys
+    return partition.keys
+
+class MergedPartition:
+    """One species from several DAT files (sources) behind a merged index of lookup
+    key -> source number, where each key goes to the first source (in priority order)
+    that has it. A lookup is one dictionary access no matter how many sources there
+    are. Supports the dictionary operations used for annotation lookups.
+    """
+    def __init__(self, parts):
+        """parts: loaded species of each source in priority order (dictionaries, or
+               columnar or disk stores)"""
+        self.parts = parts
+        self.index = {}
+        for i in reversed(range(len(parts))):
+            self.index.update(dict.fromkeys(partition_keys(parts[i]), i))
+        self.length = None
+        return
 
-        self.options = IntVar()        
-        self.cb4 = self.make_checkbutton('Summary Files', self.sf_var)
-        self.cb3 = self.make_checkbutton('Pathways', self.pw_var)
-        self.cb2 = self.make_checkbutton('GO Terms', self.go_var)
-        self.cb1 = self.make_checkbutton('Keywords', self.kw_var)
+    def _rows(self, i):
+        """Returns the records (dictionaries) or row numbers of source i that are
+        not hidden by a higher priority source."""
+        index = self.index
+        if isinstance(self.parts[i], dict):
+            return list({id(x): x for (key, x) in self.parts[i].items() if index[key] == i}.values())
+        return sorted({row for (key, row) in partition_keys(self.parts[i]).items() if index[key] == i})
+
+    def __len__(self):
+        """Number of records (not keys)."""
+        if self.length is None:
+            self.length = sum(len(self._rows(i)) for i in range(len(self.parts)))
+        return self.length
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        return self.parts[self.index[key]][key]
+
+    def get(self, key, default=None):
+        """Returns the annotations for a key from the highest priority source (or default)."""
+        i = self.index.get(key)
+        return self.parts[i][key] if i is not None else default
+
+    def records(self):
+        """Returns the distinct Annotations objects (highest priority source first)."""
+        records = []
+        for i, part in enumerate(self.parts):
+            rows = self._rows(i)
+            if isinstance(part, dict):
+                records += rows
+            elif rows:
+                part_records = part.records()
+                records += [part_records[row] for row in rows]
+        return records
+
+    def as_dict(self):
+        """Returns a dictionary of lookup key -> Annotations object."""
+        merged = {}
+        for i, part in enumerate(self.parts):
+            part_records = None if isinstance(part, dict) else part.records()
+            for key, value in partition_keys(part).items():
+                if self.index[key] == i:
+                    merged[key] = value if part_records is None else part_records[value]
+        return merged
+
+class AnnotationStore:
+    """Parsed DAT file annotations partitioned by species (OX taxonomy number).
+    Each species is cached separately (see ParseCache) and only the selected species
+    is loaded. Lookups search the selected species and any records added from other
+    sources (other species are only searched if asked for, and are not kept loaded).
+    The basic fields and each optional field group (see FIELD_GROUPS) are cached
+    separately. Only the requested groups are parsed and loaded; other groups are
+    parsed from the DAT file the first time they are needed.
+    Loaded species are kept as dictionaries of Annotations objects, or in the
+    "columnar" layout as dictionary-encoded columns (see columnar_store.py) that
+    use much less memory. In the "disk" layout the records stay in a file in the
+    cache folder and are parsed when they are looked up (see record_store.py); a
+    least recently used cache with a memory budget (ANNOTATOR_STORE_MB environment
+    variable, default 256 MB) keeps the most recent ones.
+    The IDs of other databases in the DR lines are cached for each species so that
+    RefSeq, Ensembl, etc. accessions can be looked up too (see CrossReferences).
+    """
+    def __init__(self, dat_file=None, cache=None, run_log=None, layout=None, budget_mb=None):
+        """dat_file: UniProt DAT file (can be None if records will be added)
+        cache: ParseCache object
+        run_log: RunLog object for stage timings and counters
+        layout: one of STORE_LAYOUTS (default is the ANNOTATOR_STORE environment
+                variable or "objects")
+        budget_mb: memory budget for parsed records in the disk layout (MB)"""
+        if layout is None:
+            layout = os.environ.get('ANNOTATOR_STORE', 'objects')
+        if layout not in STORE_LAYOUTS:
+            print('...unknown store layout "%s", using objects' % layout)
+            layout = 'objects'
+        self.layout = layout
+        self.dat_file = dat_file
+        self.cache = cache if cache else ParseCache()
+        self.run_log = run_log if run_log else RunLog(log_file=False)
+        self.fingerprint = self.cache.fingerprint(dat_file) if dat_file else None
+        self.species_counts = {}    # record counts keyed by taxonomy number
+        self.partitions = {}        # loaded annotation dictionaries keyed by taxonomy number
+        self.taxid = None           # selected species
+        self.groups = set()         # optional field groups loaded for every partition
+        self.frames = {}            # precomputed annotation tables keyed by taxonomy number
+        self.versions = {}          # accession -> (taxonomy number, record digest) of last parse
+        self.extra = {}             # annotations added from other sources (streaming scans)
+        self.xrefs = {}             # external ID -> accession dictionaries keyed by taxonomy number
+        if budget_mb is None:
+            budget_mb = float(os.environ.get('ANNOTATOR_STORE_MB', 256))
+        self.record_cache = record_store.RecordCache(budget_mb)    # (disk layout only)
+        return
 
+    def open(self, taxid, groups=()):
+        """Gets the species list from the cache (parsing the DAT file if needed)
+        and loads the selected species.
+        groups: optional field groups to parse and load"""
+        self.groups = set(groups)
+        with self.run_log.stage('load_cache', dat_file=self.dat_file):
+            species_counts = self.cache.load(self.fingerprint, 'species_counts.pk')
+        self.run_log.count('cache_hit' if species_counts is not None else 'cache_miss')
+        if species_counts is None and self.layout == 'disk':
+            self.write_records()    # (nothing is parsed in bulk)
+        elif species_counts is None:
+            self.parse()
+        else:
+            self.species_counts = species_counts
+        self.select(taxid)
+        return
 
+    def parse(self):
+        """Parses the DAT file and caches each species.
+        Only the basic fields and the requested field groups are parsed."""
+        previous = self.previous_release(self.groups)
+        xrefs = {}
+        with self.run_log.stage('parse_dat', dat_file=self.dat_file, groups=sorted(self.groups),
+                                previous=previous.fingerprint if previous else None):
+            with gc_paused():
+                count, annotate_dict = self._process_dat_records(self.groups, previous,
+                                                                 xrefs) # parse DAT file
+            self.run_log.count('records_parsed', count)
+        groups = self.groups
+        if previous:
+            kept = len(self.versions) - count
+            deleted = len(set(previous.versions) - set(self.versions))
+            self.run_log.count('records_reused', kept)
+            print('...%d records unchanged since the previous release, %d new or changed, '
+                  '%d deleted' % (kept, count, deleted))
+            shared = len(set(previous.versions) & set(self.versions))
+            if shared < RELEASE_OVERLAP * min(len(previous.versions), len(self.versions)):
+                print('...too few accessions in common, not compared as releases')
+                previous = None     # (unchanged records were still reused)
+        self.cache.save({'previous': previous.fingerprint if previous else None,
+                         'source': dat_source(self.dat_file), 'records': self.versions},
+                        self.fingerprint, 'record_versions.pk')
+
+        # split by species and save the parsed file results for next time
+        with self.run_log.stage('save_cache', dat_file=self.dat_file):
+            self.partitions = {}
+            for key, annotations in annotate_dict.items():
+                self.partitions.setdefault(annotations.ox, {})[key] = annotations
+            self.species_counts = {}
+            for taxid, partition in self.partitions.items():
+                self.species_counts[taxid] = len(set(id(x) for x in partition.values()))
+                self._save_partition(taxid, partition, groups)
+            self._save_xrefs(xrefs)
+            self.cache.save(self.species_counts, self.fingerprint, 'species_counts.pk')
+        return
 
-        
-        self.cb_frame.pack(side=RIGHT, fill=X)
-        self.option_bar.pack(side=TOP, fill=X, padx=5, pady=5)
-        
-        # add a multi-line text box with scrollbars
-        self.textFrame = Frame(self.myFrame, bd=2, relief=SUNKEN)
-        self.textFrame.grid_rowconfigure(0, weight=1)
-        self.textFrame.grid_columnconfigure(0, weight=1)
-        
-        self.text = Text(self.textFrame, height=40, width=132,
-                         wrap=NONE, padx=5, pady=5)
-        self.xscroll = Scrollbar(self.textFrame, orient=HORIZONTAL,
-                                 command=self.text.xview)
-        self.xscroll.grid(row=1, column=0, sticky=W+E)
-        self.yscroll = Scrollbar(self.textFrame, command=self.text.yview)
-        self.yscroll.grid(row=0, column=1, sticky=N+S)
-        
-        self.text.configure(xscrollcommand=self.xscroll.set)
-        self.text.configure(yscrollcommand=self.yscroll.set)
-        self.text.grid(row=0, column=0, sticky=N+S+E+W)
-        
-        self.textFrame.pack()
-
-        # add a status line
-        self.status = StatusBar(self.myFrame)
-        self.status.pack(side=BOTTOM, fill=X)
-        self.status.set("%s", "Status line")
-        self.print_help()
-
-        # define the actual structures for the data
-        self.accessions = None      # holds list of accessions
-        self.acc_read = False       # flag for if accessions are loaded
-        self.dat_file = None        # DAT file path and name
-        self.dat_read = False       # flag for if DAT file parsed
-        self.default = os.getcwd()  # can set a default location here
-        self._annotate_dict = {}    # maps all possible accessions to annotations
-        self.annotations = []       # list of matching annotations 
-        self.blast_map = {}         # optional BLAST ortholog mapping
-        self.blast_brief = {}       # condensed BLAST information
-        self.blast_matches = {}     # BLAST match information for loaded accessions
-        self.blast_read = False     # flag for if BLAST map was read in
-        
-        # enter main loop
-        self.root.mainloop()
-
-    def make_toolbar_button(self, _text, _command, width=12):
-        """Makes toolbar buttons
-        _text: string; button text
-        _command: method; method to be executed when button is clicked
-        width: int; desired width of button
-        """
-        b = Button(self.toolbar, text=_text, width=width, command=_command,
-                   borderwidth=2, relief=RAISED)
-        b.pack(side=LEFT, padx=5, pady=5)
-        return(b)
-    
-    def make_radiobutton(self, _text, _value):
-        """Makes a radio button for option bar'
-        _text: string; button text
-        _value: int; radiobutton value"""
-        rb = Radiobutton(self.rb_frame, text = _text, variable = self.radio_var,
-                         value = _value, width = 12, borderwidth = 2)
-        rb.pack(side=LEFT, padx=5, pady=5)
-        return(rb)
-        
-    def make_checkbutton(self, _text, var):
-        """Makes a checkbutton for the option bar
-        _text: string; checkbutton text
-        var: int; variable value"""
-        cb = Checkbutton(self.cb_frame, text = _text, width = 13, variable = var)
-        cb.pack(side=RIGHT, padx=5, pady=5)
-        return(cb)    
-
-    def _parse_accessions(self, clipboard):
-        """Helper function to parse an accessions from clipboard."""
-        headers = ['ACC', 'ACCESSION', 'ACCESSIONS', 'QUERY_ACC', 'HIT_ACC']
-        acc = []
-        for line in clipboard:
-            line = line.strip().split()[0]
-            if ';' in line:
-                line = line.split(';')[0]
-            if not line or line.upper() in headers:
+    def previous_release(self, groups=None):
+        """Returns the most recently used earlier release of the same DAT file source
+        (see dat_source) in the cache (or None).
+        groups: field groups to load (all cached groups if None)"""
+        source = dat_source(self.dat_file)
+        for fingerprint in self.cache.fingerprints('record_versions.pk'):
+            if fingerprint == self.fingerprint:
                 continue
-            if line.endswith('_family'):
-                line = line.replace('_family', '')
-            acc.append(line)
-        return acc
-    
-    # toolbar button functions
-
-    def get_accessions(self):
-        """Gets column of accessions from the clipboard."""
-        try:
-            clipboard = self.root.clipboard_get()
-        except:
-            clipboard = None
-        clipboard = clipboard.splitlines()
-
-        # parse accessions
-        accessions = self._parse_accessions(clipboard)
-        
-        if len(accessions) == 0:
-            self.clear_screen()
-            accessions = []
-            self.acc_read = False
-            self.text.insert("1.0", 'WARNING: Clipboard was empty!')
-            self.status.set("%s", 'WARNING: Clipboard was empty!')
+            saved = self.cache.load(fingerprint, 'record_versions.pk')
+            if saved is not None and saved.get('source') == source:
+                return PreviousRelease(self.cache, fingerprint, saved['records'], groups)
+        return None
+
+    def change_report(self, accessions):
+        """Compares the annotations of a list of proteins to the release the DAT file
+        was updated from. Returns a list of rows (see CHANGE_COLUMNS), or None if the
+        DAT file was not parsed as an update of an earlier release."""
+        saved = self.cache.load(self.fingerprint, 'record_versions.pk') if self.fingerprint else None
+        if saved is None or saved['previous'] is None:
+            return None
+        previous = self.cache.load(saved['previous'], 'record_versions.pk')
+        if previous is None:
+            return None     # earlier release was removed from the cache
+        release = PreviousRelease(self.cache, saved['previous'], previous['records'])
+        rows = []
+        for acc in accessions:
+            annotations = self.lookup(acc)[0]
+            acc_parts = acc.split('|')
+            accession = annotations.accession if annotations else acc_parts[len(acc_parts) // 2]
+            old = release.record(accession)
+            if annotations is None:
+                change, fields = ('deleted', '') if old else ('not found', '')
+            elif old is None:
+                change, fields = 'new', ''
+            elif saved['records'].get(accession, (None, None))[1] == previous['records'][accession][1]:
+                change, fields = 'unchanged', ''
+            else:
+                change = 'changed'
+                fields = '; '.join(name for (name, group, values) in CHANGE_FIELDS
+                                   if (group is None or group in annotations.groups & old.groups)
+                                   and values(annotations) != values(old))
+            rows.append([acc, accession, change, fields if fields else 'na'])
+        return rows
+
+    def require(self, groups):
+        """Makes sure that the optional field groups are loaded (from the cache,
+        or parsed from the DAT file if they have not been parsed before)."""
+        missing = set(groups) - self.groups
+        if not missing:
             return
+        self.groups |= missing
+        self.record_cache.clear()   # (disk layout records are parsed again with the groups)
+        for taxid in list(self.partitions):
+            if isinstance(self.partitions[taxid], dict):
+                self._load_groups(taxid, missing)
+            elif self.layout == 'columnar':
+                del self.partitions[taxid]  # reload the objects to add the groups
+                self.partition(taxid)
+        return
 
-        # make accessions table
-        self.accessions = pd.DataFrame({'Accession': accessions})
-        self.acc_read = True
+    def _load_groups(self, taxid, groups):
+        """Adds cached field groups to the records of a loaded species. Groups that are
+        not cached are parsed together in one pass through the DAT file."""
+        records = self.records(taxid)
+        missing = []
+        for group in sorted(groups):
+            if all(group in x.groups for x in records):
+                continue
+            with self.run_log.stage('load_group', taxid=taxid, group=group):
+                values = self.cache.load(self.fingerprint, 'species_%s_%s.pk' % (taxid, group))
+            if values is None:
+                missing.append(group)   # not parsed yet (or removed from the cache)
+                continue
+            for annotations in records:
+                annotations.set_group(group, values.get(annotations.accession))
+        if missing:
+            self.parse_groups(missing)
+        return
 
-        # echo the accessions to the screen
-        self.echo_dataframe(self.accessions)
-        self.status.set("%s", "%s accessions read from clipboard" % len(self.accessions))
+    def parse_groups(self, groups):
+        """Parses field groups from the DAT file, caches them for every species,
+        and adds them to the loaded species."""
+        with self.run_log.stage('parse_groups', dat_file=self.dat_file, groups=sorted(groups)):
+            count, annotate_dict = self._process_dat_records(groups)
+            self.run_log.count('records_parsed', count)
+        by_species = {}
+        for annotations in annotate_dict.values():
+            by_species.setdefault(annotations.ox, {})[annotations.accession] = annotations
+        for group in groups:
+            for taxid, parsed in by_species.items():
+                values = {acc: x.get_group(group) for (acc, x) in parsed.items()}
+                self.cache.save(values, self.fingerprint, 'species_%s_%s.pk' % (taxid, group))
+                if isinstance(self.partitions.get(taxid), dict):   # (columnar ones are reloaded)
+                    for annotations in self.records(taxid):
+                        annotations.set_group(group, values.get(annotations.accession))
         return
 
-    def select_dat_file(self):
-        """Get UniProt flat format text file (DAT file)."""        
-        ext_list = [('GZip files', '*.gz'), ('DAT files', '*.dat')]
-        message = 'Select a UniProt DAT file'
-        self.dat_file = get_file(self.default, ext_list, message)   # self.root is the root window
+    def select(self, taxid):
+        """Makes taxid the selected species and drops the other species from memory."""
+        self.taxid = taxid
+        self.partitions = {taxid: self.partition(taxid)}
+        self.xrefs = {x: ids for (x, ids) in self.xrefs.items() if x == taxid}
+        self._compact(taxid)
+        return
 
-    def parse_dat_file(self):
-        """Gets UniProt DB file and makes accession maps."""
-        # browse to DAT file
-        self.select_dat_file()
-        
-        # look for pickled annotation dictionary and reload if it exists
-        read_pk = False
-        if os.path.exists(self.dat_file + '.pk'):
-            read_pk = True
-            self.status.set("%s", "reloading DAT file from pickle")
-            pickled_anno = pickle.load(open(self.dat_file + '.pk', 'rb'))
-            try:
-                if (pickled_anno.dat_file != self.dat_file or 
-                    pickled_anno.dat_date != os.path.getctime(self.dat_file)):
-                    read_pk = False
-            except AttributeError:
-                read_pk = False
-            if read_pk:
-                self._annotate_dict = pickled_anno.annotate_dict
-                count = int(len(self._annotate_dict) / 3)
-        if not read_pk:
-            self.status.set("%s", "parsing large DAT file (be patient)")
-            count, self._annotate_dict = self._process_dat_records() # parse DAT file
-                        
-            # save the parsed file results for next time
-            pickled_anno = AnnotationPickle(self.dat_file, os.path.getctime(self.dat_file), 
-                                            self._annotate_dict)
-            pickle.dump(pickled_anno, open(self.dat_file + '.pk', 'wb'), protocol = 2)    # protocol 2 to make compatible with python 2
-
-        print('DB count: %s, dict size: %s' % (count, len(self._annotate_dict)))
-        print("DONE processing annotations")
-        self.status.set("%s", 'DB count: %s, dict size: %s' % (count, len(self._annotate_dict)))
-        self.dat_read = True
-##        writeFile(self)   # optionally write annotations to separate files by category
-##        self.acc_mapping()  # lookup the annotations for the accessions
-##        self.status.set("%s", "%s protein annotation records parsed" % len(self.annotations))
-        
-    # DAT file processing
-    def _process_dat_records(self):
-        """Parses all records in a gzipped DAT file."""
-        buff = []
-        count = 0
-        dat_dict = {}
-        try:
-            for line in gzip.open(self.dat_file, 'rt'):
-                line = line.rstrip()
-                if line == '//':
-                    annotations = Annotations()
-                    annotations.parse_record(buff)
-                    dat_dict[annotations.identifier] = annotations
-                    dat_dict[annotations.accession] = annotations
-                    dat_dict[annotations.fasta_accession] = annotations
-                    buff = []
-                    count += 1
-                else:
-                    buff.append(line)
-        except ValueError:
-            for line in gzip.open(self.dat_file):
+    def partition(self, taxid):
+        """Returns the annotation dictionary for one species (loaded if needed)."""
+        if taxid in self.partitions:
+            return self.partitions[taxid]
+        if taxid not in self.species_counts:
+            return {}
+        if self.layout == 'disk':
+            self.partitions[taxid] = self._disk_partition(taxid)
+            return self.partitions[taxid]
+        with self.run_log.stage('load_species', taxid=taxid):
+            pickled_anno = self.cache.load(self.fingerprint, 'species_%s.pk' % taxid)
+        if pickled_anno is None:    # cache file was removed
+            self.partitions[taxid] = self.parse_species(taxid)
+            self._compact(taxid)
+            return self.partitions[taxid]
+        self.partitions[taxid] = pickled_anno.annotate_dict
+        self._load_groups(taxid, self.groups)
+        self._compact(taxid)
+        return self.partitions[taxid]
+
+    def parse_species(self, taxid):
+        """Parses one species from the DAT file again and caches it (with the loaded
+        field groups). Records of the other species are skipped."""
+        with self.run_log.stage('parse_species', dat_file=self.dat_file, taxid=taxid,
+                                groups=sorted(self.groups)):
+            with gc_paused():
+                count, partition = self._process_dat_records(self.groups, taxid=taxid)
+            self.run_log.count('records_parsed', count)
+        self._save_partition(taxid, partition, self.groups)
+        return partition
+
+    def _compact(self, taxid):
+        """Converts a loaded species to dictionary-encoded columns (columnar layout only)."""
+        partition = self.partitions.get(taxid)
+        if self.layout != 'columnar' or not isinstance(partition, dict) or not partition:
+            return
+        import columnar_store
+        with self.run_log.stage('compact', taxid=taxid):
+            records = list({id(x): x for x in partition.values()}.values())
+            self.partitions[taxid] = columnar_store.ColumnarStore.from_records(records, Annotations,
+                                                                               partition)
+        return
+
+    def _disk_partition(self, taxid):
+        """Returns the disk-backed store for one species (disk layout only)."""
+        records_file = self.cache.path(self.fingerprint, 'records.z')
+        with self.run_log.stage('load_index', taxid=taxid):
+            index = self.cache.load(self.fingerprint, 'records_%s_index.pk' % taxid)
+        if index is None or not os.path.exists(records_file):
+            self.write_records()    # not made yet (or removed from the cache)
+            index = self.cache.load(self.fingerprint, 'records_%s_index.pk' % taxid)
+        self.cache.touch(records_file)
+        return record_store.DiskStore(records_file, index, self._parse_lines, self.record_cache)
+
+    def _parse_lines(self, prot_rec):
+        """Parses a record from the record file with the loaded field groups."""
+        annotations = Annotations()
+        annotations.parse_record(prot_rec, sorted(self.groups))
+        return annotations
+
+    def write_records(self):
+        """Copies the DAT file records to a compressed record file in the cache folder
+        with an index of lookup keys for each species (disk layout)."""
+        with self.run_log.stage('write_records', dat_file=self.dat_file):
+            writer = record_store.RecordWriter(self.cache.path(self.fingerprint, 'records.z'))
+            indexes = {}
+            xrefs = {}
+            buff = []
+            for line in fast_gzip.read_lines(self.dat_file):
                 line = line.rstrip()
                 if line == '//':
                     annotations = Annotations()
-                    annotations.parse_record(buff)
-                    dat_dict[annotations.identifier] = annotations
-                    dat_dict[annotations.accession] = annotations
-                    dat_dict[annotations.fasta_accession] = annotations
+                    annotations.parse_record(buff, [])     # only the basic fields
+                    keys = [annotations.identifier, annotations.accession,
+                            annotations.fasta_accession]
+                    index = indexes.setdefault(annotations.ox, record_store.RecordIndex())
+                    index.add(keys, writer.write(buff))
+                    add_xrefs(xrefs.setdefault(annotations.ox, {}), buff, annotations.accession)
                     buff = []
-                    count += 1
                 else:
                     buff.append(line)
-        except OSError:
-            for line in open(self.dat_file):
+            writer.close()
+            self.run_log.count('records_written', sum(len(x) for x in indexes.values()))
+            self.species_counts = {taxid: len(index) for (taxid, index) in indexes.items()}
+            for taxid, index in indexes.items():
+                self.cache.save(index, self.fingerprint, 'records_%s_index.pk' % taxid)
+            self._save_xrefs(xrefs)
+            self.cache.save(self.species_counts, self.fingerprint, 'species_counts.pk')
+        return
+
+    def _save_xrefs(self, xrefs):
+        """Caches the cross-reference IDs of every species without the ambiguous ones.
+        xrefs: dictionaries of ID -> accession (or None) keyed by taxonomy number"""
+        self.xrefs = {}
+        for taxid in self.species_counts:
+            ids = {x: acc for (x, acc) in xrefs.get(taxid, {}).items() if acc is not None}
+            self.cache.save(ids, self.fingerprint, 'xrefs_%s.pk' % taxid)
+        return
+
+    def index_xrefs(self):
+        """Collects the cross-reference IDs of every species from the DAT file DR lines
+        (for cached results made before the IDs were saved with them)."""
+        with self.run_log.stage('index_xrefs', dat_file=self.dat_file):
+            xrefs = {}
+            buff = []
+            for line in fast_gzip.read_lines(self.dat_file):
                 line = line.rstrip()
                 if line == '//':
                     annotations = Annotations()
-                    annotations.parse_record(buff)
-                    dat_dict[annotations.identifier] = annotations
-                    dat_dict[annotations.accession] = annotations
-                    dat_dict[annotations.fasta_accession] = annotations
+                    annotations.get_ox(buff)
+                    add_xrefs(xrefs.setdefault(annotations.ox, {}), buff, record_accession(buff))
                     buff = []
-                    count += 1
                 else:
                     buff.append(line)
-            
-        return count, dat_dict
-               
-    def blast_mapping(self):
-        """Use Blast ortholog mapping to model organism's DAT file"""
-        # check is accessions have been loaded
-        if not self.acc_read:
-            self.clear_screen()
-            self.print_string('Please load some accessions from the clipboard!')
-            return
+            self._save_xrefs(xrefs)
+        return
 
-        # browse to BLAST map TXT file
-        ext_list = [('Text files', '*.txt')]
-        message = 'Select a BLAST mapping file'
-        blast_map_file = get_file(self.default, ext_list, message)
-        if not blast_map_file: return   # cancel button response
-        
-        # read the mapping file
-        try:
-            blast = pd.read_csv(blast_map_file, sep='\t', skiprows=5)       
-            # drop some columns we do not need
-            if 'match_status' in blast.columns:
-                keep = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'match_status']
-            else:
-                keep = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'status']   # older BLAST map files
-            blast = blast.dropna(thresh=4) # this should drop rows after the main table
-            self.blast_brief = blast[keep]
-        except KeyError:
-            blast = pd.read_csv(blast_map_file, sep='\t', skiprows=4)       
-            # drop some columns we do not need
-            if 'match_status' in blast.columns:
-                keep = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'match_status']
-            else:
-                keep = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'status']   # older BLAST map files 
-            blast = blast.dropna(thresh=4) # this should drop rows after the main table
-            self.blast_brief = blast[keep]
-        self.blast_read = True
-
-
-        # make the accession mapping dictionary (allow for parsed accessions) 
-        for query, hit in zip(self.blast_brief['query_acc'], self.blast_brief['hit_acc']):
-            self.blast_map[query] = hit
-            if len(query.split('|')) == 3:     # UniProt format
-                   self.blast_map[query.split('|')[1]] = hit
-                   self.blast_map[query.split('|')[2]] = hit
-            if (len(query.split('|')) == 1) and ('.' in query): # NCBI and Ensembl format
-                self.blast_map[query.split('.')[0]] = hit
-            
-            
-        # save some of the BLAST results in a dictionary keyed by query_acc
-        match_count = self.get_blast_matches()
-                
-        # write BLAST results to screen and cliboard
-        self.echo_dataframe(self.blast_table)
-        self.root.clipboard_clear()
-        self.root.clipboard_append(self.blast_table.to_csv(sep='\t', line_terminator='\r', index=False))
-        self.status.set("%s", "%s BLAST mappings read in (echoed to screen and clipboard)" % match_count)
+    def cross_references(self, taxid=None):
+        """Returns the lookups by external IDs (see CrossReferences) for a species
+        (the selected species by default)."""
+        taxid = taxid if taxid else self.taxid
+        if taxid not in self.xrefs:
+            ids = None
+            if self.fingerprint and taxid in self.species_counts:
+                ids = self.cache.load(self.fingerprint, 'xrefs_%s.pk' % taxid)
+                if ids is None:
+                    self.index_xrefs()      # older cache (or removed from the cache)
+                    ids = self.cache.load(self.fingerprint, 'xrefs_%s.pk' % taxid)
+            self.xrefs[taxid] = ids if ids else {}
+        return CrossReferences(self.xrefs[taxid], self.partition(taxid))
+
+    def publish(self, taxid=None):
+        """Writes a species (the selected species by default) with the loaded field groups
+        to a flat file in the cache folder that worker processes can attach to without
+        copying it (see shared_store.py and attach). Returns the file name."""
+        import columnar_store
+        import shared_store
+        taxid = taxid if taxid else self.taxid
+        groups = sorted(self.groups)
+        file_name = self.cache.path(self.fingerprint, 'shared_%s_%s.col' %
+                                    (taxid, '-'.join(groups) if groups else 'basic'))
+        if os.path.exists(file_name):
+            self.cache.touch(file_name)
+            return file_name
+        with self.run_log.stage('publish', taxid=taxid, groups=groups):
+            partition = self.partition(taxid)
+            if isinstance(partition, MergedPartition):
+                partition = partition.as_dict()
+            if isinstance(partition, dict):
+                records = list({id(x): x for x in partition.values()}.values())
+                partition = columnar_store.ColumnarStore.from_records(records, Annotations, partition)
+            elif self.layout == 'disk':
+                records = partition.records()
+                keys = {key: records[row] for (key, row) in partition.index.keys.items()}
+                partition = columnar_store.ColumnarStore.from_records(records, Annotations, keys)
+            shared_store.publish(partition, file_name, {'taxid': taxid, 'groups': groups,
+                                                        'dat_file': self.dat_file})
+        self.cache.evict(self.fingerprint)
+        return file_name
+
+    @classmethod
+    def attach(cls, file_name, run_log=None):
+        """Returns a read-only store of the species written by publish (e.g. in a worker
+        process). The operating system shares the store memory with every process
+        that attaches to the file."""
+        import shared_store
+        partition, info = shared_store.attach(file_name, Annotations)
+        store = cls(run_log=run_log)
+        store.dat_file = info['dat_file']
+        store.taxid = info['taxid']
+        store.groups = set(info['groups'])
+        store.partitions = {store.taxid: partition}
+        store.species_counts = {store.taxid: len(partition)}
+        return store
+
+    def cache_stats(self):
+        """Returns the record cache statistics (hits, misses, etc.) for the disk layout."""
+        return self.record_cache.stats()
+
+    def add(self, annotate_dict):
+        """Adds annotations from another source (e.g. a TrEMBL streaming scan)."""
+        self.extra.update(annotate_dict)
         return
-    
-    def get_blast_matches(self):
-        """Gets BLAST info for the loaded accessions."""
-        # save some of the BLAST results in a dictionary keyed by query_acc
-        if not self.blast_read:
-            return 0
-        self.blast_matches = {}
-        row_count = 1
-        for row_tuple in self.blast_brief.iterrows():
-            row = row_tuple[1]
-            acc = row['query_acc']
-            self.blast_matches[row['query_acc']] = [str(x) for x in row]
-            row_count += 1
-            if len(acc.split('|')) == 3:     # UniProt format
-                   self.blast_matches[acc.split('|')[1]] = [str(x) for x in row]
-                   self.blast_matches[acc.split('|')[2]] = [str(x) for x in row]
-            if (len(acc.split('|')) == 1) and ('.' in acc): # NCBI and Ensembl format
-                self.blast_matches[acc.split('.')[0]] = [str(x) for x in row]
-
-        # organize by accession list (if loaded from clipboard)
-        if self.acc_read:
-            keys = list(self.accessions['Accession'])
-        else:
-            keys = self.blast_matches.keys()
 
-        # create a pandas dataframe for the BLAST data
-        rows = []
-        for key in keys:
-            try:
-                rows.append([key] + self.blast_matches[key])
-            except KeyError:
-                rows.append([key, 'NA', 'NA', 'NA', 'NA', 'NA'])
-
-        # make a pandas dataframe
-        self.blast_table = pd.DataFrame(rows, columns = ['Index', 'query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'match_status'])
-
-        return row_count            
-
-    def add_annotations(self):
-        """Prints annotations to the window."""
-        # make sure we have accessions and have parsed a DAT file
-        return_flag = False
-        self.clear_screen()
-        if not self.acc_read:
-            self.print_string('Please load some accessions from the clipboard!')
-            return_flag = True
-        if not self.dat_read:
-            self.print_string('Please parse a DAT file!')
-            return_flag = True
-        if return_flag:
-            self.status.set("%s", "Annotation lookup failed")
-            return
+    def count(self):
+        """Total number of records in the DAT file (and added records)."""
+        return sum(self.species_counts.values()) + len(set(id(x) for x in self.extra.values()))
+
+    def records(self, taxid=None):
+        """Returns the list of distinct annotation objects for a species
+        (the selected species by default)."""
+        partition = self.partition(taxid if taxid else self.taxid)
+        if not isinstance(partition, dict):
+            return partition.records()  # (columnar and disk layouts)
+        return list({id(x): x for x in partition.values()}.values())
+
+    def _sequence_index(self, kind, index_class, build):
+        """Loads a cached sequence index for the selected species or builds and caches it.
+        kind: string; cache file suffix
+        index_class: class with build, save, and load methods
+        build: function taking the new index object and the list of records to index"""
+        cache_file = None
+        if self.fingerprint:
+            cache_file = self.cache.path(self.fingerprint, '%s_%s.npz' % (kind, self.taxid))
+            if os.path.exists(cache_file):
+                self.cache.touch(cache_file)
+                return index_class.load(cache_file)
+        index = index_class()
+        self.require(['sequence'])
+        build(index, [x for x in self.records() if x.sequence])
+        if cache_file:
+            index.save(cache_file)
+            self.cache.evict(self.fingerprint)
+        return index
 
-        # lookup the annotations for the accessions
-        self.get_blast_matches()
-        self.acc_mapping()
-        print("%s protein annotation records parsed" % len(self.annotations))
-        self.status.set("%s", "%s protein annotation records parsed" % len(self.annotations))
+    def kmer_index(self):
+        """Returns a k-mer index of the selected species sequences (cached after first use)."""
+        import ortholog_mapper
+        def build(index, records):
+            index.build([x.fasta_accession for x in records], [x.description() for x in records],
+                        [x.sequence for x in records])
+        return self._sequence_index('kmers', ortholog_mapper.KmerIndex, build)
+
+    def peptide_index(self):
+        """Returns a peptide matching index of the selected species sequences
+        (cached after first use)."""
+        import peptide_mapper
+        def build(index, records):
+            index.build([x.fasta_accession for x in records], [x.sequence for x in records])
+        return self._sequence_index('peptides', peptide_mapper.PeptideIndex, build)
+
+    def sequence_index(self):
+        """Returns a dictionary of sequence digest -> (FASTA accession, description)
+        for the selected species."""
+        self.require(['sequence'])
+        return {x.seq_md5: (x.fasta_accession, x.description()) for x in self.records()
+                if x.seq_md5}
+
+    def features(self, acc, start, end=None, types=None):
+        """Returns the features of a protein that overlap residues start to end
+        as a list of (type, start, end, note) tuples."""
+        self.require(['features'])
+        annotations = self.lookup(acc)[0]
+        if annotations is None:
+            return []
+        return annotations.features.overlapping(start, end, types)
+
+    def annotate_sites(self, sites, types=None):
+        """Finds the features for many protein sites at once.
+        sites: iterable of (accession, position) or (accession, start, end) tuples
+        types: optional list of feature type names to keep
+        Returns a list of rows (see SITE_COLUMNS), one for each overlapping feature
+        (or one row of "na" values if there are none)."""
+        self.require(['features'])
+        rows = []
+        found = {}  # accession lookups are reused
+        for site in sites:
+            acc, start, end = site[0], int(site[1]), int(site[-1])
+            if acc not in found:
+                found[acc] = self.lookup(acc)[0]
+            features = found[acc].features.overlapping(start, end, types) if found[acc] else []
+            if not features:
+                rows.append([acc, start, end, 'na', 'na', 'na', 'na'])
+            for feature in features:
+                rows.append([acc, start, end] + list(feature))
+        return rows
+
+    def annotation_frame(self, build=False):
+        """Returns the precomputed AnnotationFrame for the selected species (or None).
+        The frame is made and cached first if build is True."""
+        if self.taxid in self.frames:
+            return self.frames[self.taxid]
+        if not self.fingerprint:
+            return None
+        kind = 'frame_%s.pk' % self.taxid
+        with self.run_log.stage('load_frame', taxid=self.taxid):
+            frame = self.cache.load(self.fingerprint, kind)
+        if frame is None and build:
+            from annotation_tables import AnnotationFrame
+            species = {taxid: value for (value, taxid) in SPECIES_TAXIDS.items()}.get(self.taxid, 1)
+            with self.run_log.stage('precompute_frame', taxid=self.taxid):
+                frame = AnnotationFrame.build(self, self.dat_file, species)
+            self.cache.save(frame, self.fingerprint, kind)
+        if frame is not None:
+            self.frames[self.taxid] = frame
+        return frame
+
+    def loaded_count(self):
+        """Number of records in the selected species."""
+        return self.species_counts.get(self.taxid, 0)
+
+    def _search_order(self, other_species=False):
+        """Generator of annotation dictionaries in lookup priority order."""
+        yield self.partition(self.taxid)
+        yield self.extra
+        yield self.cross_references()
+        if other_species:
+            for taxid in sorted(self.species_counts):
+                if taxid != self.taxid:
+                    yield self.species_records(taxid)
+
+    def species_records(self, taxid):
+        """Returns the basic annotations of a species that is not selected without
+        keeping them loaded (disk-backed in the disk layout)."""
+        if taxid in self.partitions:
+            return self.partitions[taxid]
+        if self.layout == 'disk':
+            return self._disk_partition(taxid)
+        with self.run_log.stage('load_species', taxid=taxid):
+            pickled_anno = self.cache.load(self.fingerprint, 'species_%s.pk' % taxid)
+        return pickled_anno.annotate_dict if pickled_anno is not None else {}
+
+    def lookup(self, acc, other_species=False):
+        """Returns annotations and alias type for an accession, or (None, None).
+        The full accession is tried before the identifier or accession parts of
+        UniProt FASTA style accessions. RefSeq, Ensembl, etc. accessions of the
+        selected species are found with the DR line cross-references.
+        other_species: also search the other species (slow; they are loaded for
+        each lookup and only have the basic fields)"""
+        keys = [('lookup_exact', acc)]
+        acc_parts = acc.split('|')
+        if len(acc_parts) == 3:     # this is assuming UniProt format
+            keys += [('lookup_identifier', acc_parts[2]), ('lookup_accession', acc_parts[1])]
+        for annotate_dict in self._search_order(other_species):
+            if isinstance(annotate_dict, CrossReferences):
+                if acc in annotate_dict:
+                    return annotate_dict[acc], 'lookup_xref'
+                continue
+            for alias_type, key in keys:
+                if key in annotate_dict:
+                    return annotate_dict[key], alias_type
+        return None, None
+
+    def _save_partition(self, taxid, partition, groups):
+        """Caches the basic annotations for one species and each parsed field group."""
+        basic = {}
+        copies = {}     # one copy for each record (records have several keys)
+        for key, annotations in partition.items():
+            if id(annotations) not in copies:
+                copies[id(annotations)] = annotations.basic_copy()
+            basic[key] = copies[id(annotations)]
+        pickled_anno = AnnotationPickle(self.dat_file, os.path.getctime(self.dat_file),
+                                        basic, self.fingerprint)
+        self.cache.save(pickled_anno, self.fingerprint, 'species_%s.pk' % taxid)
+        records = list({id(x): x for x in partition.values()}.values())
+        for group in groups:
+            values = {x.accession: x.get_group(group) for x in records}
+            self.cache.save(values, self.fingerprint, 'species_%s_%s.pk' % (taxid, group))
+        return
 
-        # format the annotation table (with or without the BLAST mapping info)
-        if self.blast_read:
-            annot_table = pd.merge(self.blast_table, AnnotationTable(self).table, on='Index')
-        else:
-            annot_table = AnnotationTable(self).table
-
-        # write annotations to screen and clipboard
-        self.echo_dataframe(annot_table)
-        self.root.clipboard_clear()
-        self.root.clipboard_append(annot_table.to_csv(sep='\t', line_terminator='\r', index=False))
-        self.status.set("%s", "Annotations shown above and written to clipboard")
-        print('Annotations added for %s proteins' % len(self.accessions))
-        
-    def acc_mapping(self):
-        """Looks up annotations given loaded accessions."""
-        # save annotations in a list (should be matched to self.accessions)
-        self.annotations = []
-        fail_count = 0
-        for acc in self.accessions.iloc[:, 0]:
-            if acc in self.blast_map:
-                acc = self.blast_map[acc]   # work with ortholog accession if it exists
-            if acc in self._annotate_dict:
-                self.annotations.append(self._annotate_dict[acc])
+    def _process_dat_records(self, groups=None, previous=None, xrefs=None, taxid=None):
+        """Parses all records in a gzipped (or plain text) DAT file.
+        groups: optional field groups to parse (all if None)
+        previous: optional PreviousRelease; unchanged records are copied from it
+        xrefs: optional dictionary for the cross-reference IDs of each species (see add_xrefs)
+        taxid: optional taxonomy number of the only species to parse
+        Returns the number of records parsed and the annotation dictionary."""
+        buff = []
+        count = 0
+        dat_dict = {}
+        self.versions = {}
+        for line in fast_gzip.read_lines(self.dat_file):   # uses fastest available gzip backend
+            line = line.rstrip()
+            if line == '//':
+                if taxid is not None and record_taxid(buff) != taxid:
+                    buff = []
+                    continue
+                digest = record_digest(buff)
+                annotations = None
+                if previous:
+                    annotations = previous.unchanged(record_accession(buff), digest,
+                                                     FIELD_GROUPS if groups is None else groups)
+                if annotations is None:
+                    annotations = Annotations()
+                    annotations.parse_record(buff, groups)
+                    count += 1
+                self.versions[annotations.accession] = (annotations.ox, digest)
+                if xrefs is not None:
+                    add_xrefs(xrefs.setdefault(annotations.ox, {}), buff, annotations.accession)
+                dat_dict[annotations.identifier] = annotations
+                dat_dict[annotations.accession] = annotations
+                dat_dict[annotations.fasta_accession] = annotations
+                buff = []
             else:
-                temp_acc = acc
-                acc_parts = acc.split('|')
-                if len(acc_parts) == 3:     # this is assuming UniProt format
-                    if acc_parts[2] in self._annotate_dict:
-                        temp_acc = acc_parts[2]
-                    else:
-                        temp_acc = acc_parts[1]
-                if temp_acc in self._annotate_dict:
-                    self.annotations.append(self._annotate_dict[temp_acc])
-                else:
-                    print('failed lookup:', acc)
-                    fail_count += 1
-                    # need a blank annotation object
-                    self.annotations.append(Annotations())
-                     
-        print('\nDone fetching annotations for %s accessions' % len(self.annotations))
-        print('%d lookups failed' % fail_count)
-        self.status.set("%s", "%s protein accessions looked up" % len(self.accessions))
-       
-    def clear_screen(self):
-        """Clears the window."""
-        self.text.delete("1.0", END)
-        self.status.set("%s", "Screen Cleared")
+                buff.append(line)
             
-    def clear_data(self):
-        """Clears the window contents and clipboard."""
-        self.text.delete("1.0", END)
-        self.root.clipboard_clear()
-        self.root.clipboard_append("")
-        self.dat_file = None
-        self.dat_read = False
-        self.accessions = []
-        self.acc_read = False
-        self.blast_read = False
-        self.status.set("%s", "Data and screen cleared")
-    
-    def print_help(self):
-        """Prints some help info to the window."""
-        self.clear_screen()
-        help_text = \
-"""Program add_protein_annotations.py, version 1.0
-
-Takes a list of protein accessions from a PAW results file (typically Excel) for human,
-mouse, or arabidopsis and adds additional annotations from UniProt (Swiss-Prot) DAT files.
-
-"Get accessions" => reads UniProt accessions from the clipboard and echos them to the screen.
-
-"Parse DAT file" => parses a selected UniProt DAT file and extracts annotations of interest.
-
-"Blast mapping" => uses ortholog mapping information from BLAST to bootstrap proteins
-from non-model organisms to human, mouse, or arabidopsis orthologs.
-
-"Add annotations" => maps the UniPort accessions from the clipboard to the
-annotations from the UniProt DAT file. Writes results to screen and clipboard.
-
-"Reset" => clears data and the screen text window.
-
-"Help" => prints this information.
-
-"Quit" => ends the application.
+        return count, dat_dict
 
-Written by Kyra Patton, OHSU, 2016.
+def _parse_source(dat_file, folder, max_mb, layout, groups):
+    """Parses a DAT file into the parse cache (run in a worker process by MergedStore)."""
+    store = AnnotationStore(dat_file, ParseCache(folder, max_mb), RunLog(), layout)
+    store.groups = set(groups)
+    if layout == 'disk':
+        store.write_records()
+    else:
+        store.parse()
+    return dat_file
+
+class MergedStore(AnnotationStore):
+    """Several DAT files used together in priority order (e.g. a custom reviewed subset,
+    a human-only download, and the 3-species file from keywlist_download.py). Each
+    source is an AnnotationStore with its own cache files. The sources are loaded at
+    the same time (DAT files that are not cached yet are parsed in separate processes)
+    and the species of every source are merged (see MergedPartition), so an accession
+    is found in the highest priority source that has it.
+    """
+    def __init__(self, dat_files, cache=None, run_log=None, layout=None, budget_mb=None):
+        """dat_files: DAT files in priority order
+        other arguments are the same as AnnotationStore"""
+        AnnotationStore.__init__(self, None, cache, run_log, layout, budget_mb)
+        self.dat_files = list(dat_files)
+        self.dat_file = self.dat_files[0]   # (for the keyword list file location)
+        self.sources = [AnnotationStore(x, self.cache, self.run_log, self.layout, budget_mb)
+                        for x in self.dat_files]
+        for source in self.sources:
+            source.record_cache = self.record_cache     # (one memory budget for all sources)
+        combined = ' '.join(x.fingerprint for x in self.sources)
+        self.fingerprint = 'merged_' + hashlib.sha1(combined.encode()).hexdigest()[:16]
+        return
 
-(and Phil Wilmarth, OHSU, 2016-2019)"""
-        self.text.insert("1.0", help_text)
-        self.status.set("%s", "Help Text")
+    def _each_source(self, method, *args):
+        """Calls a method of every source at the same time (one thread each; one after
+        another when profiling) and returns the results."""
+        if self.run_log.profile or len(self.sources) == 1:
+            return [getattr(x, method)(*args) for x in self.sources]
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(len(self.sources)) as pool:
+            futures = [pool.submit(getattr(x, method), *args) for x in self.sources]
+            return [x.result() for x in futures]
+
+    def open(self, taxid, groups=()):
+        """Loads the selected species of every source (parsing new DAT files first).
+        groups: optional field groups to parse and load"""
+        self.groups = set(groups)
+        new = [x.dat_file for x in self.sources
+               if not os.path.exists(self.cache.path(x.fingerprint, 'species_counts.pk'))]
+        if len(new) > 1 and not self.run_log.profile:
+            from concurrent.futures import ProcessPoolExecutor
+            with self.run_log.stage('parse_sources', sources=len(new)):
+                with ProcessPoolExecutor(min(len(new), os.cpu_count() or 1)) as pool:
+                    list(pool.map(_parse_source, new, [self.cache.folder] * len(new),
+                                  [self.cache.max_bytes / 2**20] * len(new),
+                                  [self.layout] * len(new), [sorted(self.groups)] * len(new)))
+        with self.run_log.stage('open_sources', sources=len(self.sources)):
+            self._each_source('open', taxid, sorted(self.groups))
+        self.species_counts = {}
+        for source in self.sources:
+            for x, count in source.species_counts.items():
+                self.species_counts[x] = self.species_counts.get(x, 0) + count
+        self._merge(taxid)
+        return
 
-    def echo_dataframe(self, frame):
-        """Echoes the data from the clipboard to the window."""
-        self.clear_screen()
-        self.text.insert(CURRENT, frame.to_string(index=False))
-        self.text.insert(CURRENT, '\n')
+    def _merge(self, taxid):
+        """Makes taxid the selected species and drops the merged indexes."""
+        self.taxid = taxid
+        self.partitions = {}
+        self.xrefs = {}
+        self.partition(taxid)
+        return
 
-    def print_string(self, string):
-        self.text.insert(CURRENT, string)
-        self.text.insert(CURRENT, '\n')        
-        
-    def quit_me(self):
-        """Quits the application."""
-        self.status.set("%s", "Bye")
-        self.root.withdraw()
-        self.root.update_idletasks()
-        self.root.quit()
+    def select(self, taxid):
+        """Makes taxid the selected species of every source."""
+        self._each_source('select', taxid)
+        self._merge(taxid)
         return
 
-class AnnotationTable:
-    """Collects all of the annotations into dataframes."""
-    def __init__(self, parent):
-        """parent: calling object"""
-        self.parent = parent                        # pointer to calling object
-        self.dat_file = self.parent.dat_file        # Swiss-Prot DAT file
-        self.accessions = self.parent.accessions    # accessions to be annotated
-        self.annotations = self.parent.annotations  # annotations from DAT file
-        self.reports_folder = None                  # folder to write rports to
-        self.default = self.parent.default          # set a default location for dialog boxes
-        
-        self.table = None           # final table for display and export to clipboard
-        self.basic_table = None     # table for the general annotations
-        self.kw_table = None        # table for the key words
-        self.mgi_table = None       # table for MGI info if mouse
-        self.pw_table = None        # pathways table
-        self.go_table = None        # GO terms table
-        
-        self.make_main_table()
-        if self.parent.radio_var.get() == 2:
-            self.make_mgi_table()
-        if self.parent.kw_var.get() == 1:
-            self.make_kw_table(self.accessions)
-        if self.parent.pw_var.get() == 1:
-            self.make_pw_table()
-        if self.parent.go_var.get() == 1:
-            self.make_go_table()
-        self.concatenate()
+    def require(self, groups):
+        """Makes sure that the optional field groups are loaded for every source."""
+        missing = set(groups) - self.groups
+        if not missing:
+            return
+        self.groups |= missing
+        self.record_cache.clear()
+        self._each_source('require', sorted(missing))
+        self.partitions = {}    # (columnar sources reload their species)
         return
-    
-    def make_main_table(self):
-        """Creates a dataframe of all the non-optional annotations."""
-        keys = ['Index', 'Primary Protein Name', 'Alternative Protein Names', 'Identifier', 'Accession',
-                'Other Accessions', 'UniProt Gene Name', 'Other Gene Synonyms', 
-                'Species Name', 'Taxonomy Number', 'Key Words']
-        df_dict = {k: [] for k in keys}
-        for acc in self.accessions.iloc[:, 0]:
-            df_dict['Index'].append(acc)
-        for anno in self.annotations:
-            df_dict['Primary Protein Name'].append(anno.name)
-            df_dict['Alternative Protein Names'].append(anno.other_names)
-            df_dict['Accession'].append(anno.accession)
-            df_dict['Identifier'].append(anno.identifier)
-            df_dict['Other Accessions'].append(anno.other_accessions)
-            if anno.gene:
-                df_dict['UniProt Gene Name'].append('="%s"' % anno.gene)
-            else:
-                df_dict['UniProt Gene Name'].append('na')
-            df_dict['Other Gene Synonyms'].append(anno.other_genes)
-            df_dict['Species Name'].append(anno.os)
-            df_dict['Taxonomy Number'].append(anno.ox)
-            df_dict['Key Words'].append(anno.keywords)
-            
-            #convert annotations that are type list to semicolon separated strings
-            for k in keys:
-                if type(df_dict[k][-1]) == list:
-                    df_dict[k][-1] = '; '.join(df_dict[k][-1]) # use join method
-
-        self.basic_table = pd.DataFrame.from_dict(df_dict)
-        self.basic_table = self.basic_table[keys]   # put the table columns in the order in keys
-        self.basic_table['UniProt Link'] = self.basic_table['Accession'].apply(self.add_uniprot_hyperlinks)
-        if self.parent.kw_var.get() == 1:
-            self.kw_table = pd.DataFrame(df_dict['Key Words'], columns=['Key Words'])
-        self.basic_table = self.basic_table.fillna('na')
-        self.basic_table[self.basic_table == ''] = 'na'
+
+    def partition(self, taxid):
+        """Returns the merged species of all of the sources (loaded if needed)."""
+        if taxid not in self.partitions:
+            if taxid not in self.species_counts:
+                return {}
+            parts = [x.partition(taxid) for x in self.sources]
+            with self.run_log.stage('merge_sources', taxid=taxid, sources=len(parts)):
+                self.partitions[taxid] = MergedPartition(parts)
+        return self.partitions[taxid]
+
+    def cross_references(self, taxid=None):
+        """Returns the lookups by external IDs for a species of all of the sources."""
+        taxid = taxid if taxid else self.taxid
+        if taxid not in self.xrefs:
+            ids = {}
+            for source in reversed(self.sources):
+                ids.update(source.cross_references(taxid).ids)
+            self.xrefs[taxid] = ids
+        return CrossReferences(self.xrefs[taxid], self.partition(taxid))
+
+    def count(self):
+        """Total number of records in all of the DAT files (and added records)."""
+        return (sum(sum(x.species_counts.values()) for x in self.sources) +
+                len(set(id(x) for x in self.extra.values())))
+
+    def species_records(self, taxid):
+        """Returns the merged basic annotations of a species that is not selected
+        without keeping them loaded."""
+        if taxid in self.partitions:
+            return self.partitions[taxid]
+        return MergedPartition([x.species_records(taxid) for x in self.sources])
+
+    def loaded_count(self):
+        """Number of distinct records in the selected species."""
+        return len(self.partition(self.taxid))
+
+class ParseCache:
+    """Per-user folder of parsed DAT file results keyed by DAT file contents.
+    The fingerprint is the file size plus a hash of the first and last blocks of the
+    file, so copies of the same DAT file anywhere on disk (or on a read-only share)
+    share one cache. Least recently used files are deleted when the folder gets
+    bigger than the size cap (ANNOTATOR_CACHE_MB environment variable, default 4 GB).
+    """
+    def __init__(self, folder=None, max_mb=None):
+        """folder: cache location (default is in the per-user folder)
+        max_mb: size cap for the cache folder in MB"""
+        if folder is None:
+            folder = os.path.join(get_user_folder(), 'dat_cache')
+        if max_mb is None:
+            max_mb = float(os.environ.get('ANNOTATOR_CACHE_MB', 4096))
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.max_bytes = int(max_mb * 2**20)
         return
-            
-    def add_uniprot_hyperlinks(self, acc):
-        """Adds hyperlinks to UniProt website."""
-        if not acc:
+
+    def fingerprint(self, file_name, block_size=2**20):
+        """Returns a content fingerprint string for a (possibly very large) file."""
+        size = os.path.getsize(file_name)
+        digest = hashlib.sha1(str(size).encode())
+        with open(file_name, 'rb') as fin:
+            digest.update(fin.read(block_size))
+            if size > block_size:
+                fin.seek(max(block_size, size - block_size))
+                digest.update(fin.read(block_size))
+        return '%s_%s' % (size, digest.hexdigest()[:16])
+
+    def path(self, fingerprint, kind='annotations.pk'):
+        """Full path of a cache file for a fingerprint."""
+        return os.path.join(self.folder, '%s_v%d_%s' % (fingerprint, CACHE_VERSION, kind))
+
+    def load(self, fingerprint, kind='annotations.pk'):
+        """Returns the unpickled cache contents or None if not cached."""
+        cache_file = self.path(fingerprint, kind)
+        try:
+            with open(cache_file, 'rb') as fin, gc_paused():
+                contents = pickle.load(fin)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
             return None
-        else:
-            return ('=hyperlink("http://www.uniprot.org/uniprot/' + acc + '", "' + acc + '")') 
-            
-    def make_mgi_table(self):
-        """Makes table of MGI annotations."""
-        mgi_dict = {}
-        mgi_dict['MGI Accession'] = []
-        mgi_dict['MGI Gene Name'] = []
-        mgi_dict['MGI Link'] = []
-        for anno in self.annotations:
-            mgi_dict['MGI Accession'].append(anno.mgi_acc)
-            if anno.mgi_acc:
-                mgi_dict['MGI Link'].append('=HYPERLINK("http://www.informatics.jax.org/marker/' + anno.mgi_acc + '", "' + anno.mgi_acc + '")')
-            else:
-                mgi_dict['MGI Link'].append('na')
-            if anno.mgi_gene:
-                mgi_dict['MGI Gene Name'].append('="%s"' % anno.mgi_gene)
-            else:
-                mgi_dict['MGI Gene Name'].append('na')
-        self.mgi_table = pd.DataFrame.from_dict(mgi_dict)
-        self.mgi_table = self.mgi_table.fillna('na')
-        self.mgi_table[self.mgi_table == ''] = 'na'
-        return
-            
-    def make_kw_table(self, accessions):
-        """Makes table of keyword annotations."""
-        self.kw = KeyWords()
+        self.touch(cache_file)
+        return contents
+
+    def save(self, contents, fingerprint, kind='annotations.pk'):
+        """Pickles contents to the cache and evicts old files if needed."""
+        cache_file = self.path(fingerprint, kind)
+        temp_file = cache_file + '.%d.tmp' % os.getpid()
         try:
-            self.kw.parse_file(os.path.join(os.path.dirname(self.dat_file), 'keywlist.txt'))  # parse keyword definitions file
-        except:
-            """Need to browse to file if not found!"""
-            print('\nWARNING: key word list definition file not found\n')
+            with open(temp_file, 'wb') as fout:
+                pickle.dump(contents, fout, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_file, cache_file)  # other sessions never see partial files
+        except OSError as error:
+            print('WARNING: could not save cache file:', error)
             return
-            
-        # analyze the keyword frequencies and associated proteins
-        if self.parent.sf_var.get() == 1:
-            self.analyze_keywords()
-            
-        # put the keywords into their 10 categories
-        keywords_by_category = []
-        for anno in self.annotations:
-            keywords_by_category.append(self.kw.put_keywords_in_categories(anno.keywords))
-        cat_table = pd.DataFrame(keywords_by_category, columns=['KW: '+cat for cat in self.kw.categories])
-        self.kw_table = pd.concat([self.kw_table, cat_table], axis=1)        
-        self.kw_table = self.kw_table.fillna('na')
-        self.kw_table[self.kw_table == ''] = 'na'
+        self.evict(fingerprint)
         return
-    
-    def analyze_keywords(self):
-        """Frequency anaylsis of key words and inverse mapping to proteins."""
-        keyword_freq = {}
-        for ident, keywords in zip(self.basic_table['Identifier'], self.basic_table['Key Words']):
-            if ident == 'na':
-                continue
-            for keyword in keywords.split('; '):
-                if keyword == 'na':
+
+    def fingerprints(self, kind):
+        """Returns the fingerprints that have a cache file of a kind (most recently used first)."""
+        suffix = '_v%d_%s' % (CACHE_VERSION, kind)
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith(suffix):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.folder, name)),
+                                    name[:-len(suffix)]))
+                except OSError:
                     continue
-                if keyword in keyword_freq:
-                    keyword_freq[keyword].append(ident)
-                else:
-                    keyword_freq[keyword] = [ident]
-        keyword_items = keyword_freq.items()
-        keyword_rows = [(x, len(y), '; '.join(y)) for (x, y) in keyword_items]
-        keyword_rows = sorted(keyword_rows, key=lambda x: x[1], reverse=True)
-        
-        # write frequency report to KW report file
-        if not self.reports_folder:
-            self.reports_folder = get_folder(self.default, 'Select a folder for reports')
-            if not self.reports_folder:
-                return
-        report = open(os.path.join(self.reports_folder, 'keyword_report.txt'), 'w')
-        print('KeyWord Report generated on:', time.ctime(), file=report)
-        print('Total number of key words was:', len(keyword_rows), '\n', file=report)
-        columns = ['Keyword', 'Category', 'Description', 'Synonyms', 'Frequency', 'Proteins']
-        print('\t'.join(columns), file=report)
-        for kw, freq, prots in keyword_rows:
-            kw_obj = self.kw.keywords[kw]
-            row = [kw, kw_obj.category, kw_obj.definition, '; '.join(kw_obj.synonyms), str(freq), prots]
-            if freq > 1:
-                print('\t'.join(row), file=report)
-        report.close()
-        return
-    
-    def make_pw_table(self):
-        "Make a dataframe of the pathway annotations."
-        pw_dict = {}
-        pw_dict['CC Pathway'] = []
-        pw_dict['Reactome Pathway'] = []
-        for anno in self.annotations:
-            pw_dict['CC Pathway'].append(anno.pathway.cc_string)
-            pw_dict['Reactome Pathway'].append(anno.pathway.react_string)
-        self.pw_table = pd.DataFrame.from_dict(pw_dict)
-        self.pw_table = self.pw_table.fillna('na')
-        self.pw_table[self.pw_table == ''] = 'na'
-        
-        # analyze and write report of Reactome pathways
-        if self.parent.sf_var.get() == 1:
-            self.analyze_pathways()
+        return [fingerprint for (mtime, fingerprint) in sorted(entries, reverse=True)]
+
+    def touch(self, cache_file):
+        """Marks a cache file as recently used."""
+        try:
+            os.utime(cache_file)
+        except OSError:
+            pass
         return
-        
-    def analyze_pathways(self):
-        """Frequency anaylsis of Reactome pathways and inverse mapping to proteins."""
-        pathway_freq = {}
-        for ident, pathways in zip(self.basic_table['Identifier'], self.pw_table['Reactome Pathway']):
-            if ident == 'na':
+
+    def evict(self, fingerprint=None):
+        """Deletes least recently used files until the cache is under the size cap.
+        Files of the fingerprint being saved (other species and field groups of the same
+        parse) and files still being written by other processes (.tmp) are kept."""
+        prefix = os.path.basename(self.path(fingerprint, '')) if fingerprint else None
+        entries = []
+        total = 0
+        for name in os.listdir(self.folder):
+            full_name = os.path.join(self.folder, name)
+            try:
+                stat = os.stat(full_name)
+            except OSError:
                 continue
-            for pathway in pathways.split('; '):
-                if pathway == 'na':
-                    continue
-                if pathway in pathway_freq:
-                    pathway_freq[pathway].append(ident)
-                else:
-                    pathway_freq[pathway] = [ident]
-        pathway_items = pathway_freq.items()
-        pathway_rows = [(x, len(y), '; '.join(y)) for (x, y) in pathway_items]
-        pathway_rows = sorted(pathway_rows, key=lambda x: x[1], reverse=True)
-        
-        # write frequency report to pathway report file
-        if not self.reports_folder:
-            self.reports_folder = get_folder(self.default, 'Select a folder for reports')
-            if not self.reports_folder:
-                return
-        report = open(os.path.join(self.reports_folder, 'pathway_report.txt'), 'w')
-        print('Pathway Report generated on:', time.ctime(), file=report)
-        print('Total number of pathways was:', len(pathway_rows), '\n', file=report)
-        columns = ['Identifier', 'Description', 'Link', 'Frequency', 'Proteins']
-        print('\t'.join(columns), file=report)
-        for pw, freq, prots in pathway_rows:
-            desc, ident = pw.split('{')[0], pw.split('{')[1][:-1]
-            link = '=hyperlink("http://www.reactome.org/content/detail/' + ident + '", "' + ident + '")'
-            row = [ident, desc, link, str(freq), prots]
-            if freq > 1:
-                print('\t'.join(row), file=report)
-        report.close()
-        return
-    
-    def make_go_table(self):
-        """Make a dataframe of the go terms."""
-        go_dict = {}
-        for key in ['GO: Biological Process', 'GO: Cellular Component', 'GO: Molecular Function']:
-            go_dict[key] = []
-        for anno in self.annotations:
-            # not all protein records have GO terms, so need to handle missing data 
+            total += stat.st_size
+            if not (name.endswith('.tmp') or (prefix and name.startswith(prefix))):
+                entries.append((stat.st_mtime, stat.st_size, full_name))
+        for mtime, size, full_name in sorted(entries):
+            if total <= self.max_bytes:
+                break
             try:
-                go_dict['GO: Biological Process'].append(anno.go.biological_process)
-                go_dict['GO: Cellular Component'].append(anno.go.cellular_component)
-                go_dict['GO: Molecular Function'].append(anno.go.molecular_function)
-            except AttributeError:
-                go_dict['GO: Biological Process'].append('na')
-                go_dict['GO: Cellular Component'].append('na')
-                go_dict['GO: Molecular Function'].append('na')
-        self.go_table = pd.DataFrame.from_dict(go_dict)
-        self.go_table = self.go_table.fillna('na')
-        self.go_table[self.go_table == ''] = 'na'
-        
-        # analyze and write report of GO terms
-        if self.parent.sf_var.get() == 1:
-            self.analyze_GOTerms()
+                os.remove(full_name)
+                total -= size
+                print('...removed old cache file:', os.path.basename(full_name))
+            except OSError:
+                pass
         return
-        
-    def analyze_GOTerms(self):
-        """Frequency anaylsis of GO terms and inverse mapping to proteins."""
-        # write frequency report to GO Terms report file
-        if not self.reports_folder:
-            self.reports_folder = get_folder(self.default, 'Select a folder for reports')
-            if not self.reports_folder:
-                return
-        report = open(os.path.join(self.reports_folder, 'GOTerms_report.txt'), 'w')
-        print('GO Term Report generated on:', time.ctime(), file=report)
 
-        for go_category in ['GO: Biological Process', 'GO: Cellular Component', 'GO: Molecular Function']:
-            goterm_freq = {}
-            for ident, goterms in zip(self.basic_table['Identifier'], self.go_table[go_category]):
-                if ident == 'na':
-                    continue
-                for goterm in goterms.split('; '):
-                    if goterm == 'na':
-                        continue
-                    if goterm in goterm_freq:
-                        goterm_freq[goterm].append(ident)
-                    else:
-                        goterm_freq[goterm] = [ident]
-            goterm_items = goterm_freq.items()
-            goterm_rows = [(x, len(y), '; '.join(y)) for (x, y) in goterm_items]
-            goterm_rows = sorted(goterm_rows, key=lambda x: x[1], reverse=True)
-            print('\n\nTotal number of %s terms was: %s\n' % (go_category, len(goterm_rows)), file=report)
-            columns = ['Identifier', 'Description', 'Link', 'Frequency', 'Proteins']
-            print('\t'.join(columns), file=report)
-            for go, freq, prots in goterm_rows:
-                desc, acc = go.split('{')[0], go.split('{')[1][:-1]
-                link = '=hyperlink("http://amigo.geneontology.org/amigo/term/' + acc + '", "' + acc + '")'
-                row = [acc, desc, link, str(freq), prots]
-                if freq > 1:
-                    print('\t'.join(row), file=report)
-        report.close()
-        return
-        
-    def concatenate(self):
-        """Merges all the annotation tables together."""
-        # drop any unwanted columns before concatenating
-        self.basic_table = self.basic_table.drop('Key Words', axis=1)
-        frames = [self.basic_table, self.mgi_table, self.kw_table, self.go_table, self.pw_table]
-        self.table = pd.concat(frames, axis=1)
-#        self.table = self.table.set_index('Index')
+class StreamingJoin:
+    """Single pass join of a set of accessions against a DAT file of any size.
+    Only the ID and AC lines of each record are examined until a record matches,
+    so memory use does not depend on the DAT file size (e.g. uniprot_trembl.dat.gz).
+    Matched records are saved in a small gzipped DAT subset file in the parse cache
+    folder and are checked first on later scans of the same DAT file. Accessions
+    that a full scan did not find are saved too, so they do not cause another scan.
+    """
+    def __init__(self, dat_file, cache_folder=None):
+        """dat_file: path to the (large) DAT file
+        cache_folder: location for subset files (default is the ParseCache folder)"""
+        self.dat_file = dat_file
+        self.cache = ParseCache(cache_folder)
+        self.fingerprint = self.cache.fingerprint(dat_file)
+        self.cache_file = self.cache.path(self.fingerprint, 'subset.dat.gz')
+        self.cache.touch(self.cache_file)
+        self.scanned = 0        # number of records examined in last scan
         return
 
+    def _make_targets(self, accessions):
+        """Maps every lookup key (full accession, and identifier and accession parts
+        of UniProt FASTA style accessions) to the set of accessions it can satisfy."""
+        targets = {}
+        for acc in accessions:
+            keys = [acc]
+            acc_parts = acc.split('|')
+            if len(acc_parts) == 3:
+                keys += acc_parts[1:]
+            for key in keys:
+                targets.setdefault(key, set()).add(acc)
+        return targets
+
+    def scan(self, accessions):
+        """Finds the DAT records for the accessions.
+        Returns the number of matched records, an annotation dictionary like
+        the one from parsing a full DAT file, and a list of accessions not found."""
+        targets = self._make_targets(accessions)
+        remaining = set(accessions)
+        dat_dict = {}
+        count = 0
+        self.scanned = 0
+
+        # matches from earlier scans
+        if os.path.exists(self.cache_file):
+            with gzip.open(self.cache_file, 'rt') as fin:
+                count += self._scan_lines(fin, targets, remaining, dat_dict)
+        cached = set(x.accession for x in dat_dict.values())
+
+        # the full DAT file for anything else (stops when everything is found), skipping
+        # accessions that earlier full scans did not find
+        misses = self.cache.load(self.fingerprint, 'subset_misses.pk') or set()
+        searching = remaining - misses
+        if searching:
+            new_records = []
+            lines = fast_gzip.read_lines(self.dat_file)
+            try:
+                count += self._scan_lines(lines, self._make_targets(searching), searching,
+                                          dat_dict, new_records)
+            finally:
+                lines.close()   # stops any decompression subprocess if we quit early
+            remaining = (remaining & misses) | searching    # (searching is what was not found)
+            if searching:   # (the whole DAT file was scanned)
+                self.cache.save(misses | searching, self.fingerprint, 'subset_misses.pk')
+            new_records = [x for x in new_records if record_accession(x) not in cached]
+            if new_records:
+                with gzip.open(self.cache_file, 'at') as fout:  # appends another gzip member
+                    for record in new_records:
+                        fout.write('\n'.join(record) + '\n//\n')
+        return count, dat_dict, sorted(remaining)
+
+    def _scan_lines(self, lines, targets, remaining, dat_dict, new_records=None):
+        """Parses records whose ID or AC lines match a target key.
+        Returns the number of records parsed."""
+        count = 0
+        buff = []
+        hits = []
+        in_header = True    # still reading ID and AC lines
+        for line in lines:
+            if line.startswith('//'):
+                if hits:
+                    annotations = Annotations()
+                    annotations.parse_record(buff)
+                    for key in [annotations.identifier, annotations.accession,
+                                annotations.fasta_accession] + hits:
+                        dat_dict[key] = annotations
+                    for key in hits:
+                        remaining -= targets[key]
+                    if new_records is not None:
+                        new_records.append(buff)
+                    count += 1
+                buff = []
+                hits = []
+                in_header = True
+                self.scanned += 1
+                if not self.scanned % 1000000:
+                    print('...%d records scanned, %d matched' % (self.scanned, count))
+                if not remaining:
+                    break
+            elif in_header:
+                line = line.rstrip()
+                if line.startswith('ID   '):
+                    identifier = line[5:].split()[0]
+                    if identifier in targets:
+                        hits.append(identifier)
+                elif line.startswith('AC   '):
+                    hits += [acc.strip() for acc in line[5:].split(';') if acc.strip() in targets]
+                else:
+                    in_header = False
+                buff.append(line)
+            elif hits:
+                buff.append(line.rstrip())
+        return count
+
+
 # MAIN program starts here
-annotator = ProteinAnnotator()
+if __name__ == '__main__':
+    from annotator_gui import ProteinAnnotator
+    annotator = ProteinAnnotator()
 # end when user hits quit button or closes window
@@ -0,0 +1,738 @@
+"""annotation_tables.py - annotation tables for lists of proteins (pandas dataframes).
+
+AnnotationTable collects the annotations of the looked up proteins into the table
+that is shown and copied to the clipboard (and can write summary reports), and
+AnnotationFrame is the precomputed table for every protein of a species. Kept
+apart from add_uniprot_annotations.py so that pandas and NumPy are only imported
+when tables are made.
+
+The MIT License (MIT)
+
+Copyright (c) 2019 Phillip A. Wilmarth, OHSU
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import time
+import collections
+
+import numpy as np
+import pandas as pd
+
+import protein_properties
+from add_uniprot_annotations import (COMMENT_TOPICS, EVIDENCE_FILTERS, FIELD_GROUPS, KeyWords,
+                                     get_folder)
+
+
+# parsed keyword list files keyed by (file name, modification time, size)
+_keyword_lists = {}
+
+def load_keywords(keyword_file):
+    """Returns the KeyWords object for a keyword list file (parsed once per session)."""
+    stat = os.stat(keyword_file)
+    key = (os.path.abspath(keyword_file), stat.st_mtime, stat.st_size)
+    if key not in _keyword_lists:
+        keyword_list = KeyWords()
+        keyword_list.parse_file(keyword_file)
+        _keyword_lists[key] = keyword_list
+    return _keyword_lists[key]
+
+def evidence_masks(code_arrays, evidence_filter='all'):
+    """Evaluates an evidence filter for many proteins with one NumPy comparison.
+    code_arrays: one array.array('B') of evidence level codes for each protein
+    Returns one boolean array (True means keep) for each protein."""
+    if not code_arrays:
+        return []
+    codes = np.frombuffer(b''.join([x.tobytes() for x in code_arrays]), dtype=np.uint8)
+    keep = codes <= EVIDENCE_FILTERS[evidence_filter]
+    return np.split(keep, np.cumsum([len(x) for x in code_arrays])[:-1])
+
+def keyword_depth():
+    """Returns the keyword hierarchy depth for rolled-up keywords (ANNOTATOR_KW_DEPTH
+    environment variable), or None if it is not set."""
+    depth = os.environ.get('ANNOTATOR_KW_DEPTH', '')
+    return int(depth) if depth.strip().isdigit() else None
+
+def keyword_rollup(keyword_list, keyword_lists):
+    """Rolls the keywords of many proteins up the keyword hierarchy at once.
+    keyword_list: KeyWords object (with the precomputed ancestors of each term)
+    keyword_lists: list of keywords for each protein
+    Returns a (proteins x hierarchy terms) boolean array that is True where a protein
+    has the term or any term below it."""
+    rolled = np.zeros((len(keyword_lists), len(keyword_list.terms)), dtype=bool)
+    index = keyword_list.term_index
+    pairs = [(row, index[x]) for (row, keywords) in enumerate(keyword_lists)
+             for x in keywords if x in index]
+    if not pairs:
+        return rolled
+    rows, terms = np.array(pairs, dtype=np.int64).T
+    lengths = np.array([len(x) for x in keyword_list.ancestors], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    flat = np.fromiter((i for x in keyword_list.ancestors for i in x), dtype=np.int64,
+                       count=lengths.sum())
+
+    # ancestors of every (protein, keyword) pair gathered from the flat array
+    counts = lengths[terms]
+    ends = np.cumsum(counts)
+    positions = np.repeat(starts[terms] - (ends - counts), counts) + np.arange(ends[-1])
+    rolled[np.repeat(rows, counts), flat[positions]] = True
+    return rolled
+
+def term_abundances(identifiers, term_strings, abundances):
+    """Sums the abundances of the proteins with each term (one explode and groupby).
+    identifiers: protein identifiers ('na' for proteins not found)
+    term_strings: '; ' separated terms of each protein ('na' if none)
+    abundances: (proteins x samples) dataframe of numeric columns
+    Returns a dataframe indexed by term with the total abundance (all samples), the
+    mean protein total, and the summed abundance in each sample."""
+    frame = abundances.reset_index(drop=True)
+    frame = frame.assign(_total=frame.sum(axis=1),
+                         _terms=pd.Series(list(term_strings)).str.split('; '))
+    frame = frame[(np.array(identifiers) != 'na')].explode('_terms')
+    frame = frame[frame['_terms'] != 'na']
+    grouped = frame.groupby('_terms', sort=False)
+    summary = grouped[list(abundances.columns)].sum()
+    summary.insert(0, 'Mean Abundance', grouped['_total'].mean())
+    summary.insert(0, 'Total Abundance', grouped['_total'].sum())
+    summary.index.name = None
+    return summary
+
+def format_abundances(summary):
+    """Returns the report column names and a dictionary of term -> formatted values
+    for a term_abundances dataframe (nothing if there are no abundances)."""
+    if summary is None:
+        return [], collections.defaultdict(list)
+    values = np.vectorize(lambda x: '%.10g' % x, otypes=[object])(summary.to_numpy(dtype=float))
+    return list(summary.columns), dict(zip(summary.index, values.tolist()))
+
+
+class AnnotationTable:
+    """Collects all of the annotations into dataframes."""
+    def __init__(self, parent):
+        """parent: calling object"""
+        self.parent = parent                        # pointer to calling object
+        self.dat_file = self.parent.dat_file        # Swiss-Prot DAT file
+        self.accessions = self.parent.accessions    # accessions to be annotated
+        self.annotations = self.parent.annotations  # annotations from DAT file
+        self.reports_folder = None                  # folder to write rports to
+        self.default = self.parent.default          # set a default location for dialog boxes
+        self.evidence = self.parent.ev_var.get()    # evidence filter (see EVIDENCE_FILTERS)
+        self.abundances = self.parent.abundances    # optional numeric columns for the summary files
+        self.keywords = self.filter_by_evidence([anno.keywords for anno in self.annotations],
+                                                [anno.keyword_evidence for anno in self.annotations])
+        
+        self.table = None           # final table for display and export to clipboard
+        self.basic_table = None     # table for the general annotations
+        self.kw_table = None        # table for the key words
+        self.mgi_table = None       # table for MGI info if mouse
+        self.pw_table = None        # pathways table
+        self.go_table = None        # GO terms table
+        self.cc_table = None        # CC comment topics table
+        
+        self.make_main_table()
+        if self.parent.radio_var.get() == 2:
+            self.make_mgi_table()
+        if self.parent.kw_var.get() == 1:
+            self.make_kw_table(self.accessions)
+        if self.parent.pw_var.get() == 1:
+            self.make_pw_table()
+        if self.parent.go_var.get() == 1:
+            self.make_go_table()
+        if self.parent.cc_var.get() == 1:
+            self.make_cc_table()
+        self.concatenate()
+        return
+    
+    def make_main_table(self):
+        """Creates a dataframe of all the non-optional annotations."""
+        keys = ['Index', 'Primary Protein Name', 'Alternative Protein Names', 'Identifier', 'Accession',
+                'Other Accessions', 'UniProt Gene Name', 'Other Gene Synonyms', 
+                'Species Name', 'Taxonomy Number', 'Key Words']
+        df_dict = {k: [] for k in keys}
+        for acc in self.accessions.iloc[:, 0]:
+            df_dict['Index'].append(acc)
+        other_names = self.filter_by_evidence([anno.other_names for anno in self.annotations],
+                                              [anno.other_name_evidence for anno in self.annotations])
+        for anno, names, keywords in zip(self.annotations, other_names, self.keywords):
+            df_dict['Primary Protein Name'].append(anno.name)
+            df_dict['Alternative Protein Names'].append(names)
+            df_dict['Accession'].append(anno.accession)
+            df_dict['Identifier'].append(anno.identifier)
+            df_dict['Other Accessions'].append(anno.other_accessions)
+            if anno.gene:
+                df_dict['UniProt Gene Name'].append('="%s"' % anno.gene)
+            else:
+                df_dict['UniProt Gene Name'].append('na')
+            df_dict['Other Gene Synonyms'].append(anno.other_genes)
+            df_dict['Species Name'].append(anno.os)
+            df_dict['Taxonomy Number'].append(anno.ox)
+            df_dict['Key Words'].append(keywords)
+            
+            #convert annotations that are type list to semicolon separated strings
+            for k in keys:
+                if type(df_dict[k][-1]) == list:
+                    df_dict[k][-1] = '; '.join(df_dict[k][-1]) # use join method
+
+        self.basic_table = pd.DataFrame.from_dict(df_dict)
+        self.basic_table = self.basic_table[keys]   # put the table columns in the order in keys
+        self.basic_table['UniProt Link'] = self.basic_table['Accession'].apply(self.add_uniprot_hyperlinks)
+        if self.parent.pp_var.get() == 1:
+            self.add_properties()
+        if self.parent.kw_var.get() == 1:
+            self.kw_table = pd.DataFrame(df_dict['Key Words'], columns=['Key Words'])
+        self.basic_table = self.basic_table.fillna('na')
+        self.basic_table[self.basic_table == ''] = 'na'
+        return
+
+    def filter_by_evidence(self, lists, code_arrays):
+        """Applies the evidence filter to lists of items (one list for each protein)
+        that have parallel arrays of evidence level codes."""
+        if self.evidence == 'all':
+            return lists
+        masks = evidence_masks(code_arrays, self.evidence)
+        return [[x for (x, ok) in zip(items, keep) if ok] for (items, keep) in zip(lists, masks)]
+
+    def add_properties(self):
+        """Adds sequence-derived property columns (computed for all proteins at once)."""
+        props = protein_properties.compute_properties([anno.sequence for anno in self.annotations])
+        has_sequence = props['length'] > 0
+        for column, key, digits in [('Sequence Length', 'length', 0), ('Mass (Da)', 'mass', 1),
+                                    ('pI', 'pI', 2), ('GRAVY', 'GRAVY', 3)]:
+            # formatted as text like the other columns (missing values are "na")
+            self.basic_table[column] = ['%.*f' % (digits, x) if ok else 'na'
+                                        for (x, ok) in zip(props[key], has_sequence)]
+        return
+
+    def add_uniprot_hyperlinks(self, acc):
+        """Adds hyperlinks to UniProt website."""
+        if not acc:
+            return None
+        else:
+            return ('=hyperlink("http://www.uniprot.org/uniprot/' + acc + '", "' + acc + '")') 
+            
+    def make_mgi_table(self):
+        """Makes table of MGI annotations."""
+        mgi_dict = {}
+        mgi_dict['MGI Accession'] = []
+        mgi_dict['MGI Gene Name'] = []
+        mgi_dict['MGI Link'] = []
+        for anno in self.annotations:
+            mgi_dict['MGI Accession'].append(anno.mgi_acc)
+            if anno.mgi_acc:
+                mgi_dict['MGI Link'].append('=HYPERLINK("http://www.informatics.jax.org/marker/' + anno.mgi_acc + '", "' + anno.mgi_acc + '")')
+            else:
+                mgi_dict['MGI Link'].append('na')
+            if anno.mgi_gene:
+                mgi_dict['MGI Gene Name'].append('="%s"' % anno.mgi_gene)
+            else:
+                mgi_dict['MGI Gene Name'].append('na')
+        self.mgi_table = pd.DataFrame.from_dict(mgi_dict)
+        self.mgi_table = self.mgi_table.fillna('na')
+        self.mgi_table[self.mgi_table == ''] = 'na'
+        return
+            
+    def make_kw_table(self, accessions):
+        """Makes table of keyword annotations."""
+        try:
+            self.kw = load_keywords(os.path.join(os.path.dirname(self.dat_file), 'keywlist.txt'))  # parse keyword definitions file
+        except:
+            """Need to browse to file if not found!"""
+            print('\nWARNING: key word list definition file not found\n')
+            return
+            
+        # analyze the keyword frequencies and associated proteins
+        if self.parent.sf_var.get() == 1:
+            self.analyze_keywords()
+            
+        # put the keywords into their 10 categories
+        keywords_by_category = []
+        for keywords in self.keywords:
+            keywords_by_category.append(self.kw.put_keywords_in_categories(keywords))
+        cat_table = pd.DataFrame(keywords_by_category, columns=['KW: '+cat for cat in self.kw.categories])
+        self.kw_table = pd.concat([self.kw_table, cat_table, self.rolled_up_columns()], axis=1)
+        self.kw_table = self.kw_table.fillna('na')
+        self.kw_table[self.kw_table == ''] = 'na'
+        return
+    
+    def rolled_up_columns(self):
+        """Makes the category columns of the keywords rolled up to the ANNOTATOR_KW_DEPTH
+        level of the keyword hierarchy (None if not set or no HI lines)."""
+        depth = keyword_depth()
+        if depth is None or not self.kw.terms:
+            return None
+        rolled = keyword_rollup(self.kw, self.keywords)
+        at_depth = np.array(self.kw.term_depths) == depth
+        columns = {}
+        for category in self.kw.categories:
+            terms = np.flatnonzero(at_depth & (np.array(self.kw.term_categories) == category))
+            names = [self.kw.terms[j] for j in terms]
+            columns['KW: %s (depth %d)' % (category, depth)] = [
+                '; '.join(name for (name, keep) in zip(names, row) if keep) for row in rolled[:, terms]]
+        return pd.DataFrame(columns)
+
+    def analyze_keywords(self):
+        """Frequency anaylsis of key words and inverse mapping to proteins."""
+        keyword_freq = {}
+        for ident, keywords in zip(self.basic_table['Identifier'], self.basic_table['Key Words']):
+            if ident == 'na':
+                continue
+            for keyword in keywords.split('; '):
+                if keyword == 'na':
+                    continue
+                if keyword in keyword_freq:
+                    keyword_freq[keyword].append(ident)
+                else:
+                    keyword_freq[keyword] = [ident]
+        keyword_items = keyword_freq.items()
+        keyword_rows = [(x, len(y), '; '.join(y)) for (x, y) in keyword_items]
+        keyword_rows = sorted(keyword_rows, key=lambda x: x[1], reverse=True)
+        
+        # write frequency report to KW report file
+        if not self.reports_folder:
+            self.reports_folder = get_folder(self.default, 'Select a folder for reports')
+            if not self.reports_folder:
+                return
+        report = open(os.path.join(self.reports_folder, 'keyword_report.txt'), 'w')
+        print('KeyWord Report generated on:', time.ctime(), file=report)
+        print('Total number of key words was:', len(keyword_rows), '\n', file=report)
+        headers, abundances = format_abundances(self.abundance_summary(self.basic_table['Key Words']))
+        columns = ['Keyword', 'Category', 'Description', 'Synonyms', 'Frequency'] + headers + ['Proteins']
+        print('\t'.join(columns), file=report)
+        for kw, freq, prots in keyword_rows:
+            kw_obj = self.kw.keywords[kw]
+            row = ([kw, kw_obj.category, kw_obj.definition, '; '.join(kw_obj.synonyms), str(freq)] +
+                   abundances[kw] + [prots])
+            if freq > 1:
+                print('\t'.join(row), file=report)
+        self.write_rolled_up_keywords(report)
+        report.close()
+        return
+
+    def write_rolled_up_keywords(self, report):
+        """Adds the keyword hierarchy terms down to the ANNOTATOR_KW_DEPTH level to the
+        keyword report with the number of proteins that have the term or any term below it."""
+        depth = keyword_depth()
+        if depth is None or not self.kw.terms:
+            return
+        identifiers = list(self.basic_table['Identifier'])
+        rolled = keyword_rollup(self.kw, self.keywords)
+        rolled[np.array([x == 'na' for x in identifiers], dtype=bool)] = False
+        counts = rolled.sum(axis=0)
+        keep = (np.array(self.kw.term_depths) <= depth) & (counts > 1)
+        print('\n\nKeywords rolled up the hierarchy (to depth %d):' % depth, file=report)
+        print('Total number of terms was:', int(keep.sum()), '\n', file=report)
+        headers, abundances = format_abundances(self.rolled_up_abundances(rolled, counts))
+        columns = ['Term', 'Depth', 'Category', 'Rolled-up Frequency'] + headers + ['Proteins']
+        print('\t'.join(columns), file=report)
+        for j in np.argsort(-counts, kind='stable'):
+            if keep[j]:
+                prots = '; '.join(identifiers[i] for i in np.flatnonzero(rolled[:, j]))
+                row = ([self.kw.terms[j], str(self.kw.term_depths[j]), self.kw.term_categories[j],
+                        str(counts[j])] + abundances[self.kw.terms[j]] + [prots])
+                print('\t'.join(row), file=report)
+        return
+
+    def abundance_summary(self, term_strings):
+        """Returns the term_abundances dataframe for a column of '; ' separated terms
+        (None if no abundance columns were read with the accessions)."""
+        if self.abundances is None or len(self.abundances.columns) == 0:
+            return None
+        return term_abundances(self.basic_table['Identifier'], term_strings, self.abundances)
+
+    def rolled_up_abundances(self, rolled, counts):
+        """Same as abundance_summary for the rolled-up keywords (a matrix product of the
+        rolled-up term matrix and the abundances)."""
+        if self.abundances is None or len(self.abundances.columns) == 0:
+            return None
+        profiles = rolled.T.astype(float) @ self.abundances.to_numpy(dtype=float)
+        summary = pd.DataFrame(profiles, index=self.kw.terms, columns=self.abundances.columns)
+        totals = profiles.sum(axis=1)
+        summary.insert(0, 'Mean Abundance', totals / np.maximum(counts, 1))
+        summary.insert(0, 'Total Abundance', totals)
+        return summary
+
+    def make_pw_table(self):
+        "Make a dataframe of the pathway annotations."
+        pw_dict = {}
+        pw_dict['CC Pathway'] = []
+        pw_dict['Reactome Pathway'] = []
+        cc_evidence = np.array([anno.pathway.cc_evidence for anno in self.annotations], dtype=np.uint8)
+        cc_keep = cc_evidence <= EVIDENCE_FILTERS[self.evidence]
+        for anno, keep in zip(self.annotations, cc_keep):
+            pw_dict['CC Pathway'].append(anno.pathway.cc_string if keep else '')
+            pw_dict['Reactome Pathway'].append(anno.pathway.react_string)
+        self.pw_table = pd.DataFrame.from_dict(pw_dict)
+        self.pw_table = self.pw_table.fillna('na')
+        self.pw_table[self.pw_table == ''] = 'na'
+        
+        # analyze and write report of Reactome pathways
+        if self.parent.sf_var.get() == 1:
+            self.analyze_pathways()
+        return
+        
+    def analyze_pathways(self):
+        """Frequency anaylsis of Reactome pathways and inverse mapping to proteins."""
+        pathway_freq = {}
+        for ident, pathways in zip(self.basic_table['Identifier'], self.pw_table['Reactome Pathway']):
+            if ident == 'na':
+                continue
+            for pathway in pathways.split('; '):
+                if pathway == 'na':
+                    continue
+                if pathway in pathway_freq:
+                    pathway_freq[pathway].append(ident)
+                else:
+                    pathway_freq[pathway] = [ident]
+        pathway_items = pathway_freq.items()
+        pathway_rows = [(x, len(y), '; '.join(y)) for (x, y) in pathway_items]
+        pathway_rows = sorted(pathway_rows, key=lambda x: x[1], reverse=True)
+        
+        # write frequency report to pathway report file
+        if not self.reports_folder:
+            self.reports_folder = get_folder(self.default, 'Select a folder for reports')
+            if not self.reports_folder:
+                return
+        report = open(os.path.join(self.reports_folder, 'pathway_report.txt'), 'w')
+        print('Pathway Report generated on:', time.ctime(), file=report)
+        print('Total number of pathways was:', len(pathway_rows), '\n', file=report)
+        headers, abundances = format_abundances(self.abundance_summary(self.pw_table['Reactome Pathway']))
+        columns = ['Identifier', 'Description', 'Link', 'Frequency'] + headers + ['Proteins']
+        print('\t'.join(columns), file=report)
+        for pw, freq, prots in pathway_rows:
+            desc, ident = pw.split('{')[0], pw.split('{')[1][:-1]
+            link = '=hyperlink("http://www.reactome.org/content/detail/' + ident + '", "' + ident + '")'
+            row = [ident, desc, link, str(freq)] + abundances[pw] + [prots]
+            if freq > 1:
+                print('\t'.join(row), file=report)
+        report.close()
+        return
+    
+    def make_go_table(self):
+        """Make a dataframe of the go terms."""
+        go_dict = {}
+        for key in ['GO: Biological Process', 'GO: Cellular Component', 'GO: Molecular Function']:
+            go_dict[key] = []
+        if self.evidence == 'all':
+            masks = [None] * len(self.annotations)
+        else:
+            masks = evidence_masks([anno.go.evidence for anno in self.annotations], self.evidence)
+        for anno, keep in zip(self.annotations, masks):
+            # not all protein records have GO terms, so need to handle missing data 
+            try:
+                go_dict['GO: Biological Process'].append(anno.go.category_string('P', keep))
+                go_dict['GO: Cellular Component'].append(anno.go.category_string('C', keep))
+                go_dict['GO: Molecular Function'].append(anno.go.category_string('F', keep))
+            except AttributeError:
+                go_dict['GO: Biological Process'].append('na')
+                go_dict['GO: Cellular Component'].append('na')
+                go_dict['GO: Molecular Function'].append('na')
+        self.go_table = pd.DataFrame.from_dict(go_dict)
+        self.go_table = self.go_table.fillna('na')
+        self.go_table[self.go_table == ''] = 'na'
+        
+        # analyze and write report of GO terms
+        if self.parent.sf_var.get() == 1:
+            self.analyze_GOTerms()
+        return
+        
+    def analyze_GOTerms(self):
+        """Frequency anaylsis of GO terms and inverse mapping to proteins."""
+        # write frequency report to GO Terms report file
+        if not self.reports_folder:
+            self.reports_folder = get_folder(self.default, 'Select a folder for reports')
+            if not self.reports_folder:
+                return
+        report = open(os.path.join(self.reports_folder, 'GOTerms_report.txt'), 'w')
+        print('GO Term Report generated on:', time.ctime(), file=report)
+
+        for go_category in ['GO: Biological Process', 'GO: Cellular Component', 'GO: Molecular Function']:
+            goterm_freq = {}
+            for ident, goterms in zip(self.basic_table['Identifier'], self.go_table[go_category]):
+                if ident == 'na':
+                    continue
+                for goterm in goterms.split('; '):
+                    if goterm == 'na':
+                        continue
+                    if goterm in goterm_freq:
+                        goterm_freq[goterm].append(ident)
+                    else:
+                        goterm_freq[goterm] = [ident]
+            goterm_items = goterm_freq.items()
+            goterm_rows = [(x, len(y), '; '.join(y)) for (x, y) in goterm_items]
+            goterm_rows = sorted(goterm_rows, key=lambda x: x[1], reverse=True)
+            print('\n\nTotal number of %s terms was: %s\n' % (go_category, len(goterm_rows)), file=report)
+            headers, abundances = format_abundances(self.abundance_summary(self.go_table[go_category]))
+            columns = ['Identifier', 'Description', 'Link', 'Frequency'] + headers + ['Proteins']
+            print('\t'.join(columns), file=report)
+            for go, freq, prots in goterm_rows:
+                desc, acc = go.split('{')[0], go.split('{')[1][:-1]
+                link = '=hyperlink("http://amigo.geneontology.org/amigo/term/' + acc + '", "' + acc + '")'
+                row = [acc, desc, link, str(freq)] + abundances[go] + [prots]
+                if freq > 1:
+                    print('\t'.join(row), file=report)
+        report.close()
+        return
+        
+    def make_cc_table(self):
+        """Makes a dataframe of the CC comment topics in COMMENT_TOPICS."""
+        cc_dict = {}
+        for topic in COMMENT_TOPICS:
+            cc_dict['CC: ' + topic.title()] = [anno.comment(topic, self.evidence)
+                                               for anno in self.annotations]
+        self.cc_table = pd.DataFrame.from_dict(cc_dict)
+        self.cc_table = self.cc_table.fillna('na')
+        self.cc_table[self.cc_table == ''] = 'na'
+        return
+
+    def concatenate(self):
+        """Merges all the annotation tables together."""
+        # drop any unwanted columns before concatenating
+        self.basic_table = self.basic_table.drop('Key Words', axis=1)
+        frames = [self.basic_table, self.mgi_table, self.kw_table, self.go_table, self.pw_table,
+                  self.cc_table]
+        self.table = pd.concat(frames, axis=1)
+#        self.table = self.table.set_index('Index')
+        return
+
+class Setting:
+    """A fixed option value with the get method of the tkinter variables."""
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+class TableOptions:
+    """Stands in for the GUI window when an AnnotationTable is made outside of it."""
+    def __init__(self, dat_file, accessions, annotations, species=1, keywords=1, pathways=1,
+                 go_terms=1, summary=0, properties=1, evidence='all', comments=1, abundances=None):
+        """accessions: list of accessions for the Index column
+        annotations: matching list of Annotations objects
+        abundances: optional (proteins x samples) dataframe for the summary files
+        other arguments are the GUI option settings"""
+        self.dat_file = dat_file
+        self.default = os.getcwd()
+        self.accessions = pd.DataFrame({'Accession': list(accessions)})
+        self.annotations = annotations
+        self.radio_var = Setting(species)
+        self.kw_var = Setting(keywords)
+        self.pw_var = Setting(pathways)
+        self.go_var = Setting(go_terms)
+        self.sf_var = Setting(summary)
+        self.pp_var = Setting(properties)
+        self.ev_var = Setting(evidence)
+        self.cc_var = Setting(comments)
+        self.abundances = abundances
+        return
+
+class RowCache:
+    """Formatted table rows of single proteins kept between "Add annotations" runs.
+    Rows are keyed by the resolved FASTA accession, the table options, and the DAT
+    file fingerprint, so repeated or overlapping lists only format the new proteins.
+    The least recently used rows are dropped when there are more than max_rows.
+    """
+    def __init__(self, max_rows=100000):
+        """max_rows: most rows to keep"""
+        self.max_rows = max_rows
+        self.rows = collections.OrderedDict()   # (accession, options, fingerprint) -> row tuple
+        self.columns = {}                       # (options, fingerprint) -> column names
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0     # rows reused and formatted by the last table
+        self.formatted = 0
+        return
+
+    def option_key(self, options):
+        """The option settings that change the row contents."""
+        return (options.radio_var.get(), options.kw_var.get(), options.pw_var.get(),
+                options.go_var.get(), options.pp_var.get(), options.ev_var.get(),
+                options.cc_var.get(), keyword_depth())
+
+    def table(self, options, fingerprint):
+        """Makes the AnnotationTable table for the accessions and annotations of options
+        (GUI window or TableOptions) using cached rows where possible."""
+        if len(options.annotations) == 0:
+            return AnnotationTable(options).table
+        opts = (self.option_key(options), fingerprint)
+        accessions = list(options.accessions.iloc[:, 0])
+        keys = [x.fasta_accession for x in options.annotations]  # (None for failed lookups)
+
+        # cached rows, and the first position of each protein that needs formatting
+        found = {}
+        new = {}
+        for i, key in enumerate(keys):
+            if key in found or key in new:
+                continue
+            row = self.rows.get((key, opts)) if key else None
+            if row is None:
+                new[key if key else i] = i
+            else:
+                self.rows.move_to_end((key, opts))
+                found[key] = row
+        self.reused, self.formatted = len(found), len(new)
+        self.hits += len(found)
+        self.misses += len(new)
+
+        if new:
+            subset = TableOptions(options.dat_file, [accessions[i] for i in new.values()],
+                                  [options.annotations[i] for i in new.values()],
+                                  *self.option_key(options)[:4], summary=0,
+                                  properties=options.pp_var.get(), evidence=options.ev_var.get(),
+                                  comments=options.cc_var.get())
+            table = AnnotationTable(subset).table
+            self.columns[opts] = list(table.columns)
+            for key, row in zip(new, table.itertuples(index=False, name=None)):
+                found[key] = row
+                if isinstance(key, str):
+                    self.rows[(key, opts)] = row
+            while len(self.rows) > self.max_rows:
+                self.rows.popitem(last=False)
+
+        rows = [found[key if key else i] for (i, key) in enumerate(keys)]
+        table = pd.DataFrame(rows, columns=self.columns[opts])
+        table['Index'] = accessions
+        return table
+
+class AnnotationFrame:
+    """Formatted annotation table for every record of one species (with all of the
+    optional columns) made once and cached. Annotating a list of accessions is then
+    an indexed join on the lookup keys instead of building rows from objects.
+    """
+    # columns for each option (the basic columns are always included)
+    PROPERTY_COLUMNS = ['Sequence Length', 'Mass (Da)', 'pI', 'GRAVY']
+    PATHWAY_COLUMNS = ['CC Pathway', 'Reactome Pathway']
+    # field groups used by the table columns
+    GROUPS = set(FIELD_GROUPS) - {'features'}
+
+    def __init__(self, table, species):
+        """table: AnnotationTable.table for every record (Index is the FASTA accession)
+        species: species radio button value used to make the table"""
+        self.table = table.reset_index(drop=True)
+        self.species = species
+        self.keyword_depth = keyword_depth()    # rolled-up keyword level of the table
+        self.aliases = None     # lookup key -> table row
+        return
+
+    @classmethod
+    def build(cls, store, dat_file, species):
+        """Makes the frame for the selected species of an AnnotationStore."""
+        store.require(sorted(cls.GROUPS))
+        records = store.records()
+        options = TableOptions(dat_file, [x.fasta_accession for x in records], records, species)
+        frame = cls(AnnotationTable(options).table, species)
+        frame.make_aliases(records)
+        return frame
+
+    def make_aliases(self, records):
+        """Maps the lookup keys of each record (FASTA accession, accession, identifier)
+        to its table row."""
+        keys, rows = [], []
+        for row, annotations in enumerate(records):
+            for key in [annotations.fasta_accession, annotations.accession, annotations.identifier]:
+                keys.append(key)
+                rows.append(row)
+        aliases = pd.Series(rows, index=keys)
+        self.aliases = aliases[~aliases.index.duplicated()]
+        return
+
+    def usable(self, options):
+        """True if the frame has all of the columns for the GUI options.
+        Evidence filtering and summary files need the annotation objects."""
+        if options.ev_var.get() != 'all' or options.sf_var.get() == 1:
+            return False
+        if options.radio_var.get() != self.species:
+            return False
+        if options.kw_var.get() == 1 and not any(x.startswith('KW: ') for x in self.table.columns):
+            return False    # keyword list file was not found when the frame was made
+        if options.cc_var.get() == 1 and not any(x.startswith('CC: ') for x in self.table.columns):
+            return False    # frame was made before the comment columns
+        if getattr(self, 'keyword_depth', None) != keyword_depth():
+            return False    # made without (or with other) rolled-up keyword columns
+        return True
+
+    def rows(self, keys):
+        """Finds the table rows for a list of lookup accessions (like AnnotationStore.lookup).
+        Returns an array of row numbers (-1 if not found)."""
+        keys = pd.Series(keys, dtype=object)
+        found = self.aliases.reindex(keys.values).to_numpy(dtype=float)
+        parts = keys.str.split('|')
+        uniprot = (parts.str.len() == 3).to_numpy()     # UniProt style accessions
+        for part in (2, 1):     # identifier, then accession
+            retry = np.isnan(found) & uniprot
+            if retry.any():
+                found[retry] = self.aliases.reindex(parts.str[part][retry].values).to_numpy(dtype=float)
+        return np.where(np.isnan(found), -1, found).astype(np.int64)
+
+    def join(self, accessions, keys, options, store=None):
+        """Makes the annotation table for a list of accessions.
+        accessions: values for the Index column
+        keys: lookup accessions (e.g. BLAST orthologs)
+        options: GUI window (or TableOptions)
+        store: AnnotationStore to look up keys that are not in the frame (cross-reference
+               IDs, and records added from other sources that have all of the field groups)
+        Returns the table and the number of failed lookups."""
+        rows = self.rows(keys)
+        missing = np.flatnonzero(rows < 0)
+        found = []
+        for i in missing:
+            annotations = store.lookup(keys[i])[0] if store else None
+            if annotations is None:
+                continue
+            row = self.aliases.get(annotations.fasta_accession)
+            if row is not None:
+                rows[i] = row   # found by a cross-reference ID
+            elif self.GROUPS <= annotations.groups:
+                found.append((i, annotations))
+        table = self.table.take(np.maximum(rows, 0)).reset_index(drop=True)
+        missing = np.flatnonzero(rows < 0)
+        table.loc[missing, :] = 'na'
+        failed = len(missing) - len(found)
+        if found:   # records from other sources (not parsed or loaded here)
+            extra = TableOptions(options.dat_file, [keys[i] for (i, x) in found],
+                                 [x for (i, x) in found], self.species)
+            extra_table = AnnotationTable(extra).table
+            extra_table = extra_table.reindex(columns=table.columns, fill_value='na')
+            table.loc[[i for (i, x) in found], :] = extra_table.values
+        table['Index'] = list(accessions)
+        return table[self.columns(options)], failed
+
+    def columns(self, options):
+        """Returns the table columns for the GUI options."""
+        columns = []
+        for column in self.table.columns:
+            if column in self.PROPERTY_COLUMNS:
+                keep = options.pp_var.get() == 1
+            elif column.startswith('MGI '):
+                keep = options.radio_var.get() == 2
+            elif ' (depth ' in column:
+                keep = options.kw_var.get() == 1 and column.endswith('(depth %s)' % keyword_depth())
+            elif column == 'Key Words' or column.startswith('KW: '):
+                keep = options.kw_var.get() == 1
+            elif column.startswith('GO: '):
+                keep = options.go_var.get() == 1
+            elif column in self.PATHWAY_COLUMNS:
+                keep = options.pw_var.get() == 1
+            elif column.startswith('CC: '):
+                keep = options.cc_var.get() == 1
+            else:
+                keep = True
+            if keep:
+                columns.append(column)
+        return columns
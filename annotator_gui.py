@@ -0,0 +1,886 @@
+"""annotator_gui.py - the Protein Annotator window (tkinter).
+
+Started by running add_uniprot_annotations.py. Kept apart from the parsing and
+lookup code so that it can be imported without opening a window.
+
+The MIT License (MIT)
+
+Copyright (c) 2019 Phillip A. Wilmarth, OHSU
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import time
+import collections
+import threading
+
+from tkinter import *
+
+import pandas as pd
+
+import ortholog_mapper
+from add_uniprot_annotations import (AnnotationStore, Annotations, CHANGE_COLUMNS, EVIDENCE_FILTERS,
+                                     MergedStore, RunLog, SPECIES_TAXIDS, StreamingJoin,
+                                     dat_sources, get_file, recent_dat_files, remember_dat_file)
+from annotation_tables import AnnotationTable, RowCache
+
+
+class StatusBar(Frame):
+    """window status bar class with set and clear methods.
+    Code from "http://effbot.org/tkinterbook/text.htm"
+    """
+    def __init__(self, master):
+        Frame.__init__(self, master)
+        self.label = Label(self, bd=1, padx=5, pady=1, relief=SUNKEN, anchor=W)
+        self.label.pack(fill=X)
+        return
+               
+    def set(self, format, *args):
+        self.label.config(text=format % args)
+        self.label.update_idletasks()
+        return
+            
+    def clear(self):
+        self.label.config(text="")
+        self.label.update_idletasks()
+        return     
+    # end StatusBar class  
+
+class ProteinAnnotator:
+    """Object creating the main GUI window."""
+    def __init__(self):
+        self.root = Tk()
+        self.root.title('Protein Annotator')
+        self.myFrame = Frame(self.root)
+        self.myFrame.pack()
+        self.radio_var = IntVar()
+        self.kw_var = IntVar()
+        self.pw_var = IntVar()
+        self.go_var = IntVar()
+        self.sf_var = IntVar()
+        self.pp_var = IntVar()
+        self.cc_var = IntVar()
+        self.ab_var = IntVar()
+        self.ev_var = StringVar()
+        
+        # set default values
+        self.radio_var.set(1)
+        self.kw_var.set(1)
+        self.pw_var.set(1)
+        self.go_var.set(1)
+        self.sf_var.set(0)
+        self.pp_var.set(0)
+        self.cc_var.set(0)
+        self.ab_var.set(0)
+        self.ev_var.set('all')
+        
+        # create a button toolbar
+        self.toolbar = Frame(self.myFrame)
+
+        self.b1 = self.make_toolbar_button('Get accessions', self.get_accessions)
+        self.b2 = self.make_toolbar_button('Parse DAT file', self.parse_dat_file, width=13)
+        self.b8 = self.make_toolbar_button('Scan large DAT', self.scan_dat_file, width=13)
+        self.b10 = self.make_toolbar_button('Get peptides', self.get_peptides)
+        self.b3 = self.make_toolbar_button('Blast mapping', self.blast_mapping)
+        self.b9 = self.make_toolbar_button('K-mer mapping', self.kmer_mapping, width=13)
+        self.b4 = self.make_toolbar_button('Add annotations', self.add_annotations)
+        self.b5 = self.make_toolbar_button('Reset', self.clear_data, width=8)
+        self.b6 = self.make_toolbar_button('Help', self.print_help, width=8)
+        self.b7 = self.make_toolbar_button('Quit', self.quit_me, width=8)
+
+        self.toolbar.pack(side=TOP, fill=X)
+        
+        #create an option bar
+        self.option_bar = Frame(self.myFrame)
+        self.rb_frame = Frame(self.option_bar, bd=2, relief=SUNKEN)  # radiobuttons frame
+
+        self.rb1 = self.make_radiobutton('human', 1)
+        self.rb2 = self.make_radiobutton('mouse', 2)
+        self.rb3 = self.make_radiobutton('arabidopsis', 3)
+        
+        self.rb_frame.pack(side=LEFT, fill=X, padx=5, pady=5)
+
+        self.ev_frame = Frame(self.option_bar, bd=2, relief=SUNKEN)  # evidence filter frame
+        Label(self.ev_frame, text='Evidence:').pack(side=LEFT, padx=5)
+        self.ev_menu = OptionMenu(self.ev_frame, self.ev_var, *EVIDENCE_FILTERS)
+        self.ev_menu.config(width=12)
+        self.ev_menu.pack(side=LEFT, padx=5, pady=2)
+        self.ev_frame.pack(side=LEFT, fill=X, padx=5, pady=5)
+                
+        self.cb_frame = Frame(self.option_bar, bd=2, relief=SUNKEN)  # checkboxes frame
+
+        self.options = IntVar()        
+        self.cb7 = self.make_checkbutton('Abundances', self.ab_var)
+        self.cb4 = self.make_checkbutton('Summary Files', self.sf_var)
+        self.cb5 = self.make_checkbutton('Properties', self.pp_var)
+        self.cb6 = self.make_checkbutton('Comments', self.cc_var)
+        self.cb3 = self.make_checkbutton('Pathways', self.pw_var)
+        self.cb2 = self.make_checkbutton('GO Terms', self.go_var)
+        self.cb1 = self.make_checkbutton('Keywords', self.kw_var)
+
+
+
+        
+        self.cb_frame.pack(side=RIGHT, fill=X)
+        self.option_bar.pack(side=TOP, fill=X, padx=5, pady=5)
+        
+        # add a multi-line text box with scrollbars
+        self.textFrame = Frame(self.myFrame, bd=2, relief=SUNKEN)
+        self.textFrame.grid_rowconfigure(0, weight=1)
+        self.textFrame.grid_columnconfigure(0, weight=1)
+        
+        self.text = Text(self.textFrame, height=40, width=132,
+                         wrap=NONE, padx=5, pady=5)
+        self.xscroll = Scrollbar(self.textFrame, orient=HORIZONTAL,
+                                 command=self.text.xview)
+        self.xscroll.grid(row=1, column=0, sticky=W+E)
+        self.yscroll = Scrollbar(self.textFrame, command=self.text.yview)
+        self.yscroll.grid(row=0, column=1, sticky=N+S)
+        
+        self.text.configure(xscrollcommand=self.xscroll.set)
+        self.text.configure(yscrollcommand=self.yscroll.set)
+        self.text.grid(row=0, column=0, sticky=N+S+E+W)
+        
+        self.textFrame.pack()
+
+        # add a status line
+        self.status = StatusBar(self.myFrame)
+        self.status.pack(side=BOTTOM, fill=X)
+        self.status.set("%s", "Status line")
+        self.print_help()
+
+        # define the actual structures for the data
+        self.accessions = None      # holds list of accessions
+        self.abundances = None      # optional numeric columns read with the accessions
+        self.acc_read = False       # flag for if accessions are loaded
+        self.dat_file = None        # DAT file path and name
+        self.scan_file = None       # large DAT file (e.g. TrEMBL) last streamed for accessions
+        self.dat_read = False       # flag for if DAT file parsed
+        self.default = os.getcwd()  # can set a default location here
+        self.store = None           # species partitioned annotations from DAT file
+        self.annotations = []       # list of matching annotations 
+        self.blast_map = {}         # optional BLAST ortholog mapping
+        self.blast_brief = {}       # condensed BLAST information
+        self.blast_matches = {}     # BLAST match information for loaded accessions
+        self.blast_read = False     # flag for if BLAST map was read in
+        self.run_log = RunLog()     # stage timings, memory use, and counters
+        self.row_cache = RowCache() # formatted table rows from earlier runs
+        self.loader = None          # background load of the last used DAT file
+        self.loaded = (None, None)  # (store, error) from the background load
+        self.load_number = 0        # current background load (results of older ones are dropped)
+        self.load_lock = threading.Lock()
+        self.warm_up()
+        
+        # enter main loop
+        self.root.mainloop()
+
+    def make_toolbar_button(self, _text, _command, width=12):
+        """Makes toolbar buttons
+        _text: string; button text
+        _command: method; method to be executed when button is clicked
+        width: int; desired width of button
+        """
+        b = Button(self.toolbar, text=_text, width=width, command=_command,
+                   borderwidth=2, relief=RAISED)
+        b.pack(side=LEFT, padx=5, pady=5)
+        return(b)
+    
+    def make_radiobutton(self, _text, _value):
+        """Makes a radio button for option bar'
+        _text: string; button text
+        _value: int; radiobutton value"""
+        rb = Radiobutton(self.rb_frame, text = _text, variable = self.radio_var,
+                         value = _value, width = 12, borderwidth = 2,
+                         command = self.select_species)
+        rb.pack(side=LEFT, padx=5, pady=5)
+        return(rb)
+        
+    def make_checkbutton(self, _text, var):
+        """Makes a checkbutton for the option bar
+        _text: string; checkbutton text
+        var: int; variable value"""
+        cb = Checkbutton(self.cb_frame, text = _text, width = 13, variable = var)
+        cb.pack(side=RIGHT, padx=5, pady=5)
+        return(cb)    
+
+    def _parse_accessions(self, clipboard):
+        """Helper function to parse an accessions from clipboard."""
+        headers = ['ACC', 'ACCESSION', 'ACCESSIONS', 'QUERY_ACC', 'HIT_ACC',
+                   'PEPTIDE', 'PEPTIDES', 'SEQUENCE']
+        acc = []
+        for line in clipboard:
+            line = line.strip().split()[0]
+            if ';' in line:
+                line = line.split(';')[0]
+            if not line or line.upper() in headers:
+                continue
+            if line.endswith('_family'):
+                line = line.replace('_family', '')
+            acc.append(line)
+        return acc
+
+    def _parse_abundances(self, clipboard, count):
+        """Helper function to parse the numeric columns next to the accessions (tab
+        separated with a header line of sample names). Returns a dataframe with one row
+        per parsed accession (None if there are no numeric columns)."""
+        headers = ['ACC', 'ACCESSION', 'ACCESSIONS', 'QUERY_ACC', 'HIT_ACC',
+                   'PEPTIDE', 'PEPTIDES', 'SEQUENCE']
+        rows = [line.rstrip('\r\n').split('\t') for line in clipboard]
+        if not rows or rows[0][0].strip().upper() not in headers:
+            print('WARNING: abundances need a header line with the sample names')
+            return None
+        names = [x.strip() for x in rows[0]]
+        for i, name in enumerate(names):     # (blank or repeated sample names)
+            if not name or names.index(name) < i:
+                names[i] = '%s (%d)' % (name if name else 'Column', i + 1)
+        rows = [row + [''] * (len(names) - len(row)) for row in rows[1:]
+                if row[0].strip() and row[0].strip().upper() not in headers]
+        if len(rows) != count:
+            print('WARNING: abundance rows do not match the accessions')
+            return None
+        text = pd.DataFrame([row[1:len(names)] for row in rows], columns=names[1:])
+        text = text.apply(lambda x: x.str.strip())
+        numbers = text.apply(pd.to_numeric, errors='coerce')
+        missing = text.apply(lambda x: x.str.lower().isin(['', 'na', 'nan', '#n/a']))
+        numeric = [col for col in numbers.columns
+                   if numbers[col].notna().any() and (numbers[col].notna() != missing[col]).all()]
+        if not numeric:
+            return None
+        return numbers[numeric].fillna(0.0)
+    
+    # toolbar button functions
+
+    def get_accessions(self):
+        """Gets column of accessions from the clipboard."""
+        try:
+            clipboard = self.root.clipboard_get()
+        except:
+            clipboard = None
+        clipboard = clipboard.splitlines()
+
+        # parse accessions
+        accessions = self._parse_accessions(clipboard)
+        
+        if len(accessions) == 0:
+            self.clear_screen()
+            accessions = []
+            self.acc_read = False
+            self.text.insert("1.0", 'WARNING: Clipboard was empty!')
+            self.status.set("%s", 'WARNING: Clipboard was empty!')
+            return
+
+        # make accessions table
+        self.accessions = pd.DataFrame({'Accession': accessions})
+        self.acc_read = True
+        self.abundances = None
+        if self.ab_var.get() == 1:
+            self.abundances = self._parse_abundances(clipboard, len(accessions))
+            if self.abundances is not None:
+                print('%d abundance columns read: %s' % (len(self.abundances.columns),
+                                                       ', '.join(self.abundances.columns)))
+
+        # echo the accessions to the screen
+        self.echo_dataframe(self.accessions)
+        self.status.set("%s", "%s accessions read from clipboard" % len(self.accessions))
+        return
+
+    def get_peptides(self):
+        """Gets column of peptide sequences from the clipboard and finds the proteins
+        in the selected species that contain them (I and L are equivalent)."""
+        self.clear_screen()
+        self.wait_for_store()
+        if not self.dat_read:
+            self.print_string('Please parse a DAT file!')
+            return
+        try:
+            clipboard = self.root.clipboard_get()
+        except:
+            clipboard = ''
+        peptides = self._parse_accessions(clipboard.splitlines())
+        if len(peptides) == 0:
+            self.acc_read = False
+            self.text.insert("1.0", 'WARNING: Clipboard was empty!')
+            self.status.set("%s", 'WARNING: Clipboard was empty!')
+            return
+
+        self.status.set("%s", "matching %s peptides (be patient if first time)" % len(peptides))
+        with self.run_log.stage('peptide_index', taxid=self.get_taxid()):
+            index = self.store.peptide_index()
+        with self.run_log.stage('peptide_matching', peptides=len(peptides)):
+            matches = index.match(peptides)
+
+        # the first matching protein is used like an ortholog mapping
+        rows = []
+        for peptide, refs in zip(peptides, matches):
+            prot_accs = [index.accessions[i] for i in refs]
+            if not prot_accs:
+                rows.append([peptide, 'NA', 'NA', 'proteins:0', 'No_match'])
+                continue
+            status = 'Unique' if len(prot_accs) == 1 else 'Shared'
+            annotations = self.store.lookup(prot_accs[0])[0]
+            rows.append([peptide, prot_accs[0], annotations.description(),
+                         'proteins:%d %s' % (len(prot_accs), '; '.join(prot_accs)), status])
+        self.accessions = pd.DataFrame({'Accession': peptides})
+        self.abundances = None
+        self.acc_read = True
+        self.blast_map = {}
+        self.blast_brief = pd.DataFrame(rows, columns=ortholog_mapper.BRIEF_COLUMNS)
+        self.blast_read = True
+        self._use_blast_brief('peptide')
+        return
+
+    def select_dat_file(self):
+        """Get UniProt flat format text file (DAT file) name (empty if cancelled)."""
+        ext_list = [('GZip files', '*.gz'), ('DAT files', '*.dat')]
+        message = 'Select a UniProt DAT file'
+        recent = recent_dat_files()
+        default = os.path.dirname(recent[0]) if recent else self.default
+        return get_file(default, ext_list, message)   # self.root is the root window
+
+    def make_store(self, dat_file):
+        """Returns the annotation store for a DAT file (merged with any other DAT sources)."""
+        sources = [x for x in dat_sources() if x != os.path.abspath(dat_file)]
+        if sources:
+            print('DAT sources in priority order:', ', '.join([dat_file] + sources))
+            return MergedStore([dat_file] + sources, run_log=self.run_log)
+        return AnnotationStore(dat_file, run_log=self.run_log)
+
+    def parse_dat_file(self):
+        """Gets UniProt DB file and makes accession maps."""
+        # browse to DAT file
+        dat_file = self.select_dat_file()
+        if not dat_file: return   # cancel button response
+        if self.loader is not None:
+            if os.path.abspath(dat_file) == os.path.abspath(self.dat_file):
+                self.wait_for_store()   # already loading in the background
+                if self.store is not None:
+                    return
+            else:
+                self.cancel_loading()
+        self.dat_file = dat_file
+        
+        # reload the selected species from the cache (or parse the DAT file the first time)
+        self.status.set("%s", "loading DAT file annotations (be patient if new DAT file)")
+        self.store = self.make_store(self.dat_file)
+        self.store.open(self.get_taxid(), self.selected_groups())
+        self.precompute()
+        remember_dat_file(self.dat_file)
+        self.show_store_counts()
+
+    def show_store_counts(self):
+        """Prints the record counts of a newly loaded DAT file."""
+        count = self.store.count()
+        print('DB count: %s, %s records loaded for taxonomy %s' % (count, self.store.loaded_count(),
+                                                                   self.get_taxid()))
+        print("DONE processing annotations")
+        self.status.set("%s", 'DB count: %s, %s records loaded for taxonomy %s' %
+                        (count, self.store.loaded_count(), self.get_taxid()))
+        self.dat_read = True
+
+    def warm_up(self):
+        """Starts loading the most recently used DAT file in a background thread, so it is
+        ready by the time the accessions are copied (ANNOTATOR_WARM_UP=0 turns this off)."""
+        recent = recent_dat_files()
+        if not recent or os.environ.get('ANNOTATOR_WARM_UP', '1') in ('', '0'):
+            return
+        self.dat_file = recent[0]
+        self.load_number += 1
+        self.loader = threading.Thread(target=self._load_store,
+                                       args=(self.dat_file, self.get_taxid(), self.selected_groups(),
+                                             self.load_number),
+                                       daemon=True)
+        self.loader.start()
+        self.status.set("%s", "loading %s in the background" % os.path.basename(self.dat_file))
+        self.root.after(500, self.check_loader)
+        return
+
+    def _load_store(self, dat_file, taxid, groups, number):
+        """Loads a DAT file (runs in the background thread, so no window updates here).
+        number: load number; the results are dropped if the load was cancelled"""
+        try:
+            store = self.make_store(dat_file)
+            store.open(taxid, groups)
+            result = (store, None)
+        except Exception as error:
+            result = (None, error)
+        with self.load_lock:
+            if number == self.load_number:
+                self.loaded = result
+        return
+
+    def cancel_loading(self):
+        """Drops the background load. The thread cannot be stopped, so it finishes the
+        load, but the results are not kept."""
+        with self.load_lock:
+            self.load_number += 1
+            self.loaded = (None, None)
+        self.loader = None
+        return
+
+    def check_loader(self):
+        """Checks on the background load every half second (from the window event loop)."""
+        if self.loader is None:
+            return
+        if self.loader.is_alive():
+            self.root.after(500, self.check_loader)
+        else:
+            self.finish_loading()
+        return
+
+    def wait_for_store(self):
+        """Waits for the background load to finish (if one is still running)."""
+        if self.loader is None:
+            return
+        if self.loader.is_alive():
+            self.status.set("%s", "waiting for %s to finish loading" % os.path.basename(self.dat_file))
+            self.loader.join()
+        self.finish_loading()
+        return
+
+    def finish_loading(self):
+        """Uses the results of the background load."""
+        self.loader = None
+        store, error = self.loaded
+        self.loaded = (None, None)
+        if error is not None:
+            print('WARNING: loading %s failed: %s' % (self.dat_file, error))
+            self.status.set("%s", "Background load failed, please parse a DAT file")
+            self.dat_file = None
+            return
+        self.store = store
+        if self.store.taxid != self.get_taxid():
+            self.store.select(self.get_taxid())     # (species changed during the load)
+        self.precompute()
+        print('%s loaded in the background' % self.dat_file)
+        self.show_store_counts()
+        return
+##        writeFile(self)   # optionally write annotations to separate files by category
+##        self.acc_mapping()  # lookup the annotations for the accessions
+##        self.status.set("%s", "%s protein annotation records parsed" % len(self.annotations))
+
+    def get_taxid(self):
+        """Returns the taxonomy number of the selected species radio button."""
+        return SPECIES_TAXIDS[self.radio_var.get()]
+
+    def precompute(self):
+        """Makes (or reloads) the annotation table for every protein in the selected
+        species if the ANNOTATOR_PRECOMPUTE environment variable is set."""
+        if os.environ.get('ANNOTATOR_PRECOMPUTE', '0') not in ('', '0'):
+            self.status.set("%s", "making annotation table for all proteins")
+            self.store.annotation_frame(build=True)
+        return
+
+    def selected_groups(self):
+        """Returns the optional field groups needed for the selected options."""
+        groups = []
+        if self.kw_var.get() == 1:
+            groups.append('keywords')
+        if self.go_var.get() == 1:
+            groups.append('go')
+        if self.pw_var.get() == 1:
+            groups.append('pathways')
+        if self.radio_var.get() == 2:
+            groups.append('mgi')
+        if self.pp_var.get() == 1:
+            groups.append('sequence')
+        if self.cc_var.get() == 1:
+            groups.append('comments')
+        return groups
+
+    def select_species(self):
+        """Loads the annotations for a newly selected species."""
+        if self.loader is not None:
+            return      # (the background load selects the species when it finishes)
+        if self.store is None:
+            return
+        self.status.set("%s", "loading annotations for taxonomy %s" % self.get_taxid())
+        self.store.select(self.get_taxid())
+        self.precompute()
+        self.status.set("%s", "%s records loaded for taxonomy %s" % (self.store.loaded_count(),
+                                                                     self.get_taxid()))
+        return
+
+    def scan_dat_file(self):
+        """Streams a very large DAT file (e.g. TrEMBL) once and keeps only the
+        records for the loaded accessions (or their BLAST orthologs)."""
+        if not self.acc_read:
+            self.clear_screen()
+            self.print_string('Please load some accessions from the clipboard!')
+            return
+        self.wait_for_store()
+        scan_file = self.select_dat_file()
+        if not scan_file: return   # cancel button response
+        self.scan_file = scan_file  # (self.dat_file stays the parsed DAT file, e.g. Swiss-Prot)
+
+        accessions = sorted(set(self.blast_map.get(acc, acc) for acc in self.accessions.iloc[:, 0]))
+        self.status.set("%s", "scanning DAT file for %s accessions (be patient)" % len(accessions))
+        with self.run_log.stage('stream_join', dat_file=self.scan_file, accessions=len(accessions)):
+            joiner = StreamingJoin(self.scan_file)
+            count, dat_dict, missing = joiner.scan(accessions)
+            self.run_log.count('records_parsed', count)
+            self.run_log.count('records_scanned', joiner.scanned)
+
+        # add to any annotations already loaded (e.g. Swiss-Prot first, then TrEMBL)
+        if self.store is None:
+            self.store = AnnotationStore(run_log=self.run_log)
+            self.dat_file = self.scan_file  # (only the scanned records, e.g. for the keyword list)
+        self.store.add(dat_dict)
+        self.dat_read = True
+        print('%d matching records found, %d accessions not found' % (count, len(missing)))
+        self.status.set("%s", '%d matching records found, %d accessions not found' % (count, len(missing)))
+
+    def blast_mapping(self):
+        """Use Blast ortholog mapping to model organism's DAT file"""
+        # check is accessions have been loaded
+        if not self.acc_read:
+            self.clear_screen()
+            self.print_string('Please load some accessions from the clipboard!')
+            return
+
+        # browse to BLAST map TXT file
+        ext_list = [('Text files', '*.txt')]
+        message = 'Select a BLAST mapping file'
+        blast_map_file = get_file(self.default, ext_list, message)
+        if not blast_map_file: return   # cancel button response
+        
+        # read the mapping file
+        try:
+            blast = pd.read_csv(blast_map_file, sep='\t', skiprows=5)       
+            # drop some columns we do not need
+            if 'match_status' in blast.columns:
+                keep = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'match_status']
+            else:
+                keep = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'status']   # older BLAST map files
+            blast = blast.dropna(thresh=4) # this should drop rows after the main table
+            self.blast_brief = blast[keep]
+        except KeyError:
+            blast = pd.read_csv(blast_map_file, sep='\t', skiprows=4)       
+            # drop some columns we do not need
+            if 'match_status' in blast.columns:
+                keep = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'match_status']
+            else:
+                keep = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'status']   # older BLAST map files 
+            blast = blast.dropna(thresh=4) # this should drop rows after the main table
+            self.blast_brief = blast[keep]
+        self.blast_read = True
+        self._use_blast_brief('BLAST')
+        return
+
+    def kmer_mapping(self):
+        """Maps query sequences from a FASTA file to the selected species using shared
+        k-mers (no BLAST needed) and uses the results like a BLAST mapping file."""
+        # check is accessions have been loaded and DAT file parsed
+        self.clear_screen()
+        if not self.acc_read:
+            self.print_string('Please load some accessions from the clipboard!')
+            return
+        self.wait_for_store()
+        if not self.dat_read:
+            self.print_string('Please parse a DAT file!')
+            return
+
+        # browse to FASTA file of query sequences
+        ext_list = [('FASTA files', '*.fasta'), ('FASTA files', '*.fa'), ('All files', '*.*')]
+        message = 'Select a FASTA file with the query protein sequences'
+        fasta_file = get_file(self.default, ext_list, message)
+        if not fasta_file: return   # cancel button response
+
+        # identical sequences are mapped first (no homology search needed)
+        with self.run_log.stage('exact_mapping', fasta_file=fasta_file):
+            rows, unmatched = ortholog_mapper.map_exact(ortholog_mapper.read_fasta(fasta_file),
+                                                        self.store.sequence_index())
+            self.run_log.count('exact_matches', len(rows))
+        print('%d identical sequences, %d left for k-mer mapping' % (len(rows), len(unmatched)))
+
+        if unmatched:
+            # save the remaining sequences in case they need to be BLASTed
+            ortholog_mapper.write_fasta(unmatched, os.path.splitext(fasta_file)[0] + '_not-identical.fasta')
+            self.status.set("%s", "building k-mer index for taxonomy %s" % self.get_taxid())
+            with self.run_log.stage('kmer_index', taxid=self.get_taxid()):
+                index = self.store.kmer_index()
+            self.status.set("%s", "mapping query sequences (be patient)")
+            with self.run_log.stage('kmer_mapping', fasta_file=fasta_file):
+                rows += index.map_sequences(unmatched)
+        self.blast_brief = pd.DataFrame(rows, columns=ortholog_mapper.BRIEF_COLUMNS)
+        self.blast_read = True
+        self._use_blast_brief('k-mer')
+        return
+
+    def _use_blast_brief(self, source):
+        """Makes the ortholog accession map from blast_brief and echos the results.
+        source: string; where the mappings came from (for the status line)"""
+        # make the accession mapping dictionary (allow for parsed accessions) 
+        for query, hit in zip(self.blast_brief['query_acc'], self.blast_brief['hit_acc']):
+            if hit == 'NA':
+                continue    # no ortholog found
+            self.blast_map[query] = hit
+            if len(query.split('|')) == 3:     # UniProt format
+                   self.blast_map[query.split('|')[1]] = hit
+                   self.blast_map[query.split('|')[2]] = hit
+            if (len(query.split('|')) == 1) and ('.' in query): # NCBI and Ensembl format
+                self.blast_map[query.split('.')[0]] = hit
+            
+            
+        # save some of the BLAST results in a dictionary keyed by query_acc
+        match_count = self.get_blast_matches()
+                
+        # write BLAST results to screen and cliboard
+        self.echo_dataframe(self.blast_table)
+        self.root.clipboard_clear()
+        self.root.clipboard_append(self.blast_table.to_csv(sep='\t', line_terminator='\r', index=False))
+        self.status.set("%s", "%s %s mappings read in (echoed to screen and clipboard)" % (match_count, source))
+        return
+    
+    def get_blast_matches(self):
+        """Gets BLAST info for the loaded accessions."""
+        # save some of the BLAST results in a dictionary keyed by query_acc
+        if not self.blast_read:
+            return 0
+        self.blast_matches = {}
+        row_count = 1
+        for row_tuple in self.blast_brief.iterrows():
+            row = row_tuple[1]
+            acc = row['query_acc']
+            self.blast_matches[row['query_acc']] = [str(x) for x in row]
+            row_count += 1
+            if len(acc.split('|')) == 3:     # UniProt format
+                   self.blast_matches[acc.split('|')[1]] = [str(x) for x in row]
+                   self.blast_matches[acc.split('|')[2]] = [str(x) for x in row]
+            if (len(acc.split('|')) == 1) and ('.' in acc): # NCBI and Ensembl format
+                self.blast_matches[acc.split('.')[0]] = [str(x) for x in row]
+
+        # organize by accession list (if loaded from clipboard)
+        if self.acc_read:
+            keys = list(self.accessions['Accession'])
+        else:
+            keys = self.blast_matches.keys()
+
+        # create a pandas dataframe for the BLAST data
+        rows = []
+        for key in keys:
+            try:
+                rows.append([key] + self.blast_matches[key])
+            except KeyError:
+                rows.append([key, 'NA', 'NA', 'NA', 'NA', 'NA'])
+
+        # make a pandas dataframe
+        self.blast_table = pd.DataFrame(rows, columns = ['Index', 'query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'match_status'])
+
+        return row_count            
+
+    def add_annotations(self):
+        """Prints annotations to the window."""
+        # make sure we have accessions and have parsed a DAT file
+        return_flag = False
+        self.wait_for_store()
+        self.clear_screen()
+        if not self.acc_read:
+            self.print_string('Please load some accessions from the clipboard!')
+            return_flag = True
+        if not self.dat_read:
+            self.print_string('Please parse a DAT file!')
+            return_flag = True
+        if return_flag:
+            self.status.set("%s", "Annotation lookup failed")
+            return
+
+        # use the precomputed table for the species if there is one
+        self.get_blast_matches()
+        frame = self.store.annotation_frame()
+        if frame is not None and frame.usable(self):
+            with self.run_log.stage('frame_join', accessions=len(self.accessions)):
+                accessions = list(self.accessions.iloc[:, 0])
+                keys = [self.blast_map.get(acc, acc) for acc in accessions]
+                table, failed = frame.join(accessions, keys, self, self.store)
+                self.run_log.count('lookup_failed', failed)
+            print('%s accessions joined to the precomputed table, %d lookups failed' %
+                  (len(accessions), failed))
+        else:
+            # lookup the annotations for the accessions (parsing any newly checked options)
+            self.store.require(self.selected_groups())
+            with self.run_log.stage('acc_mapping', accessions=len(self.accessions)):
+                self.acc_mapping()
+            print("%s protein annotation records parsed" % len(self.annotations))
+            if self.store.layout == 'disk':
+                print('...record cache: %(hits)s hits, %(misses)s misses, %(evictions)s evictions, '
+                      '%(records)s records (%(cached_mb)s of %(budget_mb)s MB)' % self.store.cache_stats())
+            self.status.set("%s", "%s protein annotation records parsed" % len(self.annotations))
+            with self.run_log.stage('make_tables'):
+                if self.sf_var.get() == 1:
+                    annotation_table = AnnotationTable(self)    # summary files need every protein
+                    table = annotation_table.table
+                    self.write_change_report(annotation_table.reports_folder)
+                else:
+                    table = self.row_cache.table(self, self.store.fingerprint)
+                    self.run_log.count('rows_reused', self.row_cache.reused)
+                    self.run_log.count('rows_formatted', self.row_cache.formatted)
+                    print('...%d table rows reused, %d formatted' % (self.row_cache.reused,
+                                                                    self.row_cache.formatted))
+
+        # format the annotation table (with or without the BLAST mapping info)
+        if self.blast_read:
+            annot_table = pd.merge(self.blast_table, table, on='Index')
+        else:
+            annot_table = table
+
+        # write annotations to screen and clipboard
+        with self.run_log.stage('write_results'):
+            self.echo_dataframe(annot_table)
+            self.root.clipboard_clear()
+            self.root.clipboard_append(annot_table.to_csv(sep='\t', line_terminator='\r', index=False))
+            self.run_log.count('rows_written', len(annot_table))
+        self.status.set("%s", "Annotations shown above and written to clipboard")
+        print('Annotations added for %s proteins' % len(self.accessions))
+        
+    def write_change_report(self, reports_folder):
+        """Writes the annotation changes of the loaded accessions since the previous
+        release (only if the DAT file was parsed as an update of a cached release)."""
+        if not reports_folder:
+            return
+        rows = self.store.change_report(list(self.accessions.iloc[:, 0]))
+        if rows is None:
+            return
+        report = open(os.path.join(reports_folder, 'release_changes_report.txt'), 'w')
+        print('Release Changes Report generated on:', time.ctime(), file=report)
+        print('DAT file:', self.dat_file, '\n', file=report)
+        print('\t'.join(CHANGE_COLUMNS), file=report)
+        for row in rows:
+            print('\t'.join(row), file=report)
+        report.close()
+        counts = collections.Counter(row[2] for row in rows)
+        print('...changes since the previous release:',
+              ', '.join('%d %s' % (n, change) for (change, n) in sorted(counts.items())))
+        return
+
+    def acc_mapping(self):
+        """Looks up annotations given loaded accessions."""
+        # save annotations in a list (should be matched to self.accessions)
+        self.annotations = []
+        failed = []
+        xrefs = 0
+        for acc in self.accessions.iloc[:, 0]:
+            if acc in self.blast_map:
+                acc = self.blast_map[acc]   # work with ortholog accession if it exists
+                self.run_log.count('lookup_via_blast')
+            annotations, alias_type = self.store.lookup(acc)
+            if annotations is not None:
+                self.annotations.append(annotations)
+                self.run_log.count(alias_type)
+                xrefs += alias_type == 'lookup_xref'
+            else:
+                failed.append(acc)
+                # need a blank annotation object
+                self.annotations.append(Annotations())
+        self.run_log.count('lookup_failed', len(failed))
+                     
+        print('\nDone fetching annotations for %s accessions' % len(self.annotations))
+        if xrefs:
+            print('%d accessions found with DR line cross-references (RefSeq, Ensembl, etc.)' % xrefs)
+        print('%d lookups failed' % len(failed))
+        if failed:
+            print('failed lookups:', ', '.join(failed[:20]) + (' ...' if len(failed) > 20 else ''))
+        self.status.set("%s", "%s protein accessions looked up" % len(self.accessions))
+       
+    def clear_screen(self):
+        """Clears the window."""
+        self.text.delete("1.0", END)
+        self.status.set("%s", "Screen Cleared")
+            
+    def clear_data(self):
+        """Clears the window contents and clipboard."""
+        self.text.delete("1.0", END)
+        self.root.clipboard_clear()
+        self.root.clipboard_append("")
+        self.cancel_loading()
+        self.dat_file = None
+        self.scan_file = None
+        self.dat_read = False
+        self.store = None
+        self.accessions = []
+        self.abundances = None
+        self.acc_read = False
+        self.blast_read = False
+        self.status.set("%s", "Data and screen cleared")
+    
+    def print_help(self):
+        """Prints some help info to the window."""
+        self.clear_screen()
+        help_text = \
+"""Program add_protein_annotations.py, version 1.0
+
+Takes a list of protein accessions from a PAW results file (typically Excel) for human,
+mouse, or arabidopsis and adds additional annotations from UniProt (Swiss-Prot) DAT files.
+
+"Get accessions" => reads UniProt accessions from the clipboard and echos them to the screen.
+
+"Parse DAT file" => parses a selected UniProt DAT file and extracts annotations of interest.
+The last DAT file used starts loading in the background when the program starts.
+
+"Scan large DAT" => makes one pass through a very large DAT file (like TrEMBL) and keeps
+only the records for the loaded accessions. Matches are saved for faster rescans.
+
+"Get peptides" => reads peptide sequences from the clipboard and finds the proteins in
+the selected species that contain them (use after parsing a DAT file). Annotations are
+added for the first matching protein and all matches are listed.
+
+"Blast mapping" => uses ortholog mapping information from BLAST to bootstrap proteins
+from non-model organisms to human, mouse, or arabidopsis orthologs.
+
+"K-mer mapping" => maps the sequences in a FASTA file to the selected species. Identical
+sequences are matched first, then the rest using shared k-mers (no BLAST needed).
+Results are used the same way as a BLAST mapping.
+
+"Add annotations" => maps the UniPort accessions from the clipboard to the
+annotations from the UniProt DAT file. Writes results to screen and clipboard.
+The "Evidence" menu limits GO terms, keywords, CC pathways, CC comments, and
+alternative names to experimental evidence, or drops automatic annotations.
+"Comments" adds the CC FUNCTION, SUBCELLULAR LOCATION, TISSUE SPECIFICITY, and DISEASE text.
+"Abundances" reads the numeric columns copied with the accessions (with a header line)
+and adds their summed and mean values for each term to the summary files.
+
+"Reset" => clears data and the screen text window.
+
+"Help" => prints this information.
+
+"Quit" => ends the application.
+
+Written by Kyra Patton, OHSU, 2016.
+
+(and Phil Wilmarth, OHSU, 2016-2019)"""
+        self.text.insert("1.0", help_text)
+        self.status.set("%s", "Help Text")
+
+    def echo_dataframe(self, frame):
+        """Echoes the data from the clipboard to the window."""
+        self.clear_screen()
+        self.text.insert(CURRENT, frame.to_string(index=False))
+        self.text.insert(CURRENT, '\n')
+
+    def print_string(self, string):
+        self.text.insert(CURRENT, string)
+        self.text.insert(CURRENT, '\n')        
+        
+    def quit_me(self):
+        """Quits the application."""
+        self.status.set("%s", "Bye")
+        self.root.withdraw()
+        self.root.update_idletasks()
+        self.root.quit()
+        return
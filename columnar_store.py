@@ -0,0 +1,246 @@
+"""columnar_store.py - compact column storage of parsed DAT file annotations.
+
+Parsed protein records are normally kept as one Annotations object per protein,
+each with Python lists of Python strings, in dictionaries that have several keys
+for every record. This module stores the same fields as columns (struct of
+arrays). Strings are dictionary encoded: every distinct value (species names,
+keywords, GO terms, Reactome pathways, etc.) is kept once in a string table and
+the columns hold NumPy arrays of integer IDs. Multi-valued fields (keyword lists,
+GO terms, ...) are one flat ID array with an offsets array (the values for row i
+are flat[offsets[i]:offsets[i+1]]). A separate key -> row index gives exact
+record counts no matter how many lookup keys point to a record.
+
+Annotations objects are rebuilt on demand for code that needs them, and fields
+for many rows can be pulled out at once with array slicing.
+
+The MIT License (MIT)
+
+Copyright (c) 2019 Phillip A. Wilmarth, OHSU
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import array
+
+import numpy as np
+
+# (attribute path, kind) for the stored Annotations fields:
+#   string  - one string (or None) per record, dictionary encoded
+#   code    - one small integer per record
+#   strings - list of strings per record, dictionary encoded
+#   codes   - array.array of small integers per record
+#   numbers - array.array of integers per record
+FIELDS = [('identifier', 'string'), ('db', 'string'), ('accession', 'string'),
+          ('other_accessions', 'strings'), ('fasta_accession', 'string'),
+          ('name', 'string'), ('name_evidence', 'code'),
+          ('other_names', 'strings'), ('other_name_evidence', 'codes'), ('flags', 'strings'),
+          ('gene', 'string'), ('gene_evidence', 'code'), ('other_genes', 'strings'),
+          ('os', 'string'), ('ox', 'string'), ('mgi_acc', 'string'), ('mgi_gene', 'string'),
+          ('keywords', 'strings'), ('keyword_evidence', 'codes'),
+          ('go._go_num', 'strings'), ('go._go_type', 'strings'), ('go._go_desc', 'strings'),
+          ('go.evidence', 'codes'),
+          ('pathway.react_acc', 'strings'), ('pathway.react_desc', 'strings'),
+          ('pathway.react_string', 'string'), ('pathway.cc_string', 'string'),
+          ('pathway.cc_evidence', 'code'),
+          ('features.types', 'codes'), ('features.starts', 'numbers'),
+          ('features.ends', 'numbers'), ('features.notes', 'strings'),
+          ('sequence', 'string'), ('crc64', 'string'), ('seq_md5', 'string'),
+          ('comment_topics', 'strings'), ('comment_texts', 'strings'), ('comment_evidence', 'codes')]
+
+TYPECODES = {'codes': 'B', 'numbers': 'l'}
+
+
+def get_field(obj, path):
+    """Gets a (possibly nested, e.g. "go.evidence") attribute."""
+    for name in path.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+def set_field(obj, path, value):
+    """Sets a (possibly nested) attribute."""
+    names = path.split('.')
+    for name in names[:-1]:
+        obj = getattr(obj, name)
+    setattr(obj, names[-1], value)
+    return
+
+class StringTable:
+    """Distinct values with integer IDs (None is -1)."""
+
+    def __init__(self):
+        """Basic constructor."""
+        self.strings = []   # values in ID order
+        self.ids = {}       # value -> ID (only needed while building)
+        return
+
+    def encode(self, value):
+        """Returns the ID of a value (adding it if it is new)."""
+        if value is None:
+            return -1
+        try:
+            return self.ids[value]
+        except KeyError:
+            self.ids[value] = len(self.strings)
+            self.strings.append(value)
+            return self.ids[value]
+
+    def decode(self, ids):
+        """Returns the list of values for a sequence of IDs."""
+        strings = self.strings
+        return [strings[i] if i >= 0 else None for i in ids]
+
+    def freeze(self):
+        """Drops the value -> ID dictionary once all values are encoded."""
+        self.ids = None
+        return
+
+class ColumnarStore:
+    """Parsed annotations of many proteins stored as dictionary-encoded columns.
+    Supports the dictionary operations used for annotation lookups (key in store,
+    store[key]) where the values are rebuilt Annotations objects."""
+
+    def __init__(self, factory):
+        """factory: function (or class) returning an empty Annotations object"""
+        self.factory = factory
+        self.rows = 0           # number of records
+        self.keys = {}          # lookup key -> row number
+        self.collisions = 0     # keys shared by more than one record (first one is kept)
+        self.tables = {}        # string tables keyed by field path
+        self.columns = {}       # ID or code arrays keyed by field path
+        self.offsets = {}       # offsets arrays for multi-valued fields
+        self.groups = []        # field groups parsed for each record (sorted tuple ID)
+        self.group_table = StringTable()
+        return
+
+    @classmethod
+    def from_records(cls, records, factory, keys=None):
+        """Makes a store from a list of distinct Annotations objects.
+        keys: optional dictionary of lookup key -> Annotations object (default is
+              the identifier, accession, and FASTA accession of each record)"""
+        store = cls(factory)
+        store.rows = len(records)
+        for path, kind in FIELDS:
+            values = [get_field(x, path) for x in records]
+            if kind == 'string':
+                table = store.tables[path] = StringTable()
+                store.columns[path] = np.array([table.encode(x) for x in values], dtype=np.int32)
+            elif kind == 'code':
+                store.columns[path] = np.array(values, dtype=np.uint8)
+            else:
+                lengths = np.array([len(x) for x in values], dtype=np.int64)
+                store.offsets[path] = np.concatenate([[0], np.cumsum(lengths)])
+                if kind == 'strings':
+                    table = store.tables[path] = StringTable()
+                    store.columns[path] = np.array([table.encode(s) for x in values for s in x],
+                                                   dtype=np.int32)
+                else:
+                    flat = array.array(TYPECODES[kind])
+                    for x in values:
+                        flat.extend(x)
+                    store.columns[path] = np.frombuffer(flat, dtype=np.uint8 if kind == 'codes'
+                                                        else np.int64 if flat.itemsize == 8
+                                                        else np.int32).copy()
+        store.groups = np.array([store.group_table.encode(tuple(sorted(x.groups))) for x in records],
+                                dtype=np.int32)
+        for table in list(store.tables.values()) + [store.group_table]:
+            table.freeze()
+
+        # lookup keys
+        row_of = {id(x): i for (i, x) in enumerate(records)}
+        if keys is None:
+            keys = {}
+            for x in records:
+                for key in (x.identifier, x.accession, x.fasta_accession):
+                    keys.setdefault(key, x)
+        for key, annotations in keys.items():
+            row = row_of[id(annotations)]
+            if store.keys.setdefault(key, row) != row:
+                store.collisions += 1
+        return store
+
+    def __len__(self):
+        """Number of records (not keys)."""
+        return self.rows
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __getitem__(self, key):
+        return self.record(self.keys[key])
+
+    def get(self, key, default=None):
+        """Returns the rebuilt Annotations object for a key (or default)."""
+        return self.record(self.keys[key]) if key in self.keys else default
+
+    def field_values(self, path, rows=None):
+        """Returns the values of one field for many rows (all rows by default).
+        Multi-valued fields give a list for each row."""
+        kind = dict(FIELDS)[path]
+        rows = np.arange(self.rows) if rows is None else np.asarray(rows, dtype=np.int64)
+        column = self.columns[path]
+        if kind == 'string':
+            return self.tables[path].decode(column[rows])
+        elif kind == 'code':
+            return column[rows].tolist()
+        offsets = self.offsets[path]
+        if kind == 'strings':
+            decode = self.tables[path].decode
+            return [decode(column[offsets[i]:offsets[i+1]]) for i in rows]
+        return [column[offsets[i]:offsets[i+1]] for i in rows]
+
+    def flat_codes(self, path, rows=None):
+        """Returns the concatenated values of a multi-valued numeric field for many rows
+        and the number of values in each row (for vectorized filtering)."""
+        offsets = self.offsets[path]
+        if rows is None:
+            return self.columns[path], np.diff(offsets)
+        rows = np.asarray(rows, dtype=np.int64)
+        starts, ends = offsets[rows], offsets[rows + 1]
+        lengths = ends - starts
+        index = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        return self.columns[path][np.arange(lengths.sum()) + index], lengths
+
+    def record(self, row):
+        """Rebuilds the Annotations object for one row."""
+        annotations = self.factory()
+        for path, kind in FIELDS:
+            column = self.columns[path]
+            if kind == 'string':
+                value = self.tables[path].strings[column[row]] if column[row] >= 0 else None
+                set_field(annotations, path, value)
+            elif kind == 'code':
+                set_field(annotations, path, int(column[row]))
+            else:
+                start, end = self.offsets[path][row], self.offsets[path][row + 1]
+                if kind == 'strings':
+                    set_field(annotations, path, self.tables[path].decode(column[start:end]))
+                else:
+                    set_field(annotations, path,
+                              array.array(TYPECODES[kind], column[start:end].tolist()))
+        annotations.groups = set(self.group_table.strings[self.groups[row]])
+        return annotations
+
+    def records(self):
+        """Rebuilds the Annotations objects for all rows."""
+        return [self.record(row) for row in range(self.rows)]
+
+    def nbytes(self):
+        """Approximate size of the NumPy arrays (string tables not included)."""
+        arrays = list(self.columns.values()) + list(self.offsets.values()) + [self.groups]
+        return sum(x.nbytes for x in arrays)
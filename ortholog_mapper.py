@@ -0,0 +1,227 @@
+"""ortholog_mapper.py - alignment-free ortholog mapping using shared k-mers.
+
+Maps protein sequences from a query FASTA file (e.g. a non-model organism) to the
+most similar Swiss-Prot sequences from a parsed DAT file without running BLAST.
+Every reference sequence is broken into overlapping k-mers (on a reduced amino
+acid alphabet by default so that conservative substitutions still match) and an
+inverted index from k-mer code to reference sequence is built with NumPy arrays.
+Each query is scored by counting the k-mers it shares with every reference with
+one vectorized gather and bincount. The results have the same columns as the
+BLAST map summary files (query_acc, hit_acc, hit_desc, blast_scores, match_status)
+so they can be used in place of a BLAST mapping.
+
+Sequences that are identical to a reference sequence (common for RefSeq or Ensembl
+proteins from human or mouse) can be matched first by sequence digest so that
+only the remainder need k-mer (or BLAST) mapping.
+
+Shared k-mer counts are not alignments. Close orthologs (roughly 70% identity and
+up) map reliably; more distant relationships may not be found and should be run
+through BLAST.
+
+The MIT License (MIT)
+
+Copyright (c) 2019 Phillip A. Wilmarth, OHSU
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import numpy as np
+
+from add_uniprot_annotations import sequence_digest   # (same digest as the DAT file sequences)
+
+# amino acid groupings for k-mer encoding (letters in a group are equivalent)
+ALPHABETS = {'full': ['A', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'K', 'L',
+                      'M', 'N', 'P', 'Q', 'R', 'S', 'T', 'V', 'W', 'Y'],
+             'murphy10': ['LVIM', 'C', 'A', 'G', 'ST', 'P', 'FYW', 'EDNQ', 'KR', 'H']}
+
+BRIEF_COLUMNS = ['query_acc', 'hit_acc', 'hit_desc', 'blast_scores', 'match_status']
+
+
+def read_fasta(fasta_file):
+    """Generator of (accession, description, sequence) tuples from a FASTA file."""
+    header, seq_lines = None, []
+    for line in open(fasta_file, 'r'):
+        line = line.strip()
+        if line.startswith('>'):
+            if header is not None:
+                yield header.split()[0], ' '.join(header.split()[1:]), ''.join(seq_lines)
+            header, seq_lines = line[1:], []
+        elif line:
+            seq_lines.append(line)
+    if header is not None:
+        yield header.split()[0], ' '.join(header.split()[1:]), ''.join(seq_lines)
+
+def map_exact(records, digests):
+    """Maps query sequences that are identical to a reference sequence.
+    records: iterable of (accession, description, sequence) tuples
+    digests: dictionary of sequence digest -> (reference accession, description)
+    Returns a list of rows for the matches (see BRIEF_COLUMNS) and a list of
+    the unmatched records."""
+    rows, unmatched = [], []
+    for acc, desc, seq in records:
+        try:
+            hit_acc, hit_desc = digests[sequence_digest(seq)]
+        except KeyError:
+            unmatched.append((acc, desc, seq))
+            continue
+        scores = 'identical query:%d hit:%d' % (len(seq), len(seq))
+        rows.append([acc, hit_acc, hit_desc, scores, 'OK'])
+    return rows, unmatched
+
+def write_fasta(records, fasta_file):
+    """Writes (accession, description, sequence) tuples to a FASTA file."""
+    with open(fasta_file, 'w') as fout:
+        for acc, desc, seq in records:
+            print(('>%s %s' % (acc, desc)).rstrip(), file=fout)
+            for i in range(0, len(seq), 60):
+                print(seq[i:i+60], file=fout)
+    return
+
+class KmerIndex:
+    """Inverted index from amino acid k-mers to reference sequences."""
+
+    def __init__(self, k=6, alphabet='murphy10', max_postings=2000):
+        """k: k-mer length
+        alphabet: key in ALPHABETS
+        max_postings: k-mers found in more references than this are ignored (low complexity)"""
+        self.k = k
+        self.alphabet = alphabet
+        self.max_postings = max_postings
+        self.size = len(ALPHABETS[alphabet])
+        self.encoder = np.full(256, -1, dtype=np.int64)    # byte value -> letter group
+        for code, group in enumerate(ALPHABETS[alphabet]):
+            for aa in group:
+                self.encoder[ord(aa)] = code
+        self.offsets = None         # start of each k-mer code in postings
+        self.postings = None        # reference numbers sorted by k-mer code
+        self.ref_kmers = None       # number of distinct k-mers in each reference
+        self.ref_lengths = None     # reference sequence lengths
+        self.accessions = []        # reference accessions (FASTA style)
+        self.descriptions = []      # reference descriptions
+        return
+
+    def kmer_codes(self, sequence):
+        """Returns the sorted distinct k-mer codes of a sequence (any letter case)."""
+        sequence = sequence.upper()     # (soft-masked FASTA files use lower case)
+        letters = self.encoder[np.frombuffer(sequence.encode('ascii', 'replace'), dtype=np.uint8)]
+        n = len(letters) - self.k + 1
+        if n < 1:
+            return np.zeros(0, dtype=np.int64)
+        codes = np.zeros(n, dtype=np.int64)
+        bad = np.zeros(n, dtype=bool)
+        for j in range(self.k):
+            window = letters[j:j + n]
+            codes = codes * self.size + window
+            bad |= window < 0   # skip k-mers with X, B, Z, U, etc.
+        return np.unique(codes[~bad])
+
+    def build(self, accessions, descriptions, sequences):
+        """Builds the index from lists of reference accessions, descriptions and sequences."""
+        self.accessions = list(accessions)
+        self.descriptions = list(descriptions)
+        code_list = [self.kmer_codes(seq) for seq in sequences]
+        self.ref_kmers = np.array([len(x) for x in code_list], dtype=np.int64)
+        self.ref_lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+        codes = np.concatenate(code_list) if code_list else np.zeros(0, dtype=np.int64)
+        refs = np.repeat(np.arange(len(code_list), dtype=np.int32), self.ref_kmers)
+        order = np.argsort(codes, kind='stable')
+        self.postings = refs[order]
+        counts = np.bincount(codes, minlength=self.size ** self.k)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        return
+
+    def save(self, file_name):
+        """Saves the index arrays to a NumPy .npz file."""
+        np.savez(file_name, k=self.k, alphabet=self.alphabet, max_postings=self.max_postings,
+                 offsets=self.offsets, postings=self.postings, ref_kmers=self.ref_kmers,
+                 ref_lengths=self.ref_lengths, accessions=np.array(self.accessions),
+                 descriptions=np.array(self.descriptions))
+        return
+
+    @classmethod
+    def load(cls, file_name):
+        """Returns a KmerIndex loaded from a .npz file."""
+        with np.load(file_name) as arrays:
+            index = cls(int(arrays['k']), str(arrays['alphabet']), int(arrays['max_postings']))
+            index.offsets = arrays['offsets']
+            index.postings = arrays['postings']
+            index.ref_kmers = arrays['ref_kmers']
+            index.ref_lengths = arrays['ref_lengths']
+            index.accessions = [str(x) for x in arrays['accessions']]
+            index.descriptions = [str(x) for x in arrays['descriptions']]
+        return index
+
+    def shared_kmers(self, sequence):
+        """Returns the number of distinct query k-mers and an array of shared
+        k-mer counts for every reference sequence."""
+        codes = self.kmer_codes(sequence)
+        starts = self.offsets[codes]
+        lengths = self.offsets[codes + 1] - starts
+        keep = lengths <= self.max_postings
+        starts, lengths = starts[keep], lengths[keep]
+
+        # gather all posting list slices at once
+        total = lengths.sum()
+        if total == 0:
+            return len(codes), np.zeros(len(self.accessions), dtype=np.int64)
+        shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        hits = self.postings[np.arange(total) + shifts]
+        return len(codes), np.bincount(hits, minlength=len(self.accessions))
+
+    def best_hit(self, sequence):
+        """Finds the best matching reference for a query sequence.
+        Returns (reference number, shared k-mers, query k-mers, similarity) or None."""
+        query_kmers, shared = self.shared_kmers(sequence)
+        if query_kmers == 0 or not shared.any():
+            return None
+        # fraction of the smaller sequence's k-mers that are shared
+        containment = shared / np.maximum(np.minimum(self.ref_kmers, query_kmers), 1)
+        best = int(np.argmax(containment * np.sqrt(shared)))    # favor longer shared stretches
+        similarity = containment[best] ** (1.0 / self.k)        # rough per-residue similarity
+        return best, int(shared[best]), query_kmers, float(similarity)
+
+    def map_fasta(self, fasta_file, cutoff=0.5, min_shared=8):
+        """Maps every query sequence in a FASTA file to its best reference.
+        Returns a list of rows in BLAST map summary order (see BRIEF_COLUMNS)."""
+        return self.map_sequences(read_fasta(fasta_file), cutoff, min_shared)
+
+    def map_sequences(self, records, cutoff=0.5, min_shared=8):
+        """Maps (accession, description, sequence) tuples to their best references.
+        Returns a list of rows in BLAST map summary order (see BRIEF_COLUMNS)."""
+        rows = []
+        for acc, desc, seq in records:
+            hit = self.best_hit(seq)
+            if hit is None or hit[1] < min_shared:
+                shared = hit[1] if hit else 0
+                rows.append([acc, 'NA', 'NA', 'kmers:%d query:%d' % (shared, len(seq)), 'No_match'])
+                continue
+            best, shared, query_kmers, similarity = hit
+            hit_len = int(self.ref_lengths[best])
+            scores = 'kmers:%d/%d query:%d hit:%d sim:%.1f' % (shared, query_kmers, len(seq),
+                                                             hit_len, 100 * similarity)
+            if similarity < cutoff:
+                status = 'Poor_match'
+            elif len(seq) < 0.5 * hit_len:
+                status = 'Partial_match_query'
+            elif hit_len < 0.5 * len(seq):
+                status = 'Partial_match_hit'
+            else:
+                status = 'OK'
+            rows.append([acc, self.accessions[best], self.descriptions[best], scores, status])
+        return rows
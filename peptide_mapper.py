@@ -0,0 +1,141 @@
+"""peptide_mapper.py - finds the proteins that contain peptide sequences.
+
+Matches lists of identified peptides to the Swiss-Prot sequences from a parsed DAT
+file. All reference sequences are concatenated (with separators) into one string
+with I and L made equivalent. Every position in the string is encoded by the
+residues that start there (a fixed depth prefix of the suffix) and the positions
+are sorted by that code, giving a depth-limited suffix array in NumPy arrays.
+A peptide is found with one binary search (vectorized over all peptides) and any
+peptide longer than the prefix depth is verified against the sequence string.
+The index is built once and cached with the other parsed DAT file results.
+
+The MIT License (MIT)
+
+Copyright (c) 2019 Phillip A. Wilmarth, OHSU
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import re
+
+import numpy as np
+
+DEPTH = 8       # number of residues in the sorted prefix codes
+BASE = 27       # separator (0) plus 26 letters
+
+
+def clean_peptide(peptide):
+    """Returns the upper case residues of a peptide string with I changed to L.
+    Flanking residues (K.PEPTIDE.R) and modification symbols are removed."""
+    peptide = peptide.strip()
+    if peptide.count('.') >= 2:
+        peptide = peptide.split('.')[1]
+    return re.sub('[^A-Z]', '', peptide.upper()).replace('I', 'L')
+
+class PeptideIndex:
+    """Depth-limited suffix array over concatenated reference sequences."""
+
+    def __init__(self):
+        """Basic constructor."""
+        self.text = ''          # concatenated sequences ("-" separators, I changed to L)
+        self.starts = None      # starting position of each reference sequence in text
+        self.positions = None   # text positions sorted by prefix code
+        self.codes = None       # sorted prefix codes
+        self.accessions = []    # reference accessions (FASTA style)
+        return
+
+    def _encode(self, text):
+        """Returns the array of letter codes (separator is 0) for a string."""
+        letters = np.frombuffer(text.encode('ascii', 'replace'), dtype=np.uint8).astype(np.int64)
+        return np.where((letters >= 65) & (letters <= 90), letters - 64, 0)
+
+    def build(self, accessions, sequences):
+        """Builds the index from lists of reference accessions and sequences."""
+        self.accessions = list(accessions)
+        sequences = [seq.upper().replace('I', 'L') for seq in sequences]
+        self.text = '-'.join(sequences) + '-'
+        lengths = np.array([len(seq) + 1 for seq in sequences], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+        # prefix code of the DEPTH residues starting at every position
+        letters = np.concatenate([self._encode(self.text), np.zeros(DEPTH, dtype=np.int64)])
+        n = len(self.text)
+        codes = np.zeros(n, dtype=np.int64)
+        for j in range(DEPTH):
+            codes = codes * BASE + letters[j:j + n]
+        keep = letters[:n] > 0  # no suffixes starting on a separator
+        positions = np.arange(n, dtype=np.int64)[keep]
+        codes = codes[keep]
+        order = np.argsort(codes, kind='stable')
+        self.positions = positions[order]
+        self.codes = codes[order]
+        return
+
+    def save(self, file_name):
+        """Saves the index arrays to a NumPy .npz file."""
+        np.savez(file_name, text=np.frombuffer(self.text.encode('ascii'), dtype=np.uint8),
+                 starts=self.starts, positions=self.positions, codes=self.codes,
+                 accessions=np.array(self.accessions))
+        return
+
+    @classmethod
+    def load(cls, file_name):
+        """Returns a PeptideIndex loaded from a .npz file."""
+        index = cls()
+        with np.load(file_name) as arrays:
+            index.text = arrays['text'].tobytes().decode('ascii')
+            index.starts = arrays['starts']
+            index.positions = arrays['positions']
+            index.codes = arrays['codes']
+            index.accessions = [str(x) for x in arrays['accessions']]
+        return index
+
+    def _code_range(self, peptides):
+        """Returns arrays of low and high prefix codes for a list of cleaned peptides."""
+        low = np.zeros(len(peptides), dtype=np.int64)
+        high = np.zeros(len(peptides), dtype=np.int64)
+        for i, peptide in enumerate(peptides):
+            letters = [ord(x) - 64 for x in peptide[:DEPTH]]
+            pad = DEPTH - len(letters)
+            code = 0
+            for letter in letters:
+                code = code * BASE + letter
+            low[i] = code * BASE ** pad
+            high[i] = (code + 1) * BASE ** pad  # any suffix letters allowed past the peptide end
+        return low, high
+
+    def match(self, peptides):
+        """Finds the references that contain each peptide.
+        Returns a list (same order as peptides) of sorted lists of reference numbers."""
+        cleaned = [clean_peptide(x) for x in peptides]
+        low, high = self._code_range(cleaned)
+        first = np.searchsorted(self.codes, low, side='left')
+        last = np.searchsorted(self.codes, high, side='left')
+        matches = []
+        for peptide, i, j in zip(cleaned, first, last):
+            if not peptide:
+                matches.append([])
+                continue
+            positions = self.positions[i:j]
+            if len(peptide) > DEPTH:   # check the rest of longer peptides
+                positions = [pos for pos in positions
+                             if self.text.startswith(peptide, int(pos))]
+            refs = np.searchsorted(self.starts, positions, side='right') - 1
+            matches.append(sorted(set(int(x) for x in refs)))
+        return matches
@@ -0,0 +1,105 @@
+"""protein_properties.py - sequence-derived protein properties computed with NumPy.
+
+Computes length, average molecular weight, isoelectric point, and GRAVY
+(Kyte-Doolittle grand average of hydropathy) for many sequences at once. All
+sequences are turned into one matrix of residue counts (proteins by letters) so
+the masses and hydropathy are matrix products with per-residue weight vectors,
+and the pI is found by bisection on the net charge of all proteins together.
+
+The MIT License (MIT)
+
+Copyright (c) 2019 Phillip A. Wilmarth, OHSU
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import numpy as np
+
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# average residue masses (B, Z, and X are averages)
+AVERAGE_MASSES = {'A': 71.0788, 'B': 114.5962, 'C': 103.1388, 'D': 115.0886, 'E': 129.1155,
+                  'F': 147.1766, 'G': 57.0519, 'H': 137.1411, 'I': 113.1594, 'J': 113.1594,
+                  'K': 128.1741, 'L': 113.1594, 'M': 131.1926, 'N': 114.1038, 'O': 237.3018,
+                  'P': 97.1167, 'Q': 128.1307, 'R': 156.1875, 'S': 87.0782, 'T': 101.1051,
+                  'U': 150.0388, 'V': 99.1326, 'W': 186.2132, 'X': 110.0, 'Y': 163.1760,
+                  'Z': 128.6231}
+WATER = 18.01524
+
+# Kyte-Doolittle hydropathy values
+HYDROPATHY = {'A': 1.8, 'R': -4.5, 'N': -3.5, 'D': -3.5, 'C': 2.5, 'Q': -3.5, 'E': -3.5,
+              'G': -0.4, 'H': -3.2, 'I': 4.5, 'L': 3.8, 'K': -3.9, 'M': 1.9, 'F': 2.8,
+              'P': -1.6, 'S': -0.8, 'T': -0.7, 'W': -0.9, 'Y': -1.3, 'V': 4.2}
+
+# side chain and terminal pKa values (EMBOSS)
+PKA_POSITIVE = {'K': 10.8, 'R': 12.5, 'H': 6.5}
+PKA_NEGATIVE = {'D': 3.9, 'E': 4.1, 'C': 8.5, 'Y': 10.1}
+PKA_N_TERM = 8.6
+PKA_C_TERM = 3.6
+
+
+def _weights(table):
+    """Makes a weight vector in LETTERS order from a dictionary (missing letters are 0)."""
+    return np.array([table.get(x, 0.0) for x in LETTERS])
+
+def residue_counts(sequences):
+    """Returns a (number of sequences) x 26 matrix of residue counts."""
+    sequences = [seq.upper() for seq in sequences]
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    letters = np.frombuffer(''.join(sequences).encode('ascii', 'replace'), dtype=np.uint8)
+    letters = letters.astype(np.int64) - ord('A')
+    rows = np.repeat(np.arange(len(sequences), dtype=np.int64), lengths)
+    keep = (letters >= 0) & (letters < 26)
+    flat = np.bincount(rows[keep] * 26 + letters[keep], minlength=len(sequences) * 26)
+    return flat.reshape(len(sequences), 26)
+
+def net_charge(counts, pH):
+    """Net charge of every protein (rows of counts) at pH (scalar or array of one per row)."""
+    pH = np.asarray(pH, dtype=float).reshape(-1, 1)
+    pos_pka = np.array(list(PKA_POSITIVE.values()))
+    neg_pka = np.array(list(PKA_NEGATIVE.values()))
+    pos_counts = counts[:, [LETTERS.index(x) for x in PKA_POSITIVE]]
+    neg_counts = counts[:, [LETTERS.index(x) for x in PKA_NEGATIVE]]
+    positive = (pos_counts / (1.0 + 10.0 ** (pH - pos_pka))).sum(axis=1)
+    negative = (neg_counts / (1.0 + 10.0 ** (neg_pka - pH))).sum(axis=1)
+    pH = pH[:, 0]
+    termini = 1.0 / (1.0 + 10.0 ** (pH - PKA_N_TERM)) - 1.0 / (1.0 + 10.0 ** (PKA_C_TERM - pH))
+    return positive - negative + termini
+
+def isoelectric_points(counts, tolerance=0.001):
+    """Finds the pH of zero net charge for all proteins at once by bisection."""
+    low = np.zeros(len(counts))
+    high = np.full(len(counts), 14.0)
+    while (high - low).max(initial=0.0) > tolerance:
+        middle = (low + high) / 2.0
+        positive = net_charge(counts, middle) > 0
+        low = np.where(positive, middle, low)     # still positive: pI is higher
+        high = np.where(positive, high, middle)
+    return (low + high) / 2.0
+
+def compute_properties(sequences):
+    """Computes properties for a list of sequences (empty sequences give NaN values).
+    Returns a dictionary of arrays: length, mass, pI, and GRAVY."""
+    counts = residue_counts(sequences)
+    lengths = counts.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mass = np.where(lengths > 0, counts @ _weights(AVERAGE_MASSES) + WATER, np.nan)
+        gravy = np.where(lengths > 0, (counts @ _weights(HYDROPATHY)) / lengths, np.nan)
+    pi = np.where(lengths > 0, isoelectric_points(counts), np.nan)
+    return {'length': lengths, 'mass': mass, 'pI': pi, 'GRAVY': gravy}
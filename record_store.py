@@ -0,0 +1,215 @@
+"""record_store.py - disk-backed store of DAT file records with a bounded memory cache.
+
+In the "disk" store layout the records of a DAT file are kept in one file in the
+parse cache folder (each record zlib compressed) and only small indexes of lookup
+key -> record position are loaded. Records are parsed into Annotations objects
+when they are looked up and kept in a least recently used cache with a memory
+budget, so the memory used by a session stays about the same no matter how big
+the DAT file is. Several sessions on one computer share the record file.
+
+The MIT License (MIT)
+
+Copyright (c) 2019 Phillip A. Wilmarth, OHSU
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import array
+import collections
+import os
+import sys
+import zlib
+
+
+def approximate_size(obj, seen=None):
+    """Returns the approximate memory used by an object and everything it holds (bytes).
+    Objects reached more than once are only counted once."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, array.array)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approximate_size(x, seen) for x in obj.values())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(x, seen) for x in obj)
+    elif hasattr(obj, '__dict__'):
+        size += approximate_size(obj.__dict__, seen)
+    return size
+
+class RecordWriter:
+    """Writes compressed records to a record file and keeps their positions."""
+
+    def __init__(self, file_name):
+        """file_name: record file to make (written to a temporary file until closed)"""
+        self.file_name = file_name
+        self.temp_file = file_name + '.%d.tmp' % os.getpid()
+        self.fout = open(self.temp_file, 'wb')
+        self.offset = 0
+        return
+
+    def write(self, lines):
+        """Writes one record (list of lines without the "//" line).
+        Returns the (offset, length) of the record in the file."""
+        data = zlib.compress('\n'.join(lines).encode('utf-8'), 1)
+        self.fout.write(data)
+        position = (self.offset, len(data))
+        self.offset += len(data)
+        return position
+
+    def close(self):
+        """Finishes the record file (other sessions never see partial files)."""
+        self.fout.close()
+        os.replace(self.temp_file, self.file_name)
+        return
+
+class RecordIndex:
+    """Lookup keys and file positions for the records of one species."""
+
+    def __init__(self):
+        """Basic constructor."""
+        self.keys = {}          # lookup key -> row number
+        self.offsets = array.array('q')
+        self.lengths = array.array('l')
+        return
+
+    def add(self, keys, position):
+        """Adds a record with its lookup keys and (offset, length) in the record file."""
+        row = len(self.offsets)
+        for key in keys:
+            self.keys.setdefault(key, row)
+        self.offsets.append(position[0])
+        self.lengths.append(position[1])
+        return
+
+    def __len__(self):
+        """Number of records (not keys)."""
+        return len(self.offsets)
+
+class RecordCache:
+    """Least recently used cache of parsed records with a memory budget.
+    One cache can be shared by the stores of several species (and record files)."""
+
+    def __init__(self, budget_mb=256):
+        """budget_mb: approximate memory limit for the cached records (MB)"""
+        self.budget = int(budget_mb * 2**20)
+        self.entries = collections.OrderedDict()    # (offset, file) -> (record, size)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return
+
+    def get(self, key):
+        """Returns a cached record (None if not cached)."""
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, record):
+        """Adds a record and drops the least recently used ones if over budget."""
+        size = approximate_size(record)
+        self.entries[key] = (record, size)
+        self.size += size
+        while self.size > self.budget and len(self.entries) > 1:
+            old_record, old_size = self.entries.popitem(last=False)[1]
+            self.size -= old_size
+            self.evictions += 1
+        return
+
+    def clear(self):
+        """Drops all cached records (e.g. when more field groups are needed)."""
+        self.entries.clear()
+        self.size = 0
+        return
+
+    def stats(self):
+        """Returns a dictionary of hits, misses, evictions, cached records, and cached MB."""
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'records': len(self.entries), 'cached_mb': round(self.size / 2**20, 2),
+                'budget_mb': round(self.budget / 2**20, 2)}
+
+class DiskStore:
+    """Records of one species read from a record file and parsed when needed.
+    Supports the dictionary operations used for annotation lookups (key in store,
+    store[key])."""
+
+    def __init__(self, file_name, index, parse, cache):
+        """file_name: record file
+        index: RecordIndex of the species
+        parse: function taking a list of record lines and returning an Annotations object
+        cache: RecordCache"""
+        self.file_name = file_name
+        self.index = index
+        self.parse = parse
+        self.cache = cache
+        self.fin = None
+        return
+
+    def _read(self, row):
+        """Reads and parses one record (without caching it)."""
+        if self.fin is None:
+            self.fin = open(self.file_name, 'rb')
+        self.fin.seek(self.index.offsets[row])
+        data = self.fin.read(self.index.lengths[row])
+        return self.parse(zlib.decompress(data).decode('utf-8').split('\n'))
+
+    def record(self, row):
+        """Returns the Annotations object for a row (from the cache if possible)."""
+        key = (self.index.offsets[row], self.file_name)
+        annotations = self.cache.get(key)
+        if annotations is None:
+            annotations = self._read(row)
+            self.cache.put(key, annotations)
+        return annotations
+
+    def __len__(self):
+        """Number of records (not keys)."""
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index.keys
+
+    def __getitem__(self, key):
+        return self.record(self.index.keys[key])
+
+    def get(self, key, default=None):
+        """Returns the Annotations object for a key (or default)."""
+        return self.record(self.index.keys[key]) if key in self.index.keys else default
+
+    def records(self):
+        """Parses all of the records (they are not added to the cache)."""
+        return [self._read(row) for row in range(len(self.index))]
+
+    def close(self):
+        """Closes the record file."""
+        if self.fin is not None:
+            self.fin.close()
+            self.fin = None
+        return
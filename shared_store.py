@@ -0,0 +1,205 @@
+"""shared_store.py - read-only annotation store shared by several processes.
+
+A columnar store (see columnar_store.py) is written once to a flat file: a small
+header followed by the raw bytes of every array. Strings (the string tables and
+the lookup keys) are one UTF-8 byte array plus an offsets array, and the lookup
+keys are sorted by a CRC-32 hash that is found with a binary search, so the file
+has no Python objects or memory addresses in it. Processes that attach to the file map it into
+memory read-only and the NumPy arrays are views of the mapped pages, so the
+operating system keeps one copy of the store no matter how many worker processes
+use it. Attaching takes about the same time for any store size.
+
+The MIT License (MIT)
+
+Copyright (c) 2019 Phillip A. Wilmarth, OHSU
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import mmap
+import os
+import pickle
+import struct
+import zlib
+
+import numpy as np
+
+import columnar_store
+
+MAGIC = b'ANNOFLAT'
+FORMAT_VERSION = 1
+ALIGNMENT = 64      # array start positions are multiples of this
+
+
+class FlatStrings:
+    """Read-only sequence of strings kept as one UTF-8 byte array and an offsets array."""
+
+    def __init__(self, data, offsets):
+        """data: memoryview (or bytes) of the encoded strings
+        offsets: int64 array (string i is data[offsets[i]:offsets[i+1]])"""
+        self.data = data
+        self.offsets = offsets
+        return
+
+    @staticmethod
+    def encode(strings):
+        """Returns the (data, offsets) arrays for a list of strings."""
+        encoded = [x.encode('utf-8') for x in strings]
+        lengths = np.array([len(x) for x in encoded], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        i = int(i)
+        return str(self.data[self.offsets.item(i):self.offsets.item(i + 1)], 'utf-8')
+
+def key_hash(key):
+    """Hash of a lookup key that is the same in every process (unlike hash())."""
+    return zlib.crc32(key.encode('utf-8'))
+
+class FlatKeys:
+    """Read-only mapping of lookup key -> row number with the keys sorted by key_hash
+    (supports the dictionary operations that ColumnarStore uses)."""
+
+    def __init__(self, keys, hashes, rows):
+        """keys: FlatStrings of the keys
+        hashes: sorted uint32 array of the key hashes
+        rows: int32 array of the row of each key"""
+        self.keys = keys
+        self.hashes = hashes
+        self.rows = rows
+        return
+
+    def _position(self, key):
+        """Returns the position of a key (or -1)."""
+        if not isinstance(key, str):
+            return -1
+        code = key_hash(key)
+        i = int(np.searchsorted(self.hashes, code))
+        while i < len(self.hashes) and self.hashes[i] == code:     # (hash collisions)
+            if self.keys[i] == key:
+                return i
+            i += 1
+        return -1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self._position(key) >= 0
+
+    def __getitem__(self, key):
+        i = self._position(key)
+        if i < 0:
+            raise KeyError(key)
+        return int(self.rows[i])
+
+    def get(self, key, default=None):
+        """Returns the row of a key (or default)."""
+        i = self._position(key)
+        return int(self.rows[i]) if i >= 0 else default
+
+def _aligned(size):
+    """Rounds a size up to a multiple of ALIGNMENT."""
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+def _arrays(store):
+    """Returns a dictionary of name -> array for everything in a ColumnarStore."""
+    arrays = {'groups': store.groups}
+    for path, column in store.columns.items():
+        arrays['column:' + path] = column
+    for path, offsets in store.offsets.items():
+        arrays['offsets:' + path] = offsets
+    for path, table in store.tables.items():
+        arrays['strings:' + path], arrays['string_offsets:' + path] = FlatStrings.encode(table.strings)
+    keys = sorted((key_hash(key), key, row) for (key, row) in store.keys.items()
+                  if isinstance(key, str))
+    arrays['keys'], arrays['key_offsets'] = FlatStrings.encode([x[1] for x in keys])
+    arrays['key_hashes'] = np.array([x[0] for x in keys], dtype=np.uint32)
+    arrays['key_rows'] = np.array([x[2] for x in keys], dtype=np.int32)
+    return arrays
+
+def publish(store, file_name, info=None):
+    """Writes a ColumnarStore to a flat file that processes can attach to.
+    info: optional dictionary saved with the store (e.g. taxonomy number and field groups)"""
+    arrays = {name: np.ascontiguousarray(x) for (name, x) in _arrays(store).items()}
+    layout = {}
+    position = 0
+    for name, x in arrays.items():
+        layout[name] = (x.dtype.str, x.shape, position)
+        position += _aligned(x.nbytes)
+    header = pickle.dumps({'version': FORMAT_VERSION, 'arrays': layout, 'rows': store.rows,
+                           'collisions': store.collisions,
+                           'group_strings': store.group_table.strings, 'info': info or {}},
+                          protocol=pickle.HIGHEST_PROTOCOL)
+    start = _aligned(len(MAGIC) + 8 + len(header))
+    temp_file = file_name + '.%d.tmp' % os.getpid()
+    with open(temp_file, 'wb') as fout:
+        fout.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        for name, x in arrays.items():
+            fout.seek(start + layout[name][2])
+            fout.write(x.tobytes())
+        fout.truncate(start + position)
+    os.replace(temp_file, file_name)    # other processes never see partial files
+    return
+
+def attach(file_name, factory):
+    """Maps a published store into memory (read-only, the arrays are not copied).
+    factory: function (or class) returning an empty Annotations object
+    Returns the ColumnarStore and the info dictionary."""
+    with open(file_name, 'rb') as fin:
+        buffer = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError('%s is not a published annotation store' % file_name)
+    header_size = struct.unpack('<Q', buffer[len(MAGIC):len(MAGIC) + 8])[0]
+    header = pickle.loads(buffer[len(MAGIC) + 8:len(MAGIC) + 8 + header_size])
+    if header['version'] != FORMAT_VERSION:
+        raise ValueError('%s was written by a different version' % file_name)
+    start = _aligned(len(MAGIC) + 8 + header_size)
+    arrays = {}
+    for name, (dtype, shape, position) in header['arrays'].items():
+        count = int(np.prod(shape))
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=np.dtype(dtype))
+            continue
+        arrays[name] = np.frombuffer(buffer, dtype=np.dtype(dtype), count=count,
+                                     offset=start + position).reshape(shape)
+
+    store = columnar_store.ColumnarStore(factory)
+    store.rows = header['rows']
+    store.collisions = header['collisions']
+    store.groups = arrays['groups']
+    store.group_table.strings = header['group_strings']
+    store.group_table.freeze()
+    for name, x in arrays.items():
+        kind, sep, path = name.partition(':')
+        if kind == 'column':
+            store.columns[path] = x
+        elif kind == 'offsets':
+            store.offsets[path] = x
+        elif kind == 'strings':
+            table = store.tables[path] = columnar_store.StringTable()
+            table.strings = FlatStrings(memoryview(x), arrays['string_offsets:' + path])
+            table.freeze()
+    store.keys = FlatKeys(FlatStrings(memoryview(arrays['keys']), arrays['key_offsets']),
+                          arrays['key_hashes'], arrays['key_rows'])
+    return store, header['info']
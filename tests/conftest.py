@@ -0,0 +1,43 @@
+"""Shared fixtures: a small synthetic gzipped DAT file and a cache folder.
+The modules are in the repository folder (there is no package to install)."""
+import gzip
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RECORDS = 50    # odd numbers are human, even numbers are mouse
+
+
+def make_record(i):
+    """Returns the lines of a minimal DAT record (record 3 has a secondary accession)."""
+    species, taxid, os_line = (('HUMAN', 9606, 'Homo sapiens (Human).') if i % 2 else
+                               ('MOUSE', 10090, 'Mus musculus (Mouse).'))
+    accessions = 'P%05d; Q%05d;' % (i, i) if i == 3 else 'P%05d;' % i
+    return ['ID   PROT%d_%s             Reviewed;         5 AA.' % (i, species),
+            'AC   %s' % accessions,
+            'DE   RecName: Full=Protein number %d;' % i,
+            'GN   Name=GENE%d;' % i,
+            'OS   %s' % os_line,
+            'OX   NCBI_TaxID=%d;' % taxid,
+            'DR   RefSeq; NP_%06d.1; -.' % i,
+            'KW   3D-structure; Cytoplasm.',
+            'SQ   SEQUENCE   5 AA;  600 MW;  0000000000000000 CRC64;',
+            '     MKVLA',
+            '//']
+
+
+@pytest.fixture
+def dat_file(tmp_path):
+    name = str(tmp_path / 'test.dat.gz')
+    with gzip.open(name, 'wt') as fout:
+        for i in range(1, RECORDS + 1):
+            fout.write('\n'.join(make_record(i)) + '\n')
+    return name
+
+
+@pytest.fixture
+def cache_folder(tmp_path):
+    return str(tmp_path / 'cache')
@@ -0,0 +1,53 @@
+"""Checks of the species partitioned AnnotationStore and its ParseCache."""
+import glob
+import os
+import shutil
+
+import pytest
+
+from add_uniprot_annotations import AnnotationStore, ParseCache
+
+
+@pytest.fixture
+def store(dat_file, cache_folder):
+    store = AnnotationStore(dat_file, ParseCache(cache_folder))
+    store.open('9606', ['keywords'])
+    return store
+
+
+def test_only_selected_species_is_loaded(store):
+    assert store.species_counts == {'9606': 25, '10090': 25}
+    assert sorted(store.partitions) == ['9606']
+    annotations, alias_type = store.lookup('sp|P00003|OLD3_HUMAN')
+    assert (annotations.accession, alias_type) == ('P00003', 'lookup_accession')
+    assert store.lookup('NP_000005.1') == (store.lookup('P00005')[0], 'lookup_xref')
+
+
+def test_misses_do_not_load_other_species(store):
+    assert store.lookup('CONTAMINANT_KERATIN') == (None, None)
+    assert store.lookup('P00002') == (None, None)     # a mouse protein
+    assert sorted(store.partitions) == ['9606']
+    assert store.lookup('P00002', other_species=True)[0].ox == '10090'
+    assert sorted(store.partitions) == ['9606']
+
+
+def test_copies_share_the_cache(store, dat_file, tmp_path):
+    copy = str(tmp_path / 'copy' / 'test.dat.gz')
+    os.makedirs(os.path.dirname(copy))
+    shutil.copy(dat_file, copy)
+    reloaded = AnnotationStore(copy, store.cache)
+    reloaded.open('10090', ['keywords'])
+    assert reloaded.fingerprint == store.fingerprint
+    assert reloaded.run_log.counters['cache_hit'] == 1
+    assert reloaded.lookup('P00002')[0].keywords == ['3D-structure', 'Cytoplasm']
+
+
+def test_removed_species_is_parsed_again(store, cache_folder):
+    for name in glob.glob(os.path.join(cache_folder, '*_species_10090*')):
+        os.remove(name)
+    parsed = store.run_log.counters['records_parsed']
+    store.select('10090')
+    assert sorted(store.partitions) == ['10090']
+    assert store.run_log.counters['records_parsed'] - parsed == 25
+    assert store.lookup('P00004')[0].keywords == ['3D-structure', 'Cytoplasm']
+    assert glob.glob(os.path.join(cache_folder, '*_species_10090.pk'))
@@ -0,0 +1,52 @@
+"""Checks of StreamingJoin scans against a small synthetic gzipped DAT file."""
+import gzip
+
+import add_uniprot_annotations
+from add_uniprot_annotations import StreamingJoin
+from conftest import RECORDS
+
+
+def test_stops_when_everything_is_found(dat_file, cache_folder):
+    joiner = StreamingJoin(dat_file, cache_folder)
+    count, dat_dict, missing = joiner.scan(['P00002', 'sp|P00005|PROT5_HUMAN'])
+    assert count == 2
+    assert missing == []
+    assert joiner.scanned == 5
+    assert dat_dict['sp|P00005|PROT5_HUMAN'].name == 'Protein number 5'
+
+
+def test_accessions_not_found(dat_file, cache_folder):
+    joiner = StreamingJoin(dat_file, cache_folder)
+    count, dat_dict, missing = joiner.scan(['P00004', 'CONTAMINANT_KERATIN'])
+    assert count == 1
+    assert missing == ['CONTAMINANT_KERATIN']
+    assert joiner.scanned == RECORDS
+
+    # a later scan does not read the DAT file again for the missing accession
+    count, dat_dict, missing = StreamingJoin(dat_file, cache_folder).scan(['CONTAMINANT_KERATIN'])
+    assert (count, missing) == (0, ['CONTAMINANT_KERATIN'])
+
+
+def test_subset_cache_is_reused(dat_file, cache_folder, monkeypatch):
+    StreamingJoin(dat_file, cache_folder).scan(['P00007', 'P00009'])
+
+    def no_dat_file(*args, **kwargs):
+        raise AssertionError('DAT file was read again')
+    monkeypatch.setattr(add_uniprot_annotations.fast_gzip, 'read_lines', no_dat_file)
+    joiner = StreamingJoin(dat_file, cache_folder)
+    count, dat_dict, missing = joiner.scan(['P00009', 'P00007'])
+    assert (count, missing) == (2, [])
+    assert joiner.scanned <= 2
+
+    # records are not added to the subset file again
+    monkeypatch.undo()
+    StreamingJoin(dat_file, cache_folder).scan(['P00007', 'P00011'])
+    with gzip.open(joiner.cache_file, 'rt') as fin:
+        assert sum(line.startswith('//') for line in fin) == 3
+
+
+def test_secondary_accession(dat_file, cache_folder):
+    count, dat_dict, missing = StreamingJoin(dat_file, cache_folder).scan(['Q00003'])
+    assert (count, missing) == (1, [])
+    assert dat_dict['Q00003'].accession == 'P00003'
+    assert dat_dict['P00003'] is dat_dict['Q00003']